@@ -0,0 +1,70 @@
+from collections import OrderedDict
+from multiprocessing import Array
+
+import numpy as np
+
+HITS, MISSES, EVICTIONS = range(3)
+
+
+def obs_nbytes(obs):
+    if isinstance(obs, dict):
+        return sum(obs_nbytes(v) for v in obs.values())
+    if isinstance(obs, (list, tuple)):
+        return sum(obs_nbytes(v) for v in obs)
+    if isinstance(obs, np.ndarray):
+        return obs.nbytes
+    return 8
+
+
+class AnchorCache:
+    """
+    LRU cache of the observations many samples of a trajectory are made
+    against (its final step, the initial press), keyed by (file, step) and
+    bounded by the total size of their arrays.
+
+    Every DataLoader worker holds its own entries. The hit, miss and eviction
+    counters are in shared memory, so with forked workers `stats()` in the
+    main process reports the totals over all of them. Pickled copies (e.g.
+    for a Pool) start empty with counters of their own.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.num_bytes = 0
+        self.counters = Array('q', 3)
+
+    def __getstate__(self):
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+
+    def _count(self, counter):
+        with self.counters.get_lock():
+            self.counters[counter] += 1
+
+    def get(self, key):
+        obs = self.entries.get(key)
+        if obs is None:
+            self._count(MISSES)
+            return None
+        self.entries.move_to_end(key)
+        self._count(HITS)
+        return obs
+
+    def put(self, key, obs):
+        size = obs_nbytes(obs)
+        if size > self.max_bytes or key in self.entries:
+            return
+        self.entries[key] = obs
+        self.num_bytes += size
+        while self.num_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.num_bytes -= obs_nbytes(evicted)
+            self._count(EVICTIONS)
+
+    def stats(self):
+        hits, misses, evictions = self.counters[:]
+        return {'hits': hits, 'misses': misses, 'evictions': evictions,
+                'hit_rate': hits / max(hits + misses, 1)}
@@ -3,6 +3,10 @@ import glob
 import deepdish as dd
 import numpy as np
 from multiprocessing import Pool
+from bench_press.utils.columnar import DEFAULT_KEYS, ColumnarTrajectory, is_columnar
+from bench_press.models.datasets.anchor_cache import AnchorCache
+from bench_press.models.datasets.dataset_index import DatasetIndex
+from bench_press.models.datasets.moments import Moments
 
 
 class BaseDataset(Dataset):
@@ -16,9 +20,15 @@ class BaseDataset(Dataset):
         self.folders = conf.folders
         self.transform = transform
         self.h5_files = []
+        self.folder_files = []  # (folder, files found in it)
+        self.trajectories = {}  # Open readers of columnar files, by file name
+        anchor_cache_mb = 256 if conf.anchor_cache_mb is None else conf.anchor_cache_mb
+        self.anchor_cache = AnchorCache(anchor_cache_mb * 2 ** 20) if anchor_cache_mb > 0 else None
         self.norm_keys = ['state', 'label']
         for folder in self.folders:
-            self.h5_files.extend(glob.glob(f'{folder}**/*.h5'))
+            files = glob.glob(f'{folder}**/*.h5')
+            self.folder_files.append((folder, files))
+            self.h5_files.extend(files)
         self.file_lengths = self._get_file_lengths()
         self.total_length = len(self.h5_files)
         print(f'located {len(self.h5_files)} h5 files!')
@@ -29,15 +39,70 @@ class BaseDataset(Dataset):
         pass
 
     @staticmethod
-    def _get_ind_file_len(file):
-        contents = dd.io.load(file)
-        return len(contents) - 1
+    def _get_ind_file_len(num_steps):
+        """
+        :return: number of samples in a rollout of num_steps steps
+        """
+        return num_steps - 1
+
+    def load_steps(self, file_name, steps, anchors=()):
+        """
+        :param anchors: steps among `steps` that many samples of the file share
+            (e.g. its final step). They are kept in the anchor cache and only
+            read from disk the first time.
+        :return: tuple with the observations of the given steps of a rollout,
+            read from either a deepdish log or a columnar file (see utils/columnar.py)
+        """
+        if self.anchor_cache is None or not anchors:
+            return self._read_steps(file_name, steps)
+        cached = {}
+        for step in set(anchors):
+            obs = self.anchor_cache.get((file_name, step))
+            if obs is not None:
+                cached[step] = obs
+        to_read = [step for step in steps if step not in cached]
+        if to_read:
+            for step, obs in zip(to_read, self._read_steps(file_name, to_read)):
+                if step in anchors and step not in cached:
+                    self.anchor_cache.put((file_name, step), obs)
+                cached.setdefault(step, obs)
+        return tuple(cached[step] for step in steps)
+
+    def _read_steps(self, file_name, steps):
+        if file_name not in self.trajectories:
+            self.trajectories[file_name] = ColumnarTrajectory(file_name) if is_columnar(file_name) else None
+        trajectory = self.trajectories[file_name]
+        if trajectory is None:
+            return dd.io.load(file_name, group=[f'/data/i{step}' for step in steps])
+        return trajectory.observations(steps, keys=self.conf.load_keys or DEFAULT_KEYS)
 
     def _get_file_lengths(self):
-        with Pool(self.conf.dataloader_workers) as pool:
-            file_lengths = pool.map(self._get_ind_file_len, self.h5_files)
+        file_lengths = []
+        for folder, files in self.folder_files:
+            index = self._open_index(folder)
+            num_steps = index.update(files, self.conf.dataloader_workers)
+            index.close()
+            file_lengths.extend(self._get_ind_file_len(n) for n in num_steps)
         return file_lengths
 
+    def sample_locations(self, indices):
+        """
+        :param indices: array of sample indices
+        :return: arrays of the file index and step of each sample, by which
+            FileChunkBatchSampler groups samples. By default every sample is
+            in a file of its own.
+        """
+        return indices, np.zeros_like(indices)
+
+    def get_samples(self, indices):
+        """
+        :return: list of the data points of several samples, see FileBatchDataset
+        """
+        return [self[idx] for idx in indices]
+
+    def _open_index(self, folder):
+        return DatasetIndex(folder, self.conf.index_dir, in_folder=bool(self.conf.index_in_folder))
+
     def __len__(self):
         return self.total_length
 
@@ -56,7 +121,66 @@ class BaseDataset(Dataset):
         transformed = self.transform(data_point)
         return transformed
 
+    def statistics_kind(self):
+        """
+        :return: string identifying how the samples of a file are made from its
+            steps, which the moments cached in the dataset index are keyed by.
+            None if the norm keys can not be computed from the index, in which
+            case the statistics are computed from the data points.
+        """
+        return None
+
+    def _sample_columns(self, steps):
+        """
+        :param steps: (num_steps, len(STEP_COLUMNS)) array of a file, from the dataset index
+        :return: dict of norm key -> (num_samples, D) unnormalized values of the samples of the file
+        """
+        raise NotImplementedError
+
+    def sample_table(self):
+        """
+        :return: dict of key -> (N, D) unnormalized values (see _sample_columns)
+            of all samples of the files, in sample index order, read from the
+            dataset index without opening any rollout file
+        """
+        columns = []
+        for folder, files in self.folder_files:
+            index = self._open_index(folder)
+            columns.extend(self._sample_columns(index.steps(f)) for f in files)
+            index.close()
+        return {key: np.concatenate([c[key] for c in columns]) for key in columns[0]}
+
+    def _file_moments(self, steps):
+        return {key: Moments.of(values) for key, values in self._sample_columns(steps).items()}
+
     def compute_dataset_statistics(self):
+        kind = self.statistics_kind()
+        if kind is None:
+            return self._compute_statistics_from_data_points()
+
+        totals = {key: Moments() for key in self.norm_keys}
+        for folder, files in self.folder_files:
+            index = self._open_index(folder)
+            file_moments = {f: index.get_moments(f, kind) for f in files}
+            missing = [f for f, moments in file_moments.items() if moments is None]
+            if missing:
+                with Pool(self.conf.dataloader_workers) as pool:
+                    computed = pool.map(self._file_moments, [index.steps(f) for f in missing], chunksize=64)
+                index.put_moments(dict(zip(missing, computed)), kind)
+                file_moments.update(zip(missing, computed))
+            index.close()
+            for moments in file_moments.values():
+                for key in self.norm_keys:
+                    totals[key].merge(moments[key])
+
+        norms = dict()
+        for key in self.norm_keys:
+            norms[key] = dict()
+            norms[key]['mean'], norms[key]['std'] = totals[key].mean.tolist(), totals[key].std.tolist()
+        print(norms)
+        return norms
+
+    def _compute_statistics_from_data_points(self):
 
         if not self.conf.norms:
             self.conf.norms = dict()
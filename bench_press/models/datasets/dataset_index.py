@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import sqlite3
+from multiprocessing import Pool
+
+import h5py
+import numpy as np
+from bench_press.models.datasets.moments import Moments
+from bench_press.utils.columnar import FORMAT_NAME
+
+INDEX_NAME = 'dataset_index.sqlite'
+# Per-step values recorded in the index, read from the HDF5 attributes of each step
+STEP_COLUMNS = ('x', 'y', 'z', 'force_1', 'force_2', 'force_3', 'force_4', 'dynamixel_state')
+# Columns making up the state vector of obs_to_state
+STATE_COLUMNS = [STEP_COLUMNS.index(k) for k in ('x', 'y', 'z', 'dynamixel_state')]
+
+# Bumped when the schema or STEP_COLUMNS change, older indexes are rebuilt
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    num_steps INTEGER NOT NULL,
+    steps BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS moments (
+    path TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    moments TEXT NOT NULL,
+    PRIMARY KEY (path, kind)
+);
+"""
+
+
+def default_index_dir():
+    """
+    :return: directory dataset indexes are kept in unless configured otherwise, under the user's cache directory
+    """
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'bench_press', 'dataset_index')
+
+
+def _scalar(value):
+    return None if value is None else float(value)
+
+
+def scan_file(path):
+    """
+    Read the step count and per-step metadata of a rollout file without
+    loading any image: for deepdish logs they are the `list:N` title of
+    `/data` and the scalars deepdish stores as attributes of each step group,
+    for columnar files the tb_state and dynamixel_state arrays.
+    :return: (format, num_steps, (num_steps, len(STEP_COLUMNS)) float64 array, NaN where a value was not logged)
+    """
+    with h5py.File(path, 'r') as f:
+        if f.attrs.get('format') == FORMAT_NAME:
+            num_steps = int(f.attrs['num_steps'])
+            tb_state = f['tb_state'][()] if 'tb_state' in f else None
+            dynamixel = f['dynamixel_state'][()] if 'dynamixel_state' in f else None
+            rows = []
+            for step in range(num_steps):
+                row = [_scalar(tb_state[step][k]) if tb_state is not None and k in tb_state.dtype.names else None
+                       for k in STEP_COLUMNS[:-1]]
+                rows.append(tuple(row) + (_scalar(dynamixel[step]) if dynamixel is not None else None,))
+            return FORMAT_NAME, num_steps, np.array(rows, dtype=np.float64).reshape(num_steps, len(STEP_COLUMNS))
+
+        data = f['data']
+        title = data.attrs['TITLE']
+        num_steps = int((title.decode() if isinstance(title, bytes) else title).split(':')[1])
+        rows = []
+        for step in range(num_steps):
+            group = data[f'i{step}']
+            tb_state = group['tb_state'].attrs if 'tb_state' in group else {}
+            row = tuple(_scalar(tb_state.get(k)) for k in STEP_COLUMNS[:-1])
+            rows.append(row + (_scalar(group.attrs.get('dynamixel_state')),))
+        return 'deepdish', num_steps, np.array(rows, dtype=np.float64).reshape(num_steps, len(STEP_COLUMNS))
+
+
+def _scan(args):
+    path, rel_path = args
+    return rel_path, scan_file(path)
+
+
+class DatasetIndex:
+    """
+    Persistent SQLite index of the rollout files in a data folder: size,
+    mtime, format and step count of every file, the per-step metadata in
+    STEP_COLUMNS (stored as one array per file, so that reading the steps of
+    thousands of files stays fast), and the normalization moments of the samples datasets draw
+    from each file. `update` only scans the files that were added or modified
+    since the last call and drops the ones that disappeared, so opening a
+    dataset over an unchanged folder does not read any rollout file.
+
+    Paths are stored relative to the folder, which keeps the index valid when
+    the folder is moved or mounted elsewhere.
+
+    The index is kept in `index_dir` (default_index_dir() by default), named
+    after the folder's absolute path, so data folders are never written to
+    unless `in_folder` asks for the index to live next to the data. If the
+    index cannot be written, it is built in memory for this run only.
+    """
+
+    def __init__(self, folder, index_dir=None, in_folder=False):
+        self.folder = folder
+        if in_folder:
+            self.path = os.path.join(folder, INDEX_NAME)
+        else:
+            index_dir = index_dir or default_index_dir()
+            folder_hash = hashlib.sha1(os.path.abspath(folder).encode()).hexdigest()[:16]
+            self.path = os.path.join(index_dir, f'{folder_hash}_{INDEX_NAME}')
+        self.db = None
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self.db = sqlite3.connect(self.path, timeout=60)
+            self._create()
+        except (sqlite3.Error, OSError) as e:
+            print(f'Cannot write dataset index {self.path} ({e}), keeping it in memory. Set index_dir to persist it.')
+            if self.db is not None:
+                self.db.close()
+            self.path = ':memory:'
+            self.db = sqlite3.connect(self.path)
+            self._create()
+
+    def _create(self):
+        with self.db:
+            if self.db.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+                self.db.executescript('DROP TABLE IF EXISTS files; DROP TABLE IF EXISTS steps; '
+                                      'DROP TABLE IF EXISTS moments;')
+                self.db.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+            self.db.executescript(SCHEMA)
+
+    def update(self, files, workers=1):
+        """
+        :param files: rollout files inside the folder
+        :return: number of steps of each file, in the order of `files`
+        """
+        known = {path: (size, mtime_ns) for path, size, mtime_ns in
+                 self.db.execute('SELECT path, size, mtime_ns FROM files')}
+        rel_paths = [os.path.relpath(f, self.folder) for f in files]
+        stats = {rel_path: os.stat(f) for f, rel_path in zip(files, rel_paths)}
+        changed = [(f, rel_path) for f, rel_path in zip(files, rel_paths)
+                   if known.get(rel_path) != (stats[rel_path].st_size, stats[rel_path].st_mtime_ns)]
+        removed = set(known) - set(rel_paths)
+
+        if changed:
+            print(f'Indexing {len(changed)} new or modified files in {self.folder}...')
+            with Pool(workers or 1) as pool:
+                scanned = pool.map(_scan, changed, chunksize=8)
+        else:
+            scanned = []
+        with self.db:
+            for rel_path in removed | {rel_path for rel_path, _ in scanned}:
+                self.db.execute('DELETE FROM files WHERE path = ?', (rel_path,))
+                self.db.execute('DELETE FROM moments WHERE path = ?', (rel_path,))
+            for rel_path, (file_format, num_steps, steps) in scanned:
+                stat = stats[rel_path]
+                self.db.execute('INSERT INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                                (rel_path, stat.st_size, stat.st_mtime_ns, file_format, num_steps, steps.tobytes()))
+
+        num_steps = dict(self.db.execute('SELECT path, num_steps FROM files'))
+        return [num_steps[rel_path] for rel_path in rel_paths]
+
+    def steps(self, file):
+        """
+        :return: (num_steps, len(STEP_COLUMNS)) float64 array of the metadata of
+            a file, NaN where a value was not logged
+        """
+        blob, = self.db.execute('SELECT steps FROM files WHERE path = ?',
+                                (os.path.relpath(file, self.folder),)).fetchone()
+        return np.frombuffer(blob, dtype=np.float64).reshape(-1, len(STEP_COLUMNS))
+
+    def get_moments(self, file, kind):
+        """
+        :param kind: identifies how samples are made from the steps, see BaseDataset.statistics_kind
+        :return: dict of key -> Moments of the samples of a file, None if not computed yet
+        """
+        row = self.db.execute('SELECT moments FROM moments WHERE path = ? AND kind = ?',
+                              (os.path.relpath(file, self.folder), kind)).fetchone()
+        if row is None:
+            return None
+        return {key: Moments.from_dict(d) for key, d in json.loads(row[0]).items()}
+
+    def put_moments(self, moments_by_file, kind):
+        """
+        :param moments_by_file: dict of file -> dict of key -> Moments
+        """
+        with self.db:
+            self.db.executemany('INSERT OR REPLACE INTO moments VALUES (?, ?, ?)',
+                                [(os.path.relpath(file, self.folder), kind,
+                                  json.dumps({key: m.to_dict() for key, m in moments.items()}))
+                                 for file, moments in moments_by_file.items()])
+
+    def close(self):
+        self.db.close()
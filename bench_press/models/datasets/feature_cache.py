@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import torch
+from bench_press.models.datasets.training_cache import MANIFEST, files_fingerprint
+from torch.utils.data import Dataset
+from tqdm import tqdm
+
+
+def module_fingerprint(module):
+    """
+    :return: hash of the parameters and buffers of a module
+    """
+    digest = hashlib.sha1()
+    for name, tensor in sorted(module.state_dict().items()):
+        digest.update(name.encode())
+        digest.update(tensor.detach().cpu().numpy().tobytes())
+    return digest.hexdigest()[:16]
+
+
+class FeatureStore:
+    """
+    Image encoder features of every sample of a dataset, computed once with
+    frozen encoders and then memory mapped: a float16 array of shape
+    (num_seeds, N, num_cameras, encoder_features), where seed 0 holds the
+    features of the unaugmented images and seeds 1.. those of augmented
+    passes over the dataset, and float32 (N, D) arrays of the other inputs
+    (state, label, ...) of every sample.
+
+    A store lives in `<feature_cache_dir>/<key>`, the key hashing the encoder
+    weights and everything that changes the images they see. Like
+    TrainingCache, it is rebuilt when its source files change.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.num_samples = self.manifest['num_samples']
+        self.num_seeds = self.manifest['num_seeds']
+        self.features = np.load(os.path.join(path, 'features.npy'), mmap_mode='r')
+        self.columns = {key: np.load(os.path.join(path, f'{key}.npy'), mmap_mode='r')
+                        for key in self.manifest['columns']}
+
+    @classmethod
+    def open_or_build(cls, cache_dir, key, files, num_samples, num_seeds, make_batches, encode):
+        """
+        :param files: source files of the dataset
+        :param make_batches: function of a seed returning an iterable over input
+            dicts of all samples of the dataset in order, augmented unless the seed is 0
+        :param encode: function of a list of image batches, one per camera,
+            returning features of shape [B, num_cameras, encoder_features]
+        """
+        path = os.path.join(cache_dir, key)
+        fingerprint = files_fingerprint(files)
+        manifest_file = os.path.join(path, MANIFEST)
+        if os.path.isfile(manifest_file):
+            with open(manifest_file) as f:
+                if json.load(f)['files'] == [list(entry) for entry in fingerprint]:
+                    return cls(path)
+            print(f'Source files changed, rebuilding feature store {path}')
+        cls.build(path, fingerprint, num_samples, num_seeds, make_batches, encode)
+        return cls(path)
+
+    @staticmethod
+    def build(path, fingerprint, num_samples, num_seeds, make_batches, encode):
+        print(f'Encoding {num_seeds} passes over the dataset into {path}...')
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        features, columns = None, {}
+        for seed in range(num_seeds):
+            start = 0
+            for inputs in tqdm(make_batches(seed), desc=f'seed {seed}'):
+                with torch.no_grad():
+                    encoded = encode(inputs['images']).cpu().numpy()
+                end = start + len(encoded)
+                if features is None:
+                    features = np.lib.format.open_memmap(os.path.join(tmp_path, 'features.npy'), mode='w+',
+                                                         dtype=np.float16,
+                                                         shape=(num_seeds, num_samples) + encoded.shape[1:])
+                features[seed, start:end] = encoded
+                if seed == 0:
+                    for key, value in inputs.items():
+                        if key == 'images':
+                            continue
+                        if key not in columns:
+                            columns[key] = np.lib.format.open_memmap(os.path.join(tmp_path, f'{key}.npy'), mode='w+',
+                                                                     dtype=np.float32,
+                                                                     shape=(num_samples,) + tuple(value.shape[1:]))
+                        columns[key][start:end] = value.cpu().numpy()
+                start = end
+            assert start == num_samples, f'Encoded {start} of {num_samples} samples'
+        for array in [features] + list(columns.values()):
+            array.flush()
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+            json.dump({'num_samples': num_samples, 'num_seeds': num_seeds, 'columns': list(columns),
+                       'files': [list(entry) for entry in fingerprint]}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+
+class FeatureBatchDataset(Dataset):
+    """
+    Samples of a FeatureStore, fetched as whole batches by lists of positions
+    (like FileBatchDataset, use with a BatchSampler and `batch_size=None`).
+    Each sample gets the features of one of `seeds`, drawn at random. Batches
+    hold the flattened features under 'features' (see PolicyNetwork.forward)
+    and the stored inputs under their own keys.
+    """
+
+    def __init__(self, store, indices, seeds):
+        self.store = store
+        self.indices = np.asarray(indices)
+        self.seeds = np.asarray(seeds)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, positions):
+        indices = np.sort(self.indices[positions])  # Ascending reads from the memory mapped files
+        seeds = np.random.choice(self.seeds, len(indices))
+        features = self.store.features[seeds, indices].astype(np.float32)
+        batch = {'features': torch.from_numpy(features.reshape(len(indices), -1))}
+        for key, column in self.store.columns.items():
+            batch[key] = torch.from_numpy(np.ascontiguousarray(column[indices]))
+        return batch
@@ -1,20 +1,37 @@
-from bench_press.utils.obs_to_np import denormalize
+from abc import ABC, abstractmethod
 
+import numpy as np
 
-class InsertFilter:
 
-    def __call__(self, datapoint, conf):
-        state = datapoint['state']
-        denormalized_state = denormalize(state, conf.norms.state_norm.mean, conf.norms.state_norm.scale)
-        if denormalized_state[0] <= 5000 and denormalized_state[2] < 500:
-            return True
-        return False
+class ColumnFilter(ABC):
+    """
+    Filter for TBDatasetSubset evaluated on all samples at once: called with
+    a dict of unnormalized (N, D) 'state' and 'label' arrays of every sample
+    (BaseDataset.sample_table) and the dataset config, it returns a boolean
+    mask of the samples to keep. Attributes set in __init__ are part of the
+    key the resulting indices are cached under.
+    """
 
-class PatternInsertFilter:
+    @abstractmethod
+    def __call__(self, columns, conf):
+        pass
 
-    def __call__(self, datapoint, conf):
-        state = datapoint['state']
-        denormalized_state = denormalize(state, conf.norms.state_norm.mean, conf.norms.state_norm.scale)
-        if denormalized_state[0] <= 5000 and denormalized_state[2] < 500:
-            return True
-        return False
+
+class KeepAllFilter(ColumnFilter):
+
+    def __call__(self, columns, conf):
+        return np.ones(len(columns['state']), dtype=bool)
+
+
+class InsertFilter(ColumnFilter):
+
+    def __call__(self, columns, conf):
+        state = columns['state']
+        return (state[:, 0] <= 5000) & (state[:, 2] < 500)
+
+
+class PatternInsertFilter(ColumnFilter):
+
+    def __call__(self, columns, conf):
+        state = columns['state']
+        return (state[:, 0] <= 5000) & (state[:, 2] < 500)
@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class Moments:
+    """
+    Count, mean and sum of squared deviations (M2) of a set of vectors,
+    updated in one pass. Partial moments of disjoint shards combine exactly
+    with `merge` (Chan et al.'s parallel form of Welford's algorithm), so
+    they can be computed in separate workers, or cached per file, and
+    merged afterwards.
+    """
+
+    def __init__(self, count=0, mean=None, m2=None):
+        self.count = count
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float64)
+        self.m2 = None if m2 is None else np.asarray(m2, dtype=np.float64)
+
+    @classmethod
+    def of(cls, x):
+        """
+        :param x: (N, D) array
+        """
+        x = np.asarray(x, dtype=np.float64)
+        if len(x) == 0:
+            return cls()
+        mean = x.mean(axis=0)
+        return cls(len(x), mean, ((x - mean) ** 2).sum(axis=0))
+
+    def update(self, x):
+        self.merge(Moments.of(x))
+        return self
+
+    def merge(self, other):
+        if other.count == 0:
+            return self
+        if self.count == 0:
+            self.count, self.mean, self.m2 = other.count, other.mean.copy(), other.m2.copy()
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean = self.mean + delta * other.count / count
+        self.m2 = self.m2 + other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        return self
+
+    @property
+    def std(self):
+        # Population standard deviation, as np.std computes it
+        return np.sqrt(self.m2 / self.count)
+
+    def to_dict(self):
+        if self.count == 0:
+            return {'count': 0, 'mean': None, 'm2': None}
+        return {'count': self.count, 'mean': self.mean.tolist(), 'm2': self.m2.tolist()}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['count'], d['mean'], d['m2'])
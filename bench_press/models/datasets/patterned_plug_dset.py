@@ -1,5 +1,7 @@
-import deepdish as dd
+from bench_press.models.datasets.base_dataset import BaseDataset
+from bench_press.models.datasets.dataset_index import STATE_COLUMNS
 from bench_press.models.datasets.tb_dataset import TBDataset
+from bench_press.utils.obs_to_np import states_to_actions
 
 
 class PatternPlugDataset(TBDataset):
@@ -9,15 +11,27 @@ class PatternPlugDataset(TBDataset):
 
     def setup(self):
         self.total_length = len(self.h5_files)
+        # One sample per file, so its press and final steps are never read twice
+        self.anchor_cache = None
+
+    def _sample_columns(self, steps):
+        state = steps[:, STATE_COLUMNS]
+        pt, final = state[[6]], state[[self._get_ind_file_len(len(steps)) - 1]]
+        return {'state': pt, 'label': states_to_actions(pt, final)}
+
+    # One sample per file: nothing to group, every sample reads its own file
+    sample_locations = BaseDataset.sample_locations
+    get_samples = BaseDataset.get_samples
 
     def __len__(self):
         return self.total_length
 
     def __getitem__(self, idx):
         file_name = self.h5_files[idx]
-        press, pt, final = dd.io.load(file_name, group=[f'/data/i2', '/data/i6', f'/data/i{self.file_lengths[idx]-1}'])
-        pt['raw_images']['gelsight_top'] = press['raw_images']['gelsight_top'] 
-        pt['images']['gelsight_top'] = press['images']['gelsight_top'] 
+        press, pt, final = self.load_steps(file_name, [2, 6, self.file_lengths[idx] - 1])
+        if 'raw_images' in pt:
+            pt['raw_images']['gelsight_top'] = press['raw_images']['gelsight_top']
+        pt['images']['gelsight_top'] = press['images']['gelsight_top']
 
         return self._make_data_point(pt, final)
 
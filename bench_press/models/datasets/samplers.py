@@ -0,0 +1,71 @@
+import numpy as np
+from torch.utils.data import Dataset, Sampler
+from torch.utils.data.dataloader import default_collate
+
+
+class FileChunkBatchSampler(Sampler):
+    """
+    Batch sampler over a Subset (as made by random_split) of a dataset that
+    keeps batches local to few files. The samples of every file are cut into
+    chunks of `chunk_steps` consecutive steps; chunks are visited in random
+    order and their samples pushed into a shuffle buffer of `shuffle_buffer`
+    samples, from which batches are drawn at random.
+
+    A batch therefore spans about shuffle_buffer / chunk_steps chunks. Small
+    buffers and long chunks mean few files and contiguous steps per batch,
+    a buffer at least as large as the subset is a uniform shuffle.
+    """
+
+    def __init__(self, subset, batch_size, chunk_steps=16, shuffle_buffer=1024, drop_last=False):
+        self.subset = subset
+        self.batch_size = batch_size
+        self.chunk_steps = chunk_steps
+        self.shuffle_buffer = max(shuffle_buffer or len(subset), batch_size)
+        self.drop_last = drop_last
+        file_indices, steps = subset.dataset.sample_locations(np.asarray(subset.indices))
+        chunk_ids = file_indices.astype(np.int64) * (int(steps.max(initial=0)) // chunk_steps + 1) + steps // chunk_steps
+        order = np.argsort(chunk_ids, kind='stable')
+        boundaries = np.flatnonzero(np.diff(chunk_ids[order])) + 1
+        self.chunks = np.split(order, boundaries)  # Positions in the subset, by chunk
+
+    def __iter__(self):
+        buffer = []
+        for chunk in np.random.permutation(len(self.chunks)):
+            buffer.extend(self.chunks[chunk])
+            while len(buffer) >= self.shuffle_buffer:
+                yield self._draw(buffer)
+        np.random.shuffle(buffer)
+        while len(buffer) >= self.batch_size or (buffer and not self.drop_last):
+            yield self._draw(buffer)
+
+    def _draw(self, buffer):
+        picks = np.random.choice(len(buffer), min(self.batch_size, len(buffer)), replace=False)
+        batch = [buffer[i] for i in picks]
+        for i in sorted(picks, reverse=True):
+            buffer[i] = buffer[-1]
+            buffer.pop()
+        return sorted(batch)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.subset) // self.batch_size
+        return (len(self.subset) + self.batch_size - 1) // self.batch_size
+
+
+class FileBatchDataset(Dataset):
+    """
+    Wraps a Subset so that DataLoader workers fetch whole batches, indexed by
+    the lists of positions FileChunkBatchSampler yields: the dataset's
+    `get_samples` reads the steps a batch needs from each file in one call.
+    Use with `sampler=FileChunkBatchSampler(...)` and `batch_size=None`.
+    """
+
+    def __init__(self, subset):
+        self.subset = subset
+
+    def __len__(self):
+        return len(self.subset)
+
+    def __getitem__(self, positions):
+        indices = [self.subset.indices[p] for p in positions]
+        return default_collate(self.subset.dataset.get_samples(indices))
@@ -6,6 +6,7 @@ import bisect
 import copy
 from bench_press.utils.obs_to_np import *
 from bench_press.models.datasets.tb_dataset import TBDataset
+from bench_press.models.datasets.dataset_index import STATE_COLUMNS
 
 
 class StateEstimationDataset(TBDataset):
@@ -14,19 +15,28 @@ class StateEstimationDataset(TBDataset):
     Perform state estimation from data collected using random pressing policy
     """
 
+    # Samples have no label observation and use norms.state_norm, which raw_sample and the cache do not know
+    supports_training_cache = False
+
     def __init__(self, conf, transform=None):
         super(StateEstimationDataset, self).__init__(conf, transform)
 
     @staticmethod
-    def _get_ind_file_len(f):
-        contents = dd.io.load(f)
-        return (len(contents) - 2) // 2
-
-    def __getitem__(self, idx):
-        file_name, sub_index = self.compute_file_and_offset(idx)
-        contents = dd.io.load(file_name, group=[f'/data/i{2*sub_index + 2}'])
-        data_point = self._make_data_point(contents[0])
-        return data_point
+    def _get_ind_file_len(num_steps):
+        return (num_steps - 2) // 2
+
+    def _sample_columns(self, steps):
+        state = steps[2:2 + 2 * self._get_ind_file_len(len(steps)):2][:, STATE_COLUMNS]
+        return {'state': state, 'label': state}
+
+    def _sample_steps(self, sub_index, final_index):
+        return [2 * sub_index + 2]
+
+    def _anchor_steps(self, final_index):
+        return []
+
+    def _assemble_obs(self, contents):
+        return contents[0],
 
     def _make_data_point(self, obs_1):
         images = obs_to_images(obs_1)
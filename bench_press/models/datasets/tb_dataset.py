@@ -6,16 +6,26 @@ import glob
 import bisect
 from bench_press.utils.obs_to_np import *
 from bench_press.models.datasets.base_dataset import BaseDataset
+from bench_press.models.datasets.dataset_index import STATE_COLUMNS
+from bench_press.models.datasets.training_cache import TrainingCache
 
 
 class TBDataset(BaseDataset):
 
+    # Whether raw_sample can describe a sample, so that it can be served from a TrainingCache
+    supports_training_cache = True
+
     def __init__(self, conf, transform=None):
+        self.cache = None
         super(TBDataset, self).__init__(conf, transform)
 
     def setup(self):
         self.file_len_cumsum = np.cumsum(np.array(self.file_lengths))
         self.total_length = self.file_len_cumsum[-1]
+        if self.conf.cache_dir and not self.supports_training_cache:
+            print(f'{type(self).__name__} cannot be served from a training cache, ignoring cache_dir')
+        elif self.conf.cache_dir:
+            self.cache = TrainingCache.open_or_build(self, self.conf.cache_dir)
 
     def compute_file_and_offset(self, idx):
         file_index = bisect.bisect_right(self.file_len_cumsum, idx)
@@ -26,23 +36,103 @@ class TBDataset(BaseDataset):
             sub_index = idx - self.file_len_cumsum[file_index - 1]
         return file_name, sub_index
 
+    def sample_locations(self, indices):
+        file_indices = np.searchsorted(self.file_len_cumsum, indices, side='right')
+        offsets = np.concatenate(([0], self.file_len_cumsum))[file_indices]
+        return file_indices, indices - offsets
+
+    def get_samples(self, indices):
+        """
+        Like __getitem__ on each index, but the steps needed by the samples of
+        a file are read with a single load_steps call.
+        """
+        if self.cache is not None:
+            return [TBDataset.__getitem__(self, idx) for idx in indices]
+        file_indices, sub_indices = self.sample_locations(np.asarray(indices))
+        samples = [None] * len(indices)
+        for file_index in np.unique(file_indices):
+            positions = np.flatnonzero(file_indices == file_index)
+            final_index = self.file_lengths[file_index] - 1
+            sample_steps = [self._sample_steps(int(sub_indices[p]), final_index) for p in positions]
+            steps = sorted({step for s in sample_steps for step in s})
+            anchors = self._anchor_steps(final_index)
+            contents = dict(zip(steps, self.load_steps(self.h5_files[file_index], steps, anchors)))
+            for position, s in zip(positions, sample_steps):
+                samples[position] = self._make_data_point(*self._assemble_obs([contents[step] for step in s]))
+        return samples
+
     def __getitem__(self, idx):
+        if self.cache is not None:
+            images, state, label = self.cache.sample(idx, self.conf.norms.state, self.conf.norms.label)
+            # CHW uint8 tensors sharing memory with the cache, which ToPILImage accepts like HWC arrays
+            return self._format_data_point([torch.from_numpy(image) for image in images], state, label)
+        return self._make_data_point(*self._load_obs(idx))
+
+    def raw_sample(self, idx):
+        """
+        :return: images, unnormalized state and unnormalized label of a sample, to build the cache from
+        """
+        obs_1, final = self._load_obs(idx)
+        return obs_to_images(obs_1), obs_to_state(obs_1, None), obs_to_action(obs_1, final, None)
+
+    def statistics_kind(self):
+        if set(self.norm_keys) - {'state', 'label'}:
+            return None
+        return (f'{type(self).__name__}:predict_final_action={bool(self.conf.predict_final_action)}'
+                f':use_initial_press={bool(self.conf.use_initial_press)}')
+
+    def _sample_columns(self, steps):
+        state = steps[:, STATE_COLUMNS]
+        num_samples = self._get_ind_file_len(len(steps))
+        if self.conf.predict_final_action or self.conf.use_initial_press:
+            # Labels are computed against step file_length - 1, see _load_obs
+            target = np.repeat(state[num_samples - 1:num_samples], num_samples, axis=0)
+        else:
+            target = state[1:num_samples + 1]
+        return {'state': state[:num_samples], 'label': states_to_actions(state[:num_samples], target)}
+
+    def _load_obs(self, idx):
+        """
+        :return: the observation of sample idx and the observation its label is computed against
+        """
         file_name, sub_index = self.compute_file_and_offset(idx)
+        final_index = self.file_lengths[bisect.bisect_right(self.file_len_cumsum, idx)] - 1
+        return self._assemble_obs(self.load_steps(file_name, self._sample_steps(sub_index, final_index),
+                                                  self._anchor_steps(final_index)))
 
+    def _sample_steps(self, sub_index, final_index):
+        """
+        :return: steps of its file a sample is made from
+        """
         if self.conf.predict_final_action:
-            contents = dd.io.load(file_name, group=[f'/data/i{sub_index}', f'/data/i{sub_index+1}'])
-            contents2 = dd.io.load(file_name, group=f'/data/i{self.file_lengths[file_index]-1}')
-            data_point = self._make_data_point(contents[0], contents2)
+            return [sub_index, final_index]
         elif self.conf.use_initial_press:
-            contents = dd.io.load(file_name, group=[f'/data/i{sub_index}', f'/data/i{sub_index+1}', f'/data/i2'])
-            contents[0]['raw_images']['gelsight_top'] = contents[2]['raw_images']['gelsight_top'] 
-            contents[0]['images']['gelsight_top'] = contents[2]['images']['gelsight_top'] 
-            contents2 = dd.io.load(file_name, group=f'/data/i{self.file_lengths[file_index]-1}')
-            data_point = self._make_data_point(contents[0], contents2)
-        else:
-            contents = dd.io.load(file_name, group=[f'/data/i{sub_index}', f'/data/i{sub_index+1}'])
-            data_point = self._make_data_point(contents[0], contents[1])
-        return data_point
+            return [sub_index, 2, final_index]
+        return [sub_index, sub_index + 1]
+
+    def _anchor_steps(self, final_index):
+        """
+        :return: steps every sample of a file is made against, see BaseDataset.load_steps
+        """
+        if self.conf.predict_final_action:
+            return [final_index]
+        elif self.conf.use_initial_press:
+            return [2, final_index]
+        return []
+
+    def _assemble_obs(self, contents):
+        """
+        :param contents: observations of the steps returned by _sample_steps
+        :return: arguments of _make_data_point
+        """
+        if self.conf.predict_final_action or not self.conf.use_initial_press:
+            return contents[0], contents[1]
+        # Copy before swapping in the press image, the observation may be shared with other samples
+        obs_1 = dict(contents[0], images=dict(contents[0]['images']))
+        obs_1['images']['gelsight_top'] = contents[1]['images']['gelsight_top']
+        if 'raw_images' in obs_1:
+            obs_1['raw_images'] = dict(obs_1['raw_images'], gelsight_top=contents[1]['raw_images']['gelsight_top'])
+        return obs_1, contents[2]
 
     def _make_data_point(self, obs_1, final):
         images = obs_to_images(obs_1)
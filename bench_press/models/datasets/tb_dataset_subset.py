@@ -1,7 +1,12 @@
 from tqdm import tqdm
+from bench_press.models.datasets.filter_fns import ColumnFilter, KeepAllFilter
 from bench_press.models.datasets.tb_dataset import TBDataset
+from bench_press.models.datasets.training_cache import files_fingerprint
 from pathlib import Path
+import hashlib
+import json
 import pickle as pkl
+import numpy as np
 
 
 class TBDatasetSubset(TBDataset):
@@ -13,29 +18,67 @@ class TBDatasetSubset(TBDataset):
     def setup(self):
         super(TBDatasetSubset, self).setup()
         if self.filter_fn is None:
-            self.filter_fn = lambda x, y: True
+            self.filter_fn = KeepAllFilter()
         else:
             self.filter_fn = self.filter_fn()
         self.subset_inds = self.get_filter_idxs()
         self.subset_len = len(self.subset_inds)
         print(f'Created subset of length {self.subset_len}. This is {1.0 * self.subset_len / self.total_length} of the original.')
 
+    def filter_key(self):
+        """
+        :return: hash of the filter, its parameters, how samples are made and the
+            files they come from, which the cached indices are valid for
+        """
+        key = {
+            'filter': f'{type(self.filter_fn).__module__}.{type(self.filter_fn).__qualname__}',
+            'params': {k: repr(v) for k, v in sorted(vars(self.filter_fn).items())},
+            'samples': self.statistics_kind(),
+            'files': files_fingerprint(self.h5_files),
+        }
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
+
     def get_filter_idxs(self):
         print('Loading subset filter indices...')
+        if not isinstance(self.filter_fn, ColumnFilter):
+            return self._get_filter_idxs_from_data_points()
+
+        key = self.filter_key()
+        if self.conf.save_inds_to and Path(self.conf.save_inds_to).is_file():
+            with open(self.conf.save_inds_to, 'rb') as f:
+                saved = pkl.load(f)
+            if isinstance(saved, dict) and saved.get('key') == key:
+                print(f'Loading cached indices from {self.conf.save_inds_to}...')
+                return saved['indices']
+            print(f'Cached indices in {self.conf.save_inds_to} are stale, filtering again')
+
+        mask = self.filter_fn(self.sample_table(), self.conf)
+        filter_inds = np.flatnonzero(mask).tolist()
         if self.conf.save_inds_to:
-            if Path(self.conf.save_inds_to).is_file():
+            print(f'Caching indices to {self.conf.save_inds_to}...')
+            with open(self.conf.save_inds_to, 'wb') as f:
+                pkl.dump({'key': key, 'indices': filter_inds}, f)
+        return filter_inds
+
+    def _get_filter_idxs_from_data_points(self):
+        # Filters taking (data point, conf), which need every sample to be loaded
+        if self.conf.save_inds_to and Path(self.conf.save_inds_to).is_file():
+            with open(self.conf.save_inds_to, 'rb') as f:
+                saved = pkl.load(f)
+            # A plain list of indices; a dict was written by a ColumnFilter and does not apply here
+            if isinstance(saved, list):
                 print(f'Loading cached indices from {self.conf.save_inds_to}...')
-                with open(self.conf.save_inds_to, 'rb') as f:
-                    saved_inds = pkl.load(f)
-                return saved_inds
+                return saved
+            print(f'Cached indices in {self.conf.save_inds_to} were not made by this filter, filtering again')
 
         filter_inds = []
         for i in tqdm(range(self.total_length)):
             if self.filter_fn(super(TBDatasetSubset, self).__getitem__(i), self.conf):
                 filter_inds.append(i)
-        print(f'Caching indices to {self.conf.save_inds_to}...')
-        with open(self.conf.save_inds_to, 'wb') as f:
-            pkl.dump(filter_inds, f)
+        if self.conf.save_inds_to:
+            print(f'Caching indices to {self.conf.save_inds_to}...')
+            with open(self.conf.save_inds_to, 'wb') as f:
+                pkl.dump(filter_inds, f)
         return filter_inds
 
     def __len__(self):
@@ -44,3 +87,8 @@ class TBDatasetSubset(TBDataset):
     def __getitem__(self, idx):
         return super(TBDatasetSubset, self).__getitem__(self.subset_inds[idx])
 
+    def sample_locations(self, indices):
+        return super(TBDatasetSubset, self).sample_locations(np.asarray(self.subset_inds)[indices])
+
+    def get_samples(self, indices):
+        return super(TBDatasetSubset, self).get_samples([self.subset_inds[idx] for idx in indices])
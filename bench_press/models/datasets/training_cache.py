@@ -0,0 +1,142 @@
+import hashlib
+import json
+import os
+import shutil
+from multiprocessing import Pool
+
+import numpy as np
+
+MANIFEST = 'manifest.json'
+
+
+def _hash(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def _plain(value):
+    # OmegaConf containers and numpy arrays to json-serializable values
+    if hasattr(value, 'items'):
+        return {k: _plain(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)) or type(value).__name__ == 'ListConfig':
+        return [_plain(v) for v in value]
+    return value
+
+
+def files_fingerprint(files):
+    return [(f, os.path.getsize(f), os.stat(f).st_mtime_ns) for f in files]
+
+
+class TrainingCache:
+    """
+    Dataset-wide cache of decoded samples, written once and then memory mapped:
+    one uint8 array per camera already laid out as (N, C, H, W), and the
+    unnormalized float64 state and label of every sample. Normalized float32
+    copies of state and label are added per set of norms.
+
+    A cache lives in `<cache_dir>/<hash of the dataset class and config>`. It is rebuilt
+    when the source files it was built from were added, removed or modified.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.num_samples = self.manifest['num_samples']
+        # Copy-on-write mapping: slices are writable (as torch.from_numpy wants) without touching the file
+        self.images = [np.load(os.path.join(path, f'images_{k}.npy'), mmap_mode='c')
+                       for k in range(self.manifest['num_cameras'])]
+        self.raw = {key: np.load(os.path.join(path, f'{key}_raw.npy'), mmap_mode='r') for key in ('state', 'label')}
+        self.normalized = {}
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getstate__(self):
+        # Workers started by pickling the dataset map the files again instead of receiving copies
+        return {'path': self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+
+    @staticmethod
+    def key(dataset):
+        conf = dataset.conf
+        return _hash({
+            'dataset': type(dataset).__name__,
+            'folders': _plain(conf.folders),
+            'predict_final_action': bool(conf.predict_final_action),
+            'use_initial_press': bool(conf.use_initial_press),
+        })
+
+    @classmethod
+    def open_or_build(cls, dataset, cache_dir):
+        """
+        :param dataset: TBDataset, providing `h5_files`, `total_length` and `raw_sample(idx)`
+        """
+        path = os.path.join(cache_dir, cls.key(dataset))
+        fingerprint = files_fingerprint(dataset.h5_files)
+        manifest_file = os.path.join(path, MANIFEST)
+        if os.path.isfile(manifest_file):
+            with open(manifest_file) as f:
+                if json.load(f)['files'] == [list(entry) for entry in fingerprint]:
+                    return cls(path)
+            print(f'Source files changed, rebuilding training cache {path}')
+        cls.build(dataset, path, fingerprint)
+        return cls(path)
+
+    @staticmethod
+    def build(dataset, path, fingerprint):
+        print(f'Materializing {dataset.total_length} samples into {path}...')
+        tmp_path = path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        n = int(dataset.total_length)
+        images, state, label = dataset.raw_sample(0)
+        image_arrays = [np.lib.format.open_memmap(os.path.join(tmp_path, f'images_{k}.npy'), mode='w+', dtype=np.uint8,
+                                                  shape=(n, image.shape[2], image.shape[0], image.shape[1]))
+                        for k, image in enumerate(images)]
+        raw = {'state': np.lib.format.open_memmap(os.path.join(tmp_path, 'state_raw.npy'), mode='w+',
+                                                  dtype=np.float64, shape=(n, len(state))),
+               'label': np.lib.format.open_memmap(os.path.join(tmp_path, 'label_raw.npy'), mode='w+',
+                                                  dtype=np.float64, shape=(n, len(label)))}
+        with Pool(dataset.conf.dataloader_workers or 1) as pool:
+            for idx, (images, state, label) in enumerate(pool.imap(dataset.raw_sample, range(n), chunksize=16)):
+                for array, image in zip(image_arrays, images):
+                    array[idx] = np.transpose(image, (2, 0, 1))
+                raw['state'][idx], raw['label'][idx] = state, label
+        for array in image_arrays + list(raw.values()):
+            array.flush()
+        with open(os.path.join(tmp_path, MANIFEST), 'w') as f:
+            json.dump({'num_samples': n, 'num_cameras': len(image_arrays),
+                       'files': [list(entry) for entry in fingerprint]}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def get_normalized(self, key, norm_conf):
+        """
+        :return: float32 (N, D) memmap of the `key` array normalized with norm_conf
+            (mean and std), written next to the cache the first time these norms are used
+        """
+        if norm_conf is None or 'mean' not in norm_conf:
+            norm_conf = {'mean': [0.0], 'std': [1.0]}
+        mean, std = _plain(norm_conf['mean']), _plain(norm_conf['std'])
+        name = f'{key}_{_hash([mean, std])}.npy'
+        if name not in self.normalized:
+            file_name = os.path.join(self.path, name)
+            if not os.path.isfile(file_name):
+                normalized = ((self.raw[key] - np.array(mean)) / np.array(std)).astype(np.float32)
+                tmp_name = f'{file_name}.{os.getpid()}.tmp'
+                with open(tmp_name, 'wb') as f:
+                    np.save(f, normalized)
+                os.replace(tmp_name, file_name)  # Several DataLoader workers may get here at once
+            self.normalized[name] = np.load(file_name, mmap_mode='c')
+        return self.normalized[name]
+
+    def sample(self, idx, state_norm, label_norm):
+        """
+        :return: (list of CHW uint8 image arrays, float32 state, float32 label), all
+            views into the memory mapped files
+        """
+        return ([images[idx] for images in self.images],
+                self.get_normalized('state', state_norm)[idx],
+                self.get_normalized('label', label_norm)[idx])
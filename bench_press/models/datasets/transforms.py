@@ -1,3 +1,10 @@
+import math
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+from bench_press.models.modules.pretrained_encoder import pretrained_model_normalize
+
 
 class ImageTransform:
 
@@ -11,3 +18,181 @@ class ImageTransform:
         return sample
 
 
+def to_chw_tensor(image):
+    """
+    Per-image transform for datasets feeding a BatchImageTransform: HWC uint8
+    arrays become CHW uint8 tensors, so they collate into [B, C, H, W]
+    batches. CHW tensors (from the training cache) are passed through.
+    """
+    if isinstance(image, torch.Tensor):
+        return image
+    return torch.from_numpy(np.ascontiguousarray(image.transpose(2, 0, 1)))
+
+
+def _rgb_to_hsv(rgb):
+    r, g, b = rgb.unbind(dim=1)
+    maxc, _ = rgb.max(dim=1)
+    minc, _ = rgb.min(dim=1)
+    cr = maxc - minc
+    s = cr / torch.where(maxc == 0, torch.ones_like(maxc), maxc)
+    cr_divisor = torch.where(cr == 0, torch.ones_like(cr), cr)
+    rc, gc, bc = (maxc - r) / cr_divisor, (maxc - g) / cr_divisor, (maxc - b) / cr_divisor
+    hr = (maxc == r) * (bc - gc)
+    hg = ((maxc == g) & (maxc != r)) * (2.0 + rc - bc)
+    hb = ((maxc != g) & (maxc != r)) * (4.0 + gc - rc)
+    h = torch.fmod((hr + hg + hb) / 6.0 + 1.0, 1.0)
+    return h, s, maxc
+
+
+def _hsv_to_rgb(h, s, v):
+    i = torch.floor(h * 6.0)
+    f = h * 6.0 - i
+    i = i.to(torch.int64) % 6
+    p = (v * (1.0 - s)).clamp(0.0, 1.0)
+    q = (v * (1.0 - s * f)).clamp(0.0, 1.0)
+    t = (v * (1.0 - s * (1.0 - f))).clamp(0.0, 1.0)
+    mask = i.unsqueeze(1) == torch.arange(6, device=i.device).view(1, -1, 1, 1)
+    r = torch.stack((v, q, p, p, t, v), dim=1)
+    g = torch.stack((t, v, v, q, p, p), dim=1)
+    b = torch.stack((p, p, t, v, v, q), dim=1)
+    return torch.stack([(channel * mask).sum(dim=1) for channel in (r, g, b)], dim=1)
+
+
+def _adjust_brightness(x, factor):
+    return (x * factor.view(-1, 1, 1, 1)).clamp(0, 255)
+
+
+def _adjust_hue(x, shift):
+    h, s, v = _rgb_to_hsv(x / 255.0)
+    return _hsv_to_rgb(torch.remainder(h + shift.view(-1, 1, 1), 1.0), s, v) * 255.0
+
+
+def _color_jitter(x, factor=None, shift=None, hue_first=None):
+    """
+    :param x: float [B, 3, H, W] batch in [0, 255]
+    :param factor: [B] brightness factors, or None for no brightness jitter
+    :param shift: [B] hue shifts, or None for no hue jitter
+    :param hue_first: [B] bool, samples whose hue is shifted before their
+        brightness is scaled, when both are jittered
+    """
+    if factor is None or shift is None:
+        if factor is not None:
+            return _adjust_brightness(x, factor)
+        return x if shift is None else _adjust_hue(x, shift)
+    out = torch.empty_like(x)
+    out[hue_first] = _adjust_brightness(_adjust_hue(x[hue_first], shift[hue_first]), factor[hue_first])
+    out[~hue_first] = _adjust_hue(_adjust_brightness(x[~hue_first], factor[~hue_first]), shift[~hue_first])
+    return out
+
+
+class BatchImageTransform:
+    """
+    Batched replacement for the per-sample PIL pipeline of Trainer
+    (ToPILImage, RandomApply([ColorJitter, RandomResizedCrop]), Resize,
+    ToTensor, Normalize), applied to the collated uint8 [B, C, H, W] camera
+    batches on the training device.
+
+    As in the PIL pipeline, augmentation is applied to a sample with
+    probability `augment_prob`, to all of its cameras at once, and every
+    camera draws its own jitter and crop parameters. Like ColorJitter,
+    brightness and hue are adjusted in a random order per image. Unlike the
+    PIL pipeline, jitter is applied after the crop, to final_size pixels
+    instead of the source ones: the adjustments are per pixel, so this only
+    differs where the resampling blends pixels. Crops are sampled like
+    RandomResizedCrop on the input size and are cropped and resized from the
+    input resolution in one grid_sample call, supersampled and box filtered
+    down to final_size; only samples that are not augmented go through a
+    plain resize. Scaling to [0, 1] and
+    normalization are fused into a single multiply-add.
+    """
+
+    def __init__(self, final_size, augment_prob=0.0, brightness=0.0, hue=0.0, scale=(0.9, 1.0),
+                 ratio=(3.0 / 4.0, 4.0 / 3.0), mean=pretrained_model_normalize.mean,
+                 std=pretrained_model_normalize.std):
+        self.final_size = tuple(final_size)
+        self.augment_prob = augment_prob or 0.0
+        self.brightness = brightness or 0.0
+        self.hue = hue or 0.0
+        self.scale = scale
+        self.log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+        self.ratio = ratio
+        self.mean = torch.tensor(mean, dtype=torch.float32).view(1, -1, 1, 1)
+        self.std = torch.tensor(std, dtype=torch.float32).view(1, -1, 1, 1)
+
+    def __call__(self, images):
+        """
+        :param images: list with one uint8 [B, C, H, W] tensor per camera
+        :return: list of normalized float32 [B, C, *final_size] tensors
+        """
+        apply = None
+        if self.augment_prob > 0:
+            apply = torch.rand(images[0].shape[0], device=images[0].device) < self.augment_prob
+        return [self.transform(x, apply) for x in images]
+
+    def transform(self, x, apply=None):
+        height, width = x.shape[-2:]
+        x = x.float()
+        if apply is not None and apply.any():
+            out = x.new_empty(x.shape[:2] + self.final_size)
+            if not apply.all():
+                out[~apply] = self._resize(x[~apply])
+            out[apply] = self._augment(x[apply], height, width)
+            x = out
+        else:
+            x = self._resize(x)
+        scale = 1.0 / (255.0 * self.std.to(x.device))
+        return torch.addcmul(-self.mean.to(x.device) / self.std.to(x.device), x, scale)
+
+    def _resize(self, x):
+        if tuple(x.shape[-2:]) == self.final_size:
+            return x
+        return F.interpolate(x, size=self.final_size, mode='bilinear', align_corners=False, antialias=True)
+
+    def _crop_boxes(self, n, height, width, device):
+        """
+        :return: (top, left, height, width) of n crops as fractions of the
+            image, with RandomResizedCrop.get_params's sampling and fallback
+        """
+        area = height * width
+        target_area = area * torch.empty(n, 10, device=device).uniform_(*self.scale)
+        aspect_ratio = torch.exp(torch.empty(n, 10, device=device).uniform_(*self.log_ratio))
+        w = torch.round(torch.sqrt(target_area * aspect_ratio))
+        h = torch.round(torch.sqrt(target_area / aspect_ratio))
+        valid = (w > 0) & (w <= width) & (h > 0) & (h <= height)
+        first = valid.int().argmax(dim=1)
+        w, h = w.gather(1, first[:, None])[:, 0], h.gather(1, first[:, None])[:, 0]
+
+        in_ratio = width / height
+        if in_ratio < self.ratio[0]:
+            fallback_w, fallback_h = width, round(width / self.ratio[0])
+        elif in_ratio > self.ratio[1]:
+            fallback_w, fallback_h = round(height * self.ratio[1]), height
+        else:
+            fallback_w, fallback_h = width, height
+        found = valid.any(dim=1)
+        w = torch.where(found, w, torch.full_like(w, fallback_w))
+        h = torch.where(found, h, torch.full_like(h, fallback_h))
+        top = torch.where(found, torch.floor(torch.rand(n, device=device) * (height - h + 1)), (height - h) // 2)
+        left = torch.where(found, torch.floor(torch.rand(n, device=device) * (width - w + 1)), (width - w) // 2)
+        return top / height, left / width, h / height, w / width
+
+    def _augment(self, x, height, width):
+        n = x.shape[0]
+        top, left, h, w = self._crop_boxes(n, height, width, x.device)
+        theta = torch.zeros(n, 2, 3, device=x.device)
+        theta[:, 0, 0], theta[:, 0, 2] = w, 2 * left + w - 1
+        theta[:, 1, 1], theta[:, 1, 2] = h, 2 * top + h - 1
+        # Sample at a multiple of final_size and average it down, so that downscaling does not alias
+        factor = max(1, min(height // self.final_size[0], width // self.final_size[1]))
+        size = [n, x.shape[1], self.final_size[0] * factor, self.final_size[1] * factor]
+        grid = F.affine_grid(theta, size, align_corners=False)
+        x = F.grid_sample(x, grid, mode='bilinear', padding_mode='border', align_corners=False)
+        if factor > 1:
+            x = F.avg_pool2d(x, factor)
+
+        factor = shift = None
+        if self.brightness > 0:
+            factor = torch.empty(n, device=x.device).uniform_(max(0.0, 1 - self.brightness), 1 + self.brightness)
+        if self.hue > 0:
+            shift = torch.empty(n, device=x.device).uniform_(-self.hue, self.hue)
+        return _color_jitter(x, factor, shift, torch.rand(n, device=x.device) < 0.5)
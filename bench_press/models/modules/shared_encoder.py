@@ -0,0 +1,56 @@
+import torch
+import torch.nn as nn
+
+CAMERA_ADAPTERS = ('input', 'head')
+
+
+class SharedCameraEncoder(nn.Module):
+    """
+    Encodes the images of several cameras with one trunk: the cameras are
+    stacked into a single [B*N, C, H, W] batch and go through the trunk in one
+    forward pass. Per-camera specialization is optional:
+        'input': a per-camera, per-channel scale and shift of the images
+        'head': a per-camera linear layer on the trunk features
+    Both start out as the identity, so a pretrained trunk behaves the same for
+    every camera until they are trained.
+    """
+
+    def __init__(self, trunk, num_cameras, num_features, adapters=()):
+        super(SharedCameraEncoder, self).__init__()
+        for adapter in adapters:
+            assert adapter in CAMERA_ADAPTERS, f'Camera adapters must be among {CAMERA_ADAPTERS}'
+        self.trunk = trunk
+        self.num_cameras = num_cameras
+        self.num_features = num_features
+        self.input_scale, self.input_shift = None, None
+        self.head_weight, self.head_bias = None, None
+        if 'input' in adapters:
+            self.input_scale = nn.Parameter(torch.ones(num_cameras, 1, 3, 1, 1))
+            self.input_shift = nn.Parameter(torch.zeros(num_cameras, 1, 3, 1, 1))
+        if 'head' in adapters:
+            self.head_weight = nn.Parameter(torch.eye(num_features).repeat(num_cameras, 1, 1))
+            self.head_bias = nn.Parameter(torch.zeros(num_cameras, 1, num_features))
+
+    def encode_trunk(self, images):
+        """
+        :param images: list of num_cameras image tensors of shape [B, C, H, W]
+        :return: trunk features of shape [N, B, num_features]
+        """
+        x = torch.stack(images)
+        if self.input_scale is not None:
+            x = torch.addcmul(self.input_shift, x, self.input_scale)
+        n, b = x.shape[:2]
+        return self.trunk(x.flatten(0, 1)).view(n, b, -1)
+
+    def head(self, features):
+        """
+        :param features: trunk features of shape [N, B, num_features]
+        :return: tensor of shape [B, N*num_features], cameras in input order as
+            if each had been encoded separately and concatenated
+        """
+        if self.head_weight is not None:
+            features = torch.baddbmm(self.head_bias, features, self.head_weight)
+        return features.transpose(0, 1).flatten(1)
+
+    def forward(self, images):
+        return self.head(self.encode_trunk(images))
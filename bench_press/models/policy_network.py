@@ -3,6 +3,7 @@ import torch.nn as nn
 from torchvision import models
 import numpy as np
 from bench_press.models.modules.pretrained_encoder import *
+from bench_press.models.modules.shared_encoder import SharedCameraEncoder
 from bench_press.models.model import Model
 
 
@@ -26,19 +27,25 @@ class PolicyNetwork(Model):
             print(f'!! Activation {self.conf.activation} not found! Defaulting to identity')
             self.activation = lambda x: x
 
-    def build_network(self):
-        num_image_inputs = len(self.conf.image_inputs)
+    def _make_encoder(self):
         if self.conf.encoder_type == 'resnet':
-            self.image_encoders = nn.ModuleList(
-                [get_resnet_encoder(models.resnet18, self.conf.encoder_features, freeze=False) for _ in range(num_image_inputs)])
+            return get_resnet_encoder(models.resnet18, self.conf.encoder_features, freeze=False)
         elif self.conf.encoder_type == 'resnet_spatial':
-            self.image_encoders = nn.ModuleList(
-                [get_resnet_spatial_encoder(models.resnet18, self.conf.encoder_features, freeze=False) for _ in range(num_image_inputs)])
+            return get_resnet_spatial_encoder(models.resnet18, self.conf.encoder_features, freeze=False)
+        else:
+            return get_vgg_encoder(models.vgg13, self.conf.encoder_features)
+
+    def build_network(self):
+        num_image_inputs = len(self.conf.image_inputs)
+        if self.conf.shared_encoder and num_image_inputs:
+            # One trunk for all cameras, run on all of them in a single batch
+            self.image_encoders = SharedCameraEncoder(self._make_encoder(), num_image_inputs,
+                                                      self.conf.encoder_features,
+                                                      adapters=self.conf.camera_adapters or ())
         else:
-            self.image_encoders = nn.ModuleList(
-                [get_vgg_encoder(models.vgg13, self.conf.encoder_features) for _ in range(num_image_inputs)])
+            self.image_encoders = nn.ModuleList([self._make_encoder() for _ in range(num_image_inputs)])
 
-        current_layer_width = len(self.image_encoders) * self.conf.encoder_features
+        current_layer_width = num_image_inputs * self.conf.encoder_features
         if self.conf.use_state:
             current_layer_width += self.conf.state_dim
         else:
@@ -57,30 +64,28 @@ class PolicyNetwork(Model):
         :param inputs: a dictionary containing the following keys:
             'images': a list of num_cameras image tensors of shape [B, C, W, H]
             'state': a tensor of shape [B, state_dim]
+            'features' (optional): a tensor of shape [B, num_cameras*encoder_features] of
+                precomputed image encodings (see FeatureStore), used instead of 'images'
         :return: a tensor of shape [B, action_dim]
         """
 
-        image_inputs, state_input = inputs['images'], inputs['state']
-        sel_image_inputs = []
-        for name in self.conf.image_inputs:
-            assert name in self.input_sources
-            ind = self.input_sources.index(name)
-            sel_image_inputs.append(image_inputs[ind])
-
-        image_inputs = sel_image_inputs
-        image_encodings = []
-        if self.image_encoders:
-            for camera_i_images, encoder in zip(image_inputs, self.image_encoders):
-                image_encodings.append(encoder(camera_i_images))
-            image_encodings_cat = torch.cat(image_encodings, dim=1)  # form [B, num_cam*encoder_features] tensor
+        state_input = inputs['state']
+        image_encodings_cat = None
+        if 'features' in inputs:
+            image_encodings_cat = inputs['features']
             output = image_encodings_cat
+        else:
+            image_inputs = self.select_images(inputs['images'])
+            if image_inputs:
+                image_encodings_cat = self.encode_images(image_inputs)  # form [B, num_cam*encoder_features] tensor
+                output = image_encodings_cat
         if self.conf.use_state:
-            if image_encodings: 
+            if image_encodings_cat is not None:
                 output = torch.cat((image_encodings_cat, state_input), dim=1)
             else:
                 output = state_input
         if self.conf.use_opto:
-            if image_encodings or self.conf.use_state:
+            if image_encodings_cat is not None or self.conf.use_state:
                 output = torch.cat((output, inputs['opto_1'], inputs['opto_2']), dim=1)
             else: 
                 output = torch.cat((inputs['opto_1'], inputs['opto_2']), dim=1)
@@ -89,3 +94,23 @@ class PolicyNetwork(Model):
         output = self.output_layer(output)
         return output
 
+    def select_images(self, image_inputs):
+        """
+        :param image_inputs: list of image tensors of all input sources
+        :return: list of the image tensors of conf.image_inputs, in that order
+        """
+        sel_image_inputs = []
+        for name in self.conf.image_inputs:
+            assert name in self.input_sources
+            ind = self.input_sources.index(name)
+            sel_image_inputs.append(image_inputs[ind])
+        return sel_image_inputs
+
+    def encode_images(self, image_inputs):
+        """
+        :param image_inputs: list of image tensors of shape [B, C, H, W], one per entry of conf.image_inputs
+        :return: a tensor of shape [B, num_cameras*encoder_features]
+        """
+        if isinstance(self.image_encoders, SharedCameraEncoder):
+            return self.image_encoders(image_inputs)
+        return torch.cat([encoder(images) for images, encoder in zip(image_inputs, self.image_encoders)], dim=1)
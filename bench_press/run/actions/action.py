@@ -24,6 +24,9 @@ class DeltaAction(Action):
     def apply(self, environment):
         environment.move_delta(self.delta)
 
+    def apply_async(self, environment):
+        return environment.move_delta_async(self.delta)
+
     def inverse(self):
         return DeltaAction(-self.delta)
 
@@ -40,6 +43,9 @@ class AbsoluteAction(Action):
     def apply(self, environment):
         environment.move_to(self.pos)
 
+    def apply_async(self, environment):
+        return environment.move_to_async(self.pos)
+
     def __str__(self):
         return f'[Action: AbsoluteAction {self.pos}]'
 
@@ -78,8 +84,22 @@ class SequentialAction(Action):
         self.action_list = action_list
 
     def apply(self, environment):
+        # Consecutive moves are queued on the environment back to back, and
+        # only waited for before an action which cannot be queued, or at the end
+        queue_moves = hasattr(environment, 'move_to_async')
+        pending = []
         for action in self.action_list:
+            if queue_moves and hasattr(action, 'apply_async'):
+                move = action.apply_async(environment)
+                if move is not None:  # None if the environment rejected the target
+                    pending.append(move)
+                continue
+            for move in pending:
+                move.result()
+            pending = []
             action.apply(environment)
+        for move in pending:
+            move.result()
 
     def inverse(self):
         """
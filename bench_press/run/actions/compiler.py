@@ -0,0 +1,199 @@
+import numpy as np
+from bench_press.run.actions.action import AbsoluteAction, DeltaAction, DynamixelAngleAction, \
+    SequentialAction, SleepAction
+
+
+class CostModel:
+    """
+    Rough execution time of actions on the testbench. Axes move
+    simultaneously at `steps_per_sec`, every move costs a fixed
+    `move_overhead` (serial command, completion message, acceleration), and
+    Dynamixel commands only cost a bus write since they are not waited for.
+    """
+
+    def __init__(self, steps_per_sec=(2000, 2000, 1000), move_overhead=0.02, dynamixel_overhead=0.005):
+        self.steps_per_sec = np.array(steps_per_sec, dtype=np.float64)
+        self.move_overhead = move_overhead
+        self.dynamixel_overhead = dynamixel_overhead
+
+    def move_time(self, delta):
+        return self.move_overhead + float(np.max(np.abs(delta) / self.steps_per_sec))
+
+    def estimate(self, actions, start_pos=None):
+        """
+        :param actions: flat list of actions
+        :param start_pos: xyz position before the first action. Until it is
+            known, absolute moves are only charged their overhead.
+        :return: estimated execution time in seconds
+        """
+        pos = None if start_pos is None else np.array(start_pos, dtype=np.float64)
+        total = 0.0
+        for action in actions:
+            if isinstance(action, DeltaAction):
+                total += self.move_time(action.delta)
+                if pos is not None:
+                    pos = pos + action.delta
+            elif isinstance(action, AbsoluteAction):
+                total += self.move_time(action.pos - pos) if pos is not None else self.move_overhead
+                pos = np.array(action.pos, dtype=np.float64)
+            elif isinstance(action, SleepAction):
+                total += action.time
+            elif isinstance(action, DynamixelAngleAction):
+                total += self.dynamixel_overhead
+        return total
+
+
+class Plan:
+    """
+    Result of compiling an action: the optimized action, ready to be applied,
+    with the estimated time of the original and of the optimized version.
+    """
+
+    def __init__(self, action, num_original, estimated_time, original_time):
+        self.action = action
+        self.num_original = num_original
+        self.estimated_time = estimated_time
+        self.original_time = original_time
+
+    def apply(self, environment):
+        self.action.apply(environment)
+
+    def __len__(self):
+        return len(self.action.action_list)
+
+    def __str__(self):
+        return (f'[Plan: {self.num_original} -> {len(self)} actions, estimated '
+                f'{self.original_time:.3f}s -> {self.estimated_time:.3f}s]\n{self.action}')
+
+
+class ActionCompiler:
+    """
+    Rewrites an action tree into an equivalent but cheaper flat SequentialAction:
+        - nested SequentialActions are flattened
+        - if the environment clips targets to `min_bounds`/`max_bounds`, every
+          move is first replaced by the move the environment would actually
+          make, tracking the position from `start_pos` or the last absolute
+          move; deltas issued while the position is unknown are neither merged
+          nor folded, since their clipping is unknown
+        - zero DeltaActions are dropped, and so are absolute moves to the
+          previous absolute target or to the position tracked from `start_pos`
+        - an action directly followed by its inverse (e.g. the deltas of a
+          sequence and of its `inverse()`) is folded away
+        - consecutive deltas are merged when that does not change the path:
+          deltas along the same axis and direction always, and purely planar
+          (xy) deltas, which turn L-shaped moves into diagonals, only if
+          `merge_planar` is set
+        - DynamixelAngleActions to the angle the gripper is already at (within
+          `angle_tolerance` degrees) are dropped, as are ones overridden by a later angle command before any
+          other action waits on the hardware
+    SleepActions, EndActions and any other action act as barriers which
+    nothing is merged or folded across.
+    """
+
+    def __init__(self, cost_model=None, merge_planar=False, fold_inverses=True, angle_tolerance=0.5,
+                 min_bounds=None, max_bounds=None):
+        self.cost_model = CostModel() if cost_model is None else cost_model
+        self.merge_planar = merge_planar
+        self.fold_inverses = fold_inverses
+        self.angle_tolerance = angle_tolerance
+        self.min_bounds = None if min_bounds is None else np.array(min_bounds)
+        self.max_bounds = None if max_bounds is None else np.array(max_bounds)
+
+    @staticmethod
+    def flatten(action):
+        if isinstance(action, SequentialAction):
+            return [leaf for child in action.action_list for leaf in ActionCompiler.flatten(child)]
+        return [action]
+
+    def _track(self, actions, start_pos):
+        """
+        Follow the position through the moves, replacing them by the ones the
+        environment makes after clipping their targets to the bounds (see
+        TBEnv.move_to_async) and dropping absolute moves to where it already is.
+        :return: actions, and the ids of deltas whose clipping is unknown
+        """
+        bounded = self.min_bounds is not None and self.max_bounds is not None
+        pos = None if start_pos is None else np.array(start_pos)
+        out, unknown = [], set()
+        for action in actions:
+            if isinstance(action, DeltaAction):
+                if pos is None:
+                    if bounded:
+                        unknown.add(id(action))
+                else:
+                    target = pos + action.delta
+                    if bounded:
+                        target = np.clip(target, self.min_bounds, self.max_bounds)
+                        action = DeltaAction(target - pos)
+                    pos = target
+            elif isinstance(action, AbsoluteAction):
+                target = action.pos
+                if bounded:
+                    target = np.clip(target, self.min_bounds, self.max_bounds)
+                if pos is not None and np.array_equal(target, pos):
+                    continue
+                if bounded:
+                    action = AbsoluteAction(target)
+                pos = target
+            out.append(action)
+        return out, unknown
+
+    def _can_merge(self, d1, d2):
+        if self.merge_planar and d1[2] == 0 and d2[2] == 0:
+            return True
+        # Collinear and in the same direction along one axis, so the path is unchanged
+        axes1, axes2 = np.flatnonzero(d1), np.flatnonzero(d2)
+        return len(axes1) == 1 and np.array_equal(axes1, axes2) and np.sign(d1[axes1[0]]) == np.sign(d2[axes1[0]])
+
+    def _optimize(self, actions, start_angle=None, unknown=()):
+        out = []
+        angle, angle_before = start_angle, start_angle
+        for action in actions:
+            if isinstance(action, DeltaAction):
+                if not np.any(action.delta):
+                    continue
+                prev = out[-1] if out else None
+                if isinstance(prev, DeltaAction) and id(prev) not in unknown and id(action) not in unknown:
+                    if self.fold_inverses and np.array_equal(prev.delta, -action.delta):
+                        out.pop()
+                        continue
+                    if self._can_merge(prev.delta, action.delta):
+                        out[-1] = DeltaAction(prev.delta + action.delta)
+                        continue
+                out.append(action)
+            elif isinstance(action, AbsoluteAction):
+                if out and isinstance(out[-1], AbsoluteAction) and np.array_equal(out[-1].pos, action.pos):
+                    continue
+                out.append(action)
+            elif isinstance(action, DynamixelAngleAction):
+                if out and isinstance(out[-1], DynamixelAngleAction):
+                    # Overridden before anything waited on the gripper
+                    out.pop()
+                    angle = angle_before
+                angle_before = angle
+                if angle is not None and abs(action.angle - angle) <= self.angle_tolerance:
+                    continue
+                angle = action.angle
+                out.append(action)
+            else:
+                out.append(action)
+        return out
+
+    def compile(self, action, start_pos=None, start_angle=None):
+        """
+        :param action: any action, usually a SequentialAction from a policy
+        :param start_pos: xyz position before the action, if known
+        :param start_angle: current Dynamixel angle, if known
+        :return: Plan with the optimized action and time estimates
+        """
+        actions = self.flatten(action)
+        tracked, unknown = self._track(actions, start_pos)
+        optimized = self._optimize(tracked, start_angle, unknown)
+        # Folding can make new neighbours mergeable, so repeat until nothing changes
+        while True:
+            again = self._optimize(optimized, start_angle, unknown)
+            if len(again) == len(optimized):
+                break
+            optimized = again
+        return Plan(SequentialAction(optimized), len(actions),
+                    self.cost_model.estimate(optimized, start_pos), self.cost_model.estimate(actions, start_pos))
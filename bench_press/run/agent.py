@@ -1,4 +1,5 @@
 from bench_press.run.actions.action import EndAction
+from bench_press.run.actions.compiler import ActionCompiler
 from bench_press.utils.infra import str_to_class
 from bench_press.utils.logger import Logger
 
@@ -9,6 +10,11 @@ class Agent:
         self.config = config
         self.logger = Logger(config)
         self.env = self._setup_env()
+        self.compiler = None
+        if config.agent.compile_actions:
+            # Moves are clipped to the bounds of the environment, the compiler needs them to merge moves exactly
+            self.compiler = ActionCompiler(min_bounds=getattr(self.env, 'min_bounds', None),
+                                           max_bounds=getattr(self.env, 'max_bounds', None))
 
     def _setup_env(self):
         # Environment setup, happens at the very beginning of runs
@@ -22,18 +28,32 @@ class Agent:
     def rollout(self, policy, idx):
         done = False
         num_steps = 0
-        observations = []
         self.env.reset()
-        input("rollout starting, press enter to continue")
-        observation = self.env.get_obs()
-        observations.append(observation)
-        while not done and num_steps < self.config.agent.max_steps:
-            action = policy.get_action(observation, num_steps)
-            print(action)
-            if isinstance(action, EndAction):
-                done = True
-            self.env.step(action)
+        if not self.config.agent.no_prompt:
+            input("rollout starting, press enter to continue")
+        observations = self.logger.start_rollout(idx)
+        try:
             observation = self.env.get_obs()
             observations.append(observation)
-            num_steps += 1
-        self.logger.log_obs(observations, idx)
+            while not done and num_steps < self.config.agent.max_steps:
+                action = policy.get_action(observation, num_steps)
+                print(action)
+                if isinstance(action, EndAction):
+                    done = True
+                elif self.compiler is not None:
+                    action = self._compile(action, observation)
+                self.env.step(action)
+                observation = self.env.get_obs()
+                observations.append(observation)
+                num_steps += 1
+        finally:
+            # Also saves what was recorded of a rollout that failed
+            observations.close()
+        return num_steps
+
+    def _compile(self, action, observation):
+        tb_state = observation.get('tb_state')
+        start_pos = None if tb_state is None else (tb_state['x'], tb_state['y'], tb_state['z'])
+        plan = self.compiler.compile(action, start_pos, observation.get('dynamixel_state'))
+        self.logger.log_text(plan)
+        return plan.action
@@ -0,0 +1,99 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+from bench_press.run.env.tb_env import TBEnv
+from bench_press.tb_control.tb_emulator import TBEmulatorProcess
+
+
+class SimDynamixel:
+
+    def __init__(self):
+        self.ids = [1]
+        self.angle = 0
+
+    def move_to_angle(self, angle):
+        self.angle = angle
+
+    def move_to_angles(self, angles):
+        self.angle = angles[0]
+
+    def get_current_angle(self):
+        return self.angle
+
+
+# Same fields as utils.camera.Frame, which cannot be imported without OpenCV
+SimFrame = namedtuple('SimFrame', ['seq', 'timestamp', 'image', 'raw_image'])
+
+
+class SimCamera:
+    # Stands in for a CameraThread, producing random frames of the configured size like DummyEnv.
+    # Frames are made on demand, so one is always available at exactly the requested time.
+
+    def __init__(self, name, goal_height, goal_width, raw_height=480, raw_width=640, thread_rate=30,
+                 publish_raw=True):
+        self.name = name
+        self.goal_shape = (goal_height, goal_width, 3)
+        self.raw_shape = (raw_height, raw_width, 3)
+        self.thread_rate = thread_rate
+        self.publish_raw = publish_raw
+        self.seq = -1
+
+    def get_name(self):
+        return self.name
+
+    def get_frame(self):
+        return np.random.randint(0, 256, self.goal_shape, dtype=np.uint8)
+
+    def get_raw_frame(self):
+        return np.random.randint(0, 256, self.raw_shape, dtype=np.uint8)
+
+    def frame_at(self, t):
+        self.seq += 1
+        return SimFrame(self.seq, t, self.get_frame(), self.get_raw_frame() if self.publish_raw else None)
+
+    def get_latest(self):
+        return self.frame_at(time.monotonic())
+
+    def latest_after(self, t, timeout=None):
+        return self.get_latest()
+
+    def rate_summary(self):
+        return 'simulated'
+
+    def stop(self):
+        pass
+
+    def join(self):
+        pass
+
+
+class SimTBEnv(TBEnv):
+    """
+    TBEnv driving a simulated testbench (see tb_control/tb_emulator.py) through
+    the real TestBench serial code, with simulated cameras and gripper. Each
+    instance starts its own emulator process, so several can run in parallel.
+    Emulator parameters (e.g. time_scale) are read from the `sim` config section.
+    """
+
+    def __init__(self, env_config, logger):
+        assert not env_config.optoforce, 'The optoforce sensor is not simulated'
+        sim_conf = dict(env_config.sim) if env_config.sim else {}
+        self.emulator = TBEmulatorProcess(**sim_conf).start()
+        env_config.serial_name = self.emulator.port_name
+        super(SimTBEnv, self).__init__(env_config, logger)
+
+    def clean_up(self):
+        super(SimTBEnv, self).clean_up()
+        self.tb.close()
+        self.emulator.stop()
+
+    def _setup_dynamixel(self):
+        self.dynamixel = SimDynamixel()
+
+    def _setup_cameras(self):
+        if not self.config.cameras:
+            return []
+        return [SimCamera(name, conf.goal_height, conf.goal_width, thread_rate=conf.thread_rate or 30,
+                          publish_raw=not self.config.skip_raw_images)
+                for name, conf in self.config.cameras.items()]
@@ -2,18 +2,16 @@ import time
 
 import numpy as np
 from bench_press.run.env.base_env import BaseEnv
-from bench_press.tb_control.dynamixel_interface import Dynamixel
 from bench_press.tb_control.testbench_control import TestBench
-from bench_press.utils.camera import CameraThread, Camera
-from bench_press.utils.optoforce import OptoforceThread
-
-try:
-    from src.optoforce.optoforce import *
-except ImportError:
-    print('No optoforce drivers installed! Be careful')
+from bench_press.utils.obs_assembler import ObservationAssembler, Timestamped
 
 
 class TBEnv(BaseEnv):
+    """
+    The drivers of the optional hardware (Dynamixel SDK, OpenCV cameras,
+    optoforce) are imported by the _setup_* methods that use them, so that
+    subclasses replacing those methods (see SimTBEnv) do not need them.
+    """
 
     def __init__(self, env_config, logger):
         super(TBEnv, self).__init__(env_config, logger)
@@ -29,20 +27,29 @@ class TBEnv(BaseEnv):
         self.min_bounds = np.array(self.config.min_bounds)
         self.max_bounds = np.array(self.config.max_bounds)
         self.home_pos = np.array(self.config.home_pos)
+        self.obs_assembler = ObservationAssembler(self._obs_readers())
 
     def clean_up(self):
+        self.obs_assembler.shutdown()
         for camera_thread in self.cameras:
             camera_thread.stop()
             camera_thread.join()
+            self.logger.log_text(f'Camera {camera_thread.get_name()}: {camera_thread.rate_summary()}')
         if self.config.optoforce:
             self.optoforce.stop()
             self.optoforce.join()
+            self.logger.log_text(f'Optoforce: {self.optoforce.rate_summary()}')
+        if self.config.dynamixel and self.config.dynamixel.poll_rate:
+            self.logger.log_text(f'Dynamixel poller: {self.dynamixel.poller.scheduler.summary()}')
+            self.dynamixel.stop_polling()
 
     def _setup_optoforce(self):
+        from bench_press.utils.optoforce import OptoforceDriver, OptoforceThread
         opto = OptoforceDriver(self.config.optoforce.name, self.config.optoforce.sensor_type,
                                [self.config.optoforce.scale])
         print(f'Building optoforce object...')
-        opto_thread = OptoforceThread(opto)
+        opto_thread = OptoforceThread(opto, self.config.optoforce.thread_rate,
+                                      history_len=self.config.optoforce.history_len or 10000)
         opto_thread.start()
         return opto_thread
 
@@ -57,22 +64,28 @@ class TBEnv(BaseEnv):
     def _setup_tb(self):
         self.logger.log_text('------------- Setting up TB -----------------')
 
-        tb = TestBench(self.config.serial_name)
-        while not tb.ready():
-            time.sleep(0.1)
-            tb.update()
+        tb = TestBench(self.config.serial_name, verbose=self.logger.logger_conf.log_text)
+        tb.wait_ready()
         tb.flip_x_reset()
         time.sleep(0.2)
         tb.start()
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
+        if self.config.stream_rate:
+            if tb.supports('stream'):
+                tb.start_stream(self.config.stream_rate)
+            else:
+                self.logger.log_text('Testbench firmware cannot stream telemetry, polling it instead')
 
         self.logger.log_text('----------------- Done ----------------------')
         self.logger.log_text(tb.req_data())
         return tb
 
     def _setup_dynamixel(self):
-        self.dynamixel = Dynamixel(self.config.dynamixel.name, self.config.dynamixel.home_pos)
+        from bench_press.tb_control.dynamixel_interface import Dynamixel
+        self.dynamixel = Dynamixel(self.config.dynamixel.name, self.config.dynamixel.home_pos,
+                                   ids=self.config.dynamixel.ids)
+        if self.config.dynamixel.poll_rate:
+            self.dynamixel.start_polling(self.config.dynamixel.poll_rate)
         if self.config.dynamixel.reset_on_start:
             self.move_dyna_to_angle(0)
 
@@ -80,10 +93,12 @@ class TBEnv(BaseEnv):
         cameras = []
         if not self.config.cameras:
             return cameras
+        from bench_press.utils.camera import CameraThread, Camera
         for camera_name, camera_conf in self.config.cameras.items():
             camera = Camera(camera_name, camera_conf.index, camera_conf.goal_height,
                             camera_conf.goal_width)
-            camera_thread = CameraThread(camera, camera_conf.thread_rate)
+            camera_thread = CameraThread(camera, camera_conf.thread_rate, publish_raw=not self.config.skip_raw_images,
+                                         history_len=camera_conf.history_len or 64)
             camera_thread.start()
             cameras.append(camera_thread)
         return cameras
@@ -93,28 +108,55 @@ class TBEnv(BaseEnv):
         action.apply(self)
 
     def move_to(self, position):
+        move = self.move_to_async(position)
+        if move is not None:
+            target = move.result()
+            self.logger.log_text(self.get_tb_obs() if self.tb.streaming() else f'Moved to {target}')
+
+    def move_to_async(self, position):
+        """
+        Queue a move to an xyz position (clipped to the bounds) behind any
+        moves already queued, see TestBench.move_to_async.
+        :return: future resolving once the target is reached, None if it was rejected
+        """
         position = np.array(position)
         position = np.clip(position, self.min_bounds, self.max_bounds)
         if np.any(position < self.min_bounds):
             self.logger.log_text(f'Position target {position} must be at least min bounds')
-            return
+            return None
         if np.any(position > self.max_bounds):
             self.logger.log_text(f'Position target {position} must be at most max bounds')
-            return
-        self.tb.target_pos(*position)
-        while self.tb.busy():
-            self.tb.update()
-        self.logger.log_text(self.tb.req_data())
+            return None
+        return self.tb.move_to_async(*(int(p) for p in position))
+
+    def commanded_position(self):
+        """
+        Position the testbench ends up at once all queued moves are done. This
+        is tracked locally, the testbench is only queried when it is unknown
+        (at startup, or after a reset or press).
+        """
+        if self.tb.commanded_pos is None:
+            self.tb.wait_idle()
+            tb_state = self.tb.req_data()
+            self.tb.commanded_pos = (tb_state['x'], tb_state['y'], tb_state['z'])
+        return np.array(self.tb.commanded_pos)
 
     def move_delta(self, position):
-        tb_state = self.tb.req_data()
-        x, y, z = tb_state['x'], tb_state['y'], tb_state['z']
-        target = np.array(position) + np.array((x, y, z))
-        self.move_to(target)
+        self.move_to(self.commanded_position() + np.array(position))
+
+    def move_delta_async(self, position):
+        return self.move_to_async(self.commanded_position() + np.array(position))
 
     def move_dyna_to_angle(self, angle):
-        if self.dynamixel_bounds[0] <= angle <= self.dynamixel_bounds[1]:
-            self.dynamixel.move_to_angle(angle)
+        # A list of angles (one per configured id) moves all servos in one sync write
+        if np.isscalar(angle) and len(self.dynamixel.ids) > 1:
+            angle = [angle] * len(self.dynamixel.ids)
+        angles = np.asarray(angle)
+        if np.all(self.dynamixel_bounds[0] <= angles) and np.all(angles <= self.dynamixel_bounds[1]):
+            if np.isscalar(angle):
+                self.dynamixel.move_to_angle(angle)
+            else:
+                self.dynamixel.move_to_angles(angle)
         else:
             self.logger.log_text(f'Dynamixel cannot move to OOB pos {angle}')
 
@@ -125,15 +167,82 @@ class TBEnv(BaseEnv):
         return {c_thread.get_name(): c_thread.get_raw_frame() for c_thread in self.cameras}
 
     def get_tb_obs(self):
+        if self.tb.streaming():
+            return self.tb.latest_data(max_age=self.config.stream_max_age)
         return self.tb.req_data()
 
-    def get_obs(self):
-        obs = {'tb_state': self.get_tb_obs(),
-               'images': self.get_current_image_obs(),
-               'raw_images': self.get_current_raw_image_obs()}
+    def _obs_readers(self):
+        """
+        Readers of the sensors sampled in the background (cameras, streamed
+        telemetry, optoforce, polled Dynamixel) return Timestamped readings,
+        so each observation entry carries the time it was captured rather than
+        the time it was read, see ObservationAssembler
+        """
+        readers = {'tb_state': self._read_tb_state,
+                   'images': self._read_images}
+        if not self.config.skip_raw_images:
+            readers['raw_images'] = lambda: self._read_images(raw=True)
         if self.config.dynamixel:
-            obs['dynamixel_state'] = self.dynamixel.get_current_angle()
+            readers['dynamixel_state'] = lambda: self._read_dynamixel(self.dynamixel.get_current_angle)
+            if len(self.dynamixel.ids) > 1:
+                readers['dynamixel_servos'] = lambda: self._read_dynamixel(self.dynamixel.get_servo_states)
         if self.config.optoforce:
-            obs['optoforce'] = self.optoforce.get_force()
+            readers['optoforce'] = self._read_force
+            window_ms = self.config.optoforce.window_ms
+            if window_ms:
+                readers['optoforce_stats'] = lambda: self.optoforce.window_stats(window_ms)
+                if self.config.optoforce.store_window:
+                    readers['optoforce_window'] = lambda: self._opto_window(window_ms)
+        return readers
+
+    def _read_tb_state(self):
+        tb_state = self.get_tb_obs()
+        # Streamed telemetry carries its host receive time, req_data replies are read synchronously
+        return Timestamped(tb_state, tb_state.get('time'))
+
+    def _read_images(self, raw=False):
+        frames = [c_thread.get_latest() for c_thread in self.cameras]
+        images = {c_thread.get_name(): frame.raw_image if raw else frame.image
+                  for c_thread, frame in zip(self.cameras, frames)}
+        # Stamped with the oldest frame, the one furthest from the other sensors
+        return Timestamped(images, min((frame.timestamp for frame in frames), default=None))
+
+    def _read_dynamixel(self, reader):
+        poller = getattr(self.dynamixel, 'poller', None)
+        if poller is None:
+            return Timestamped(reader(), None)
+        # One snapshot, a state and timestamp read separately could come from two polls
+        state, timestamp = poller.get_snapshot()
+        return Timestamped(reader(state), timestamp)
+
+    def _read_force(self):
+        latest = self.optoforce.history.latest()
+        if latest is None:
+            return Timestamped(None, None)
+        return Timestamped(latest['force'], float(latest['timestamp']))
+
+    def _opto_window(self, window_ms):
+        readings = self.optoforce.window(window_ms)
+        return {'timestamp': readings['timestamp'], 'force': readings['force']}
 
+    def get_obs(self):
+        # All sensors are read in parallel, see ObservationAssembler
+        obs, timing = self.obs_assembler.read()
+        obs['capture_time'] = timing['capture_time']
+        obs['capture_skew'] = timing['skew']
+        if self.config.align_images:
+            self._align_images(obs)
         return obs
+
+    def _align_images(self, obs):
+        """
+        Replace each camera image by the frame captured closest to the moment
+        the testbench state was sampled. Raw images are left as they are.
+        """
+        t = obs['capture_time']['tb_state']
+        for c_thread in self.cameras:
+            # Make sure the frame following t has been captured before picking the closest one
+            c_thread.latest_after(t, timeout=2.0 / c_thread.thread_rate)
+            frame = c_thread.frame_at(t)
+            if frame is not None:
+                obs['images'][c_thread.get_name()] = frame.image
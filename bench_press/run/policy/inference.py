@@ -0,0 +1,157 @@
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from bench_press.models.modules.pretrained_encoder import pretrained_model_normalize
+from bench_press.utils.infra import str_to_class
+
+INFERENCE_MODES = ('eager', 'trace', 'compile')
+
+
+def input_names(num_cameras):
+    """
+    :return: names of the inputs of an exported policy, see _PolicyInputs
+    """
+    return [f'image_{i}' for i in range(num_cameras)] + ['state', 'opto_1', 'opto_2']
+
+
+class _PolicyInputs(nn.Module):
+    """
+    Calls a policy network with positional tensors instead of an input dict, which torch.jit.trace needs
+    """
+
+    def __init__(self, model):
+        super(_PolicyInputs, self).__init__()
+        self.model = model
+
+    def forward(self, images, state, opto_1, opto_2):
+        return self.model({'images': list(images), 'state': state, 'opto_1': opto_1, 'opto_2': opto_2})
+
+
+class OnnxForward:
+    """
+    Runs a policy exported to ONNX (see scripts/quantize_policy.py) with
+    onnxruntime, taking and returning tensors like a traced _PolicyInputs
+    """
+
+    def __init__(self, path, num_threads=None):
+        import onnxruntime
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.names = [i.name for i in self.session.get_inputs()]
+
+    def __call__(self, images, state, opto_1, opto_2):
+        feed = dict(zip(input_names(len(images)), [x.cpu().numpy() for x in list(images) + [state, opto_1, opto_2]]))
+        return torch.from_numpy(self.session.run(None, {name: feed[name] for name in self.names})[0])
+
+
+def load_artifact(path, device, num_threads=None):
+    """
+    :param path: TorchScript (.pt) or ONNX (.onnx) policy written by scripts/quantize_policy.py
+    :return: callable taking (images, state, opto_1, opto_2) tensors, to give to InferenceEngine
+    """
+    if path.endswith('.onnx'):
+        return OnnxForward(path, num_threads)
+    return torch.jit.load(path, map_location=device)
+
+
+class InferenceEngine:
+    """
+    Single-observation forward pass of a policy network, for running on the
+    testbench. Inputs are written into tensors allocated once; images go
+    from uint8 HWC arrays to normalized float tensors with one resize (only
+    if their size differs from final_size) and one fused multiply-add, and
+    cameras the network does not use are skipped. The network runs under
+    torch.inference_mode, either as is (`eager`), traced with
+    torch.jit.trace (`trace`) or compiled with torch.compile (`compile`).
+    Instead of a model, an exported policy can be given as `forward` (see
+    load_artifact).
+    """
+
+    def __init__(self, model, model_conf, device, mode='trace', num_threads=None, forward=None):
+        assert mode in INFERENCE_MODES, f'Inference mode must be one of {INFERENCE_MODES}'
+        assert model is not None or forward is not None, 'Either a model or a forward function is needed'
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        self.model = model.eval() if model is not None else None
+        self.model_conf = model_conf
+        self.device = device
+        self.mode = mode
+        self.final_size = tuple(model_conf.final_size)
+        self.mean = torch.tensor(pretrained_model_normalize.mean, device=device).view(1, 3, 1, 1)
+        self.std = torch.tensor(pretrained_model_normalize.std, device=device).view(1, 3, 1, 1)
+        self.scale = 1.0 / (255.0 * self.std)
+        self.shift = -self.mean / self.std
+        self.images, self.used_cameras = None, None
+        self.state = torch.zeros(1, model_conf.state_dim or 4, device=device)
+        self.opto_1 = torch.zeros(1, model_conf.opto_dim or 1, device=device)
+        self.opto_2 = torch.zeros(1, model_conf.opto_dim or 1, device=device)
+        self.forward = forward
+
+    def _setup(self, num_cameras):
+        """
+        Allocate the image inputs and trace or compile the network, once the number of cameras is known
+        """
+        self.images = [torch.zeros((1, 3) + self.final_size, device=self.device) for _ in range(num_cameras)]
+        self.used_cameras = list(range(num_cameras))
+        if self.model_conf.image_inputs is not None:
+            # PolicyNetwork indexes its cameras among the sorted input sources
+            sources = getattr(str_to_class(self.model_conf.type), 'input_sources', None)
+            if sources is not None and len(sources) == num_cameras:
+                self.used_cameras = [sources.index(name) for name in self.model_conf.image_inputs]
+        if self.forward is not None:
+            return
+
+        wrapped = _PolicyInputs(self.model).eval()
+        if self.mode == 'trace':
+            try:
+                with torch.inference_mode():
+                    self.forward = torch.jit.freeze(torch.jit.trace(wrapped, self._inputs(), check_trace=False))
+            except Exception as e:
+                print(f'Tracing the policy failed ({e}), running it in eager mode')
+                self.forward = wrapped
+        elif self.mode == 'compile':
+            self.forward = torch.compile(wrapped)
+        else:
+            self.forward = wrapped
+
+    def _inputs(self):
+        return tuple(self.images), self.state, self.opto_1, self.opto_2
+
+    def _load_image(self, image, out):
+        x = torch.from_numpy(np.ascontiguousarray(image)).to(self.device).permute(2, 0, 1)[None].float()
+        if x.shape[-2:] != self.final_size:
+            x = F.interpolate(x, size=self.final_size, mode='bilinear', align_corners=False, antialias=True)
+        torch.addcmul(self.shift, x, self.scale, out=out)
+
+    def warmup(self, num_cameras, iterations=5):
+        """
+        Run the network on dummy inputs, so tracing, compilation and memory
+        allocation do not happen on the first real step
+        """
+        if self.images is None:
+            self._setup(num_cameras)
+        with torch.inference_mode():
+            for _ in range(iterations):
+                self.forward(*self._inputs())
+
+    @torch.inference_mode()
+    def __call__(self, images, state, opto_1=None, opto_2=None):
+        """
+        :param images: list of HWC uint8 arrays, as returned by obs_to_images
+        :param state: normalized float32 state vector
+        :param opto_1: normalized optoforce readings at the press, if the network uses them
+        :param opto_2: normalized current optoforce readings, if the network uses them
+        :return: network output for the observation, as a numpy array of shape (1, action_dim)
+        """
+        if self.images is None:
+            self._setup(len(images))
+        for i in self.used_cameras:
+            self._load_image(images[i], self.images[i])
+        self.state.copy_(torch.from_numpy(state)[None])
+        if opto_1 is not None:
+            self.opto_1.copy_(torch.from_numpy(opto_1)[None])
+            self.opto_2.copy_(torch.from_numpy(opto_2)[None])
+        return self.forward(*self._inputs()).cpu().numpy()
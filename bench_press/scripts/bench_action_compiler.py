@@ -0,0 +1,72 @@
+import argparse
+import time
+
+import attrdict
+import deepdish as dd
+import numpy as np
+from bench_press.run.actions.action import DeltaAction, DynamixelAngleAction, SequentialAction
+from bench_press.run.actions.compiler import ActionCompiler
+from bench_press.run.policy.random_press_policy import RandomPressPolicy
+
+
+def actions_from_log(filename, order):
+    """
+    Reconstruct the actions of a recorded rollout (record_<n>.h5 written by
+    Logger.log_obs) from consecutive observations, as NNPolicy emits them:
+    one DeltaAction per axis in `order`, then the gripper command.
+    :return: list of (action, start position, start angle) per step
+    """
+    observations = dd.io.load(filename)
+    steps = []
+    for prev, curr in zip(observations[:-1], observations[1:]):
+        start = np.array([prev['tb_state'][k] for k in 'xyz'])
+        delta = np.array([curr['tb_state'][k] for k in 'xyz']) - start
+        actions = [DeltaAction(np.where(np.arange(3) == 'xyz'.index(axis), delta, 0)) for axis in order]
+        if 'dynamixel_state' in curr:
+            actions.append(DynamixelAngleAction(curr['dynamixel_state']))
+        steps.append((SequentialAction(actions), start, prev.get('dynamixel_state')))
+    return steps
+
+
+def random_press_actions(num_rollouts, max_steps, rad):
+    policy = RandomPressPolicy(attrdict.AttrDict({'x_rad': rad, 'y_rad': rad, 'z_rad': 0}))
+    steps = []
+    for _ in range(num_rollouts):
+        for num_steps in range(max_steps):
+            steps.append((policy.get_action(None, num_steps), None, None))
+    return steps
+
+
+def bench(steps, compiler):
+    num_before, num_after, time_before, time_after, compile_time = 0, 0, 0.0, 0.0, 0.0
+    for action, start_pos, start_angle in steps:
+        start = time.perf_counter()
+        plan = compiler.compile(action, start_pos, start_angle)
+        compile_time += time.perf_counter() - start
+        num_before += plan.num_original
+        num_after += len(plan)
+        time_before += plan.original_time
+        time_after += plan.estimated_time
+    print(f'{len(steps)} steps: {num_before} -> {num_after} actions, estimated execution time '
+          f'{time_before:.1f}s -> {time_after:.1f}s ({100 * (1 - time_after / max(time_before, 1e-9)):.1f}% saved)')
+    print(f'compile time: {1e6 * compile_time / max(len(steps), 1):.1f} us per step')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='estimate the gains of the action compiler on recorded rollouts')
+    parser.add_argument('logs', nargs='*', help='record_<n>.h5 rollout logs')
+    parser.add_argument('--order', action='store', default='xyz',
+                        help='axis order the actions of the logs were issued in (NNPolicy `order`)')
+    parser.add_argument('--random_press', action='store', type=int, default=0,
+                        help='also benchmark this many RandomPressPolicy rollouts')
+    parser.add_argument('--max_steps', action='store', type=int, default=20)
+    parser.add_argument('--merge_planar', action='store_true', help='also merge xy deltas into diagonal moves')
+    args = parser.parse_args()
+
+    compiler = ActionCompiler(merge_planar=args.merge_planar)
+    if args.logs:
+        print(f'Recorded logs ({len(args.logs)} files):')
+        bench([step for log in args.logs for step in actions_from_log(log, args.order)], compiler)
+    if args.random_press:
+        print(f'RandomPressPolicy ({args.random_press} rollouts):')
+        bench(random_press_actions(args.random_press, args.max_steps, 200), compiler)
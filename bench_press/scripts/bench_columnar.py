@@ -0,0 +1,60 @@
+import argparse
+import glob
+import os
+import tempfile
+import time
+
+import deepdish as dd
+import numpy as np
+from bench_press.utils.columnar import ColumnarTrajectory, convert_record
+from bench_press.utils.obs_to_np import obs_to_images, obs_to_state
+
+
+def deepdish_sample(file_name, step):
+    return dd.io.load(file_name, group=[f'/data/i{step}', f'/data/i{step + 1}'])
+
+
+def columnar_sample(trajectories, file_name, step):
+    if file_name not in trajectories:
+        trajectories[file_name] = ColumnarTrajectory(file_name)
+    return trajectories[file_name].observations([step, step + 1])
+
+
+def bench(name, load_sample, index, num_samples):
+    """
+    Reads random (step, step + 1) pairs like TBDataset.__getitem__ and turns
+    them into model inputs.
+    """
+    rng = np.random.RandomState(0)
+    start = time.perf_counter()
+    for i in rng.randint(0, len(index), num_samples):
+        file_name, step = index[i]
+        obs_1, obs_2 = load_sample(file_name, step)
+        obs_to_images(obs_1)
+        obs_to_state(obs_1, None)
+    elapsed = time.perf_counter() - start
+    print(f'{name}: {num_samples / elapsed:.1f} samples/s')
+    return num_samples / elapsed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare sample loading speed of deepdish logs and columnar files')
+    parser.add_argument('folder', action='store', help='folder of deepdish rollout logs')
+    parser.add_argument('-n', '--num_samples', action='store', type=int, default=500)
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(f'{args.folder}/**/*.h5', recursive=True))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        converted = {}
+        for i, f in enumerate(files):
+            converted[f] = os.path.join(tmp_dir, f'{i}.h5')
+            convert_record(f, converted[f])
+        lengths = [len(ColumnarTrajectory(converted[f])) - 1 for f in files]
+        index = [(f, step) for f, length in zip(files, lengths) for step in range(length)]
+        print(f'{len(files)} rollouts, {len(index)} samples')
+
+        dd_rate = bench('deepdish', deepdish_sample, index, args.num_samples)
+        trajectories = {}
+        col_rate = bench('columnar', lambda f, step: columnar_sample(trajectories, converted[f], step), index,
+                         args.num_samples)
+        print(f'speedup: {col_rate / dd_rate:.1f}x')
@@ -0,0 +1,96 @@
+import argparse
+import tempfile
+import time
+
+import deepdish as dd
+import numpy as np
+import torch
+from bench_press.models.datasets.transforms import ImageTransform
+from bench_press.models.modules.pretrained_encoder import pretrained_model_normalize
+from bench_press.run.policy.inference import INFERENCE_MODES, InferenceEngine
+from bench_press.utils.infra import str_to_class, deep_map
+from bench_press.utils.obs_to_np import obs_to_images, obs_to_state
+from omegaconf import OmegaConf
+from torchvision import transforms
+
+
+class LegacyForward:
+    """
+    The forward pass NNPolicy used before InferenceEngine: per-step PIL
+    transforms, deep_map conversions and an eager model call
+    """
+
+    def __init__(self, model, final_size, device):
+        self.model, self.device = model, device
+        self.transform = transforms.Compose([
+            ImageTransform(transforms.ToPILImage()),
+            ImageTransform(transforms.Resize(tuple(final_size))),
+            ImageTransform(transforms.ToTensor()),
+            ImageTransform(pretrained_model_normalize),
+        ])
+
+    def __call__(self, images, state):
+        inp = self.transform({'state': state[None], 'images': images})
+        inp = deep_map(lambda x: torch.from_numpy(x) if not isinstance(x, torch.Tensor) else x, inp)
+        inp = deep_map(lambda x: x.to(self.device), inp)
+        for i, img in enumerate(inp['images']):
+            inp['images'][i] = img[None]
+        return self.model(inp).cpu().detach().numpy()
+
+
+def load_observations(logs, final_size, num_steps):
+    if logs:
+        observations = [obs for log in logs for obs in dd.io.load(log)]
+    else:
+        rng = np.random.RandomState(0)
+        observations = [{
+            'images': {cam: rng.randint(0, 256, tuple(final_size) + (3,), dtype=np.uint8)
+                       for cam in ('external', 'gelsight_side', 'gelsight_top')},
+            'tb_state': {'x': rng.randint(0, 8000), 'y': rng.randint(0, 12000), 'z': rng.randint(0, 1850)},
+            'dynamixel_state': 0.0,
+        } for _ in range(64)]
+    return [observations[i % len(observations)] for i in range(num_steps)]
+
+
+def bench(name, forward, observations, state_norm):
+    latencies, outputs = [], []
+    for obs in observations:
+        start = time.perf_counter()
+        state = obs_to_state(obs, state_norm).astype(np.float32)
+        outputs.append(forward(obs_to_images(obs), state))
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1e3
+    print(f'{name:>8}: p50 {np.percentile(latencies, 50):7.2f} ms, p99 {np.percentile(latencies, 99):7.2f} ms, '
+          f'mean {latencies.mean():7.2f} ms')
+    return np.concatenate(outputs)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='per-step latency of the policy forward pass on recorded observations')
+    parser.add_argument('model_conf', action='store', help='training config (conf.yaml of an experiment)')
+    parser.add_argument('logs', nargs='*', help='rollout logs to replay, random observations if none')
+    parser.add_argument('--checkpoint', action='store', help='weights to load, random weights if not given')
+    parser.add_argument('--modes', nargs='+', default=list(INFERENCE_MODES), choices=INFERENCE_MODES)
+    parser.add_argument('--threads', action='store', type=int)
+    parser.add_argument('-n', '--num_steps', action='store', type=int, default=200)
+    args = parser.parse_args()
+
+    conf = OmegaConf.load(args.model_conf)
+    device = torch.device('cpu')
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    with tempfile.TemporaryDirectory() as exp_dir:
+        model = str_to_class(conf.model.type)(conf.model, exp_dir).to(device)
+    if args.checkpoint:
+        model.load_state_dict(torch.load(args.checkpoint, map_location=device)['state_dict'])
+    model.eval()
+    state_norm = conf.dataset.norms.state if conf.dataset.norms else None
+    observations = load_observations(args.logs, conf.model.final_size, args.num_steps)
+    print(f'{len(observations)} steps, {torch.get_num_threads()} threads')
+
+    reference = bench('legacy', LegacyForward(model, conf.model.final_size, device), observations, state_norm)
+    for mode in args.modes:
+        engine = InferenceEngine(model, conf.model, device, mode=mode)
+        engine.warmup(len(observations[0]['images']))
+        outputs = bench(mode, engine, observations, state_norm)
+        print(f'{"":>8}  max abs difference to legacy outputs: {np.abs(outputs - reference).max():.2e}')
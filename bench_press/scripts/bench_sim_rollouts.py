@@ -0,0 +1,63 @@
+import argparse
+import multiprocessing
+import queue
+import time
+
+from bench_press.utils.infra import str_to_class
+from omegaconf import OmegaConf
+
+
+def run_worker(config_file, worker_idx, num_rollouts, results):
+    conf = OmegaConf.load(config_file)
+    conf.logger.log_folder = f'{conf.logger.log_folder}/worker_{worker_idx}'
+    if conf.env.sim:
+        conf.env.sim.seed = worker_idx
+    agent = str_to_class(conf.agent.type)(conf)
+    policy = str_to_class(conf.policy.type)(conf.policy)
+
+    num_steps = 0
+    start = time.time()
+    for rollout_idx in range(num_rollouts):
+        num_steps += agent.rollout(policy, rollout_idx)
+    elapsed = time.time() - start
+    agent.env.clean_up()
+    results.put((worker_idx, num_steps, elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='measure rollout throughput on parallel simulated testbenches')
+    parser.add_argument('config_file', action='store')
+    parser.add_argument('-n', '--num_envs', action='store', type=int, default=4)
+    parser.add_argument('-r', '--num_rollouts', action='store', type=int, default=5)
+    parser.add_argument('--timeout', action='store', type=float, default=600,
+                        help='seconds to wait for all workers to finish')
+    args = parser.parse_args()
+
+    # Plain processes rather than a Pool: pool workers are daemonic and could not start their emulator processes
+    results = multiprocessing.Queue()
+    workers = [multiprocessing.Process(target=run_worker, args=(args.config_file, i, args.num_rollouts, results))
+               for i in range(args.num_envs)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    collected = []
+    while len(collected) < len(workers):
+        try:
+            collected.append(results.get(timeout=1))
+        except queue.Empty:
+            # A worker that crashed (e.g. its emulator or env failed to start) never reports
+            exitcodes = {i: worker.exitcode for i, worker in enumerate(workers) if worker.exitcode not in (None, 0)}
+            if exitcodes or time.time() - start > args.timeout:
+                for worker in workers:
+                    worker.terminate()
+                raise RuntimeError(f'Workers failed with exit codes {exitcodes}' if exitcodes else
+                                   f'No results from {len(workers) - len(collected)} workers after {args.timeout}s')
+    results = sorted(collected)
+    wall = time.time() - start
+    for worker in workers:
+        worker.join()
+
+    total_steps = sum(steps for _, steps, _ in results)
+    for i, steps, elapsed in results:
+        print(f'env {i}: {steps} steps in {elapsed:.2f}s ({steps / elapsed:.1f} steps/s)')
+    print(f'total: {total_steps} steps in {wall:.2f}s ({total_steps / wall:.1f} steps/s over {args.num_envs} envs)')
@@ -0,0 +1,74 @@
+import argparse
+import time
+
+import numpy as np
+import serial
+from bench_press.tb_control.tb_emulator import TBEmulator
+from bench_press.tb_control.testbench_control import TestBench
+
+
+def legacy_wait_idle(ser):
+    """
+    Reproduces the old `while tb.busy(): tb.update()` loop, reading one
+    character at a time until an idle message arrives.
+    """
+    curr_msg = ''
+    while True:
+        for i in range(ser.inWaiting()):
+            ch = ser.read().decode()
+            if ch == '\n':
+                if any([curr_msg.startswith(key) for key in TestBench.IDLE_MSGS]):
+                    return
+                curr_msg = ''
+            else:
+                curr_msg += ch
+
+
+def bench_legacy(emulator, num_moves):
+    ser = serial.Serial(emulator.port_name, baudrate=250000, timeout=1)
+    latencies = []
+    for i in range(num_moves):
+        ser.write(f'x{i}y{i}z0\n'.encode())
+        ser.flush()
+        legacy_wait_idle(ser)
+        latencies.append(time.monotonic() - emulator.last_reply_time)
+    ser.close()
+    return latencies
+
+
+def bench_threaded(emulator, num_moves):
+    """
+    Waits with TestBench.wait_idle. The reply is read on the SerialReaderThread
+    and the caller is woken by a condition variable, so the latency includes two
+    thread wake-ups that the busy loop of bench_legacy does not pay for.
+    """
+    tb = TestBench(emulator.port_name, verbose=False)
+    tb.wait_ready(timeout=5)
+    latencies = []
+    for i in range(num_moves):
+        tb.target_pos(i, i, 0)
+        tb.wait_idle()
+        latencies.append(time.monotonic() - emulator.last_reply_time)
+    tb.close()
+    return latencies
+
+
+def run_bench(name, bench_fn, num_moves, move_time):
+    emulator = TBEmulator(move_time=move_time).start()
+    cpu_start, wall_start = time.process_time(), time.monotonic()
+    latencies = np.array(bench_fn(emulator, num_moves)) * 1e6
+    cpu, wall = time.process_time() - cpu_start, time.monotonic() - wall_start
+    emulator.stop()
+    print(f'{name:>9}: cpu {100 * cpu / wall:5.1f}% of one core | '
+          f'wake-up latency p50 {np.percentile(latencies, 50):7.1f} us, '
+          f'p99 {np.percentile(latencies, 99):7.1f} us, max {latencies.max():7.1f} us')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='benchmark testbench serial waiting against the emulator')
+    parser.add_argument('--num_moves', action='store', type=int, default=100)
+    parser.add_argument('--move_time', action='store', type=float, default=0.02)
+    args = parser.parse_args()
+
+    run_bench('legacy', bench_legacy, args.num_moves, args.move_time)
+    run_bench('threaded', bench_threaded, args.num_moves, args.move_time)
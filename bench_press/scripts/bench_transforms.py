@@ -0,0 +1,96 @@
+import argparse
+import time
+
+import deepdish as dd
+import numpy as np
+import torch
+from bench_press.models.datasets.transforms import BatchImageTransform, ImageTransform, to_chw_tensor
+from bench_press.models.modules.pretrained_encoder import pretrained_model_normalize
+from bench_press.utils.obs_to_np import obs_to_images
+from torch.utils.data.dataloader import default_collate
+from torchvision import transforms
+
+
+def pil_transform(final_size, augment_prob, brightness, hue):
+    # Same pipeline as Trainer without batch_transforms
+    return transforms.Compose([
+        ImageTransform(transforms.ToPILImage()),
+        transforms.RandomApply([
+            ImageTransform(transforms.ColorJitter(brightness=brightness, contrast=0, saturation=0, hue=hue)),
+            ImageTransform(transforms.RandomResizedCrop(final_size, scale=(0.9, 1.0)))
+        ], p=augment_prob),
+        ImageTransform(transforms.Resize(final_size)),
+        ImageTransform(transforms.ToTensor()),
+        ImageTransform(pretrained_model_normalize)
+    ])
+
+
+def load_images(logs, num_cameras, size, num_images):
+    """
+    :return: list of samples, each a list of HWC uint8 images (one per camera),
+        from rollout logs if given, random otherwise
+    """
+    if logs:
+        samples = [obs_to_images(obs) for log in logs for obs in dd.io.load(log)]
+        return [samples[i % len(samples)] for i in range(num_images)]
+    rng = np.random.RandomState(0)
+    return [[rng.randint(0, 256, size + (3,), dtype=np.uint8) for _ in range(num_cameras)]
+            for _ in range(num_images)]
+
+
+def bench_pil(samples, transform, batch_size):
+    outputs = []
+    start = time.perf_counter()
+    for i in range(0, len(samples), batch_size):
+        batch = [transform({'images': list(images)})['images'] for images in samples[i:i + batch_size]]
+        outputs.append(default_collate(batch))
+    return time.perf_counter() - start, outputs
+
+
+def bench_batched(samples, transform, batch_size, device):
+    to_tensor = ImageTransform(to_chw_tensor)
+    outputs = []
+    start = time.perf_counter()
+    for i in range(0, len(samples), batch_size):
+        batch = default_collate([to_tensor({'images': list(images)})['images'] for images in samples[i:i + batch_size]])
+        outputs.append(transform([images.to(device) for images in batch]))
+    if device.type == 'cuda':
+        torch.cuda.synchronize()
+    return time.perf_counter() - start, outputs
+
+
+def channel_stats(outputs):
+    images = torch.cat([batch[0].float().cpu() for batch in outputs])
+    return images.mean(dim=(0, 2, 3)).numpy(), images.std(dim=(0, 2, 3)).numpy()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='compare the per-sample PIL transforms with BatchImageTransform')
+    parser.add_argument('logs', nargs='*', help='rollout logs to take images from, random images if none')
+    parser.add_argument('-n', '--num_images', action='store', type=int, default=2048)
+    parser.add_argument('--batch_size', action='store', type=int, default=64)
+    parser.add_argument('--cameras', action='store', type=int, default=2)
+    parser.add_argument('--size', action='store', type=int, nargs=2, default=[240, 320])
+    parser.add_argument('--final_size', action='store', type=int, nargs=2, default=[48, 64])
+    parser.add_argument('--augment_prob', action='store', type=float, default=0.5)
+    parser.add_argument('--brightness', action='store', type=float, default=0.3)
+    parser.add_argument('--hue', action='store', type=float, default=0.05)
+    parser.add_argument('--cpu', action='store_true', help='run the batched transforms on the CPU even with a GPU')
+    args = parser.parse_args()
+
+    device = torch.device('cuda' if torch.cuda.is_available() and not args.cpu else 'cpu')
+    final_size = tuple(args.final_size)
+    samples = load_images(args.logs, args.cameras, tuple(args.size), args.num_images)
+    print(f'{len(samples)} samples with {len(samples[0])} cameras of {samples[0][0].shape}, batched on {device}')
+
+    pil_time, pil_out = bench_pil(samples, pil_transform(final_size, args.augment_prob, args.brightness, args.hue),
+                                  args.batch_size)
+    batch_transform = BatchImageTransform(final_size, args.augment_prob, args.brightness, args.hue)
+    bench_batched(samples[:args.batch_size], batch_transform, args.batch_size, device)  # Warm up
+    batched_time, batched_out = bench_batched(samples, batch_transform, args.batch_size, device)
+
+    print(f'PIL:     {len(samples) / pil_time:.1f} samples/s')
+    print(f'batched: {len(samples) / batched_time:.1f} samples/s ({pil_time / batched_time:.1f}x)')
+    for name, outputs in (('PIL', pil_out), ('batched', batched_out)):
+        mean, std = channel_stats(outputs)
+        print(f'{name:8} camera 0 channel mean {np.round(mean, 3)}, std {np.round(std, 3)}')
@@ -0,0 +1,31 @@
+import argparse
+import glob
+import os
+from functools import partial
+from multiprocessing import Pool
+
+from bench_press.utils.columnar import convert_record
+
+
+def convert(src, in_folder, out_folder, compression):
+    dst = os.path.join(out_folder, os.path.relpath(src, in_folder))
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    convert_record(src, dst, compression=compression)
+    return dst
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='convert deepdish rollout logs to the columnar trajectory format')
+    parser.add_argument('in_folder', action='store', help='folder searched recursively for .h5 rollout logs')
+    parser.add_argument('out_folder', action='store', help='converted files keep their path relative to in_folder')
+    parser.add_argument('-w', '--workers', action='store', type=int, default=4)
+    parser.add_argument('--compression', action='store', default='lzf', help="h5py compression filter, or 'none'")
+    args = parser.parse_args()
+
+    files = glob.glob(f'{args.in_folder}/**/*.h5', recursive=True)
+    compression = None if args.compression == 'none' else args.compression
+    with Pool(args.workers) as pool:
+        for dst in pool.imap_unordered(partial(convert, in_folder=args.in_folder, out_folder=args.out_folder,
+                                               compression=compression), files):
+            print(dst)
+    print(f'Converted {len(files)} files')
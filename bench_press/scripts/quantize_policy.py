@@ -0,0 +1,188 @@
+import argparse
+import copy
+import glob
+import io
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from bench_press.models.datasets.transforms import BatchImageTransform, ImageTransform, to_chw_tensor
+from bench_press.models.modules.shared_encoder import SharedCameraEncoder
+from bench_press.run.policy.inference import _PolicyInputs, input_names, load_artifact
+from bench_press.scripts.train_policy import make_dataset, split_dataset
+from bench_press.utils.infra import str_to_class
+from omegaconf import OmegaConf
+from torch.ao.quantization import get_default_qconfig_mapping, quantize_dynamic
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+QUANTIZATION_MODES = ('dynamic', 'static')
+
+
+def encoder_slots(model):
+    """
+    :return: (parent module, attribute name) of each image encoder trunk of a PolicyNetwork
+    """
+    if isinstance(model.image_encoders, SharedCameraEncoder):
+        return [(model.image_encoders, 'trunk')]
+    return [(model.image_encoders, str(i)) for i in range(len(model.image_encoders))]
+
+
+def quantize(model, mode, calibration_inputs):
+    """
+    int8 copy of a PolicyNetwork for CPU inference. Linear layers are always
+    quantized dynamically. In `static` mode the encoder trunks are also
+    quantized with FX graph mode, with activation ranges observed on
+    calibration_inputs.
+    """
+    model = copy.deepcopy(model).eval()
+    if mode == 'static':
+        qconfig_mapping = get_default_qconfig_mapping(torch.backends.quantized.engine)
+        example = (torch.zeros((1, 3) + tuple(model.conf.final_size)),)
+        for parent, name in encoder_slots(model):
+            setattr(parent, name, prepare_fx(getattr(parent, name), qconfig_mapping, example))
+        with torch.no_grad():
+            for inputs in calibration_inputs:
+                model(inputs)
+        for parent, name in encoder_slots(model):
+            setattr(parent, name, convert_fx(getattr(parent, name)))
+    return quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8)
+
+
+class Experiment:
+    """
+    Model and train/val split of a training run, rebuilt like Trainer does
+    (same seeds before the model and dataset are made, so the same split),
+    without its summary writer, optimizer or feature cache. Images are
+    resized and normalized without augmentation, as in validation.
+    """
+
+    def __init__(self, exp_dir, checkpoint=None):
+        self.conf = OmegaConf.load(os.path.join(exp_dir, 'conf.yaml'))
+        torch.manual_seed(self.conf.seed)
+        np.random.seed(self.conf.seed)
+        self.model = str_to_class(self.conf.model.type)(self.conf.model, exp_dir)
+        self.dataset = make_dataset(self.conf)
+        self.dataset.transform = ImageTransform(to_chw_tensor)
+        self.train_dataset, self.val_dataset = split_dataset(self.dataset, self.conf.train_frac)
+        self.batch_transform = BatchImageTransform(self.conf.model.final_size)
+        if checkpoint is None:
+            weights = os.path.join(exp_dir, 'weights')
+            checkpoint = os.path.join(weights, max(os.listdir(weights),
+                                                   key=lambda f: int(''.join(filter(str.isdigit, f)))))
+        print(f'Loading checkpoint from file {checkpoint}')
+        self.model.load_state_dict(torch.load(checkpoint, map_location='cpu')['state_dict'])
+        self.model.eval()
+
+    def dataloader(self, subset):
+        workers = self.conf.dataset.dataloader_workers or 0
+        return torch.utils.data.DataLoader(subset, batch_size=self.conf.model.batch_size,
+                                           num_workers=workers if workers > 1 else 0)
+
+    def to_inputs(self, batch):
+        return dict(batch, images=self.batch_transform(batch['images']))
+
+
+def positional_inputs(inputs, model_conf):
+    batch_size = inputs['state'].shape[0]
+    opto = [inputs[k] if k in inputs else torch.zeros(batch_size, model_conf.opto_dim or 1)
+            for k in ('opto_1', 'opto_2')]
+    return (tuple(inputs['images']), inputs['state'], *opto)
+
+
+def evaluate(forward, experiment):
+    """
+    :return: dict of the validation MSE, overall and of x, y and z, of a forward function taking positional inputs
+    """
+    errors = []
+    with torch.no_grad():
+        for batch in experiment.dataloader(experiment.val_dataset):
+            inputs = experiment.to_inputs(batch)
+            output = forward(*positional_inputs(inputs, experiment.conf.model))
+            errors.append(((output - inputs['label']) ** 2).numpy())
+    errors = np.concatenate(errors)
+    return {'loss': float(errors.mean()), 'xloss': float(errors[:, 0].mean()),
+            'yloss': float(errors[:, 1].mean()), 'zloss': float(errors[:, 2].mean())}
+
+
+def latency(forward, inputs, iterations):
+    """
+    :return: p50 and p99 latency in ms of forward on single samples of inputs
+    """
+    times = []
+    with torch.inference_mode():
+        for i in range(iterations + 5):
+            idx = i % inputs[1].shape[0]
+            sample = (tuple(x[idx:idx + 1] for x in inputs[0]),) + tuple(x[idx:idx + 1] for x in inputs[1:])
+            start = time.perf_counter()
+            forward(*sample)
+            if i >= 5:
+                times.append(time.perf_counter() - start)
+    times = np.array(times) * 1e3
+    return float(np.percentile(times, 50)), float(np.percentile(times, 99))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='quantize and export a trained policy for CPU inference')
+    parser.add_argument('exp_dir', action='store', help='experiment directory with conf.yaml and weights/')
+    parser.add_argument('--mode', action='store', default='static', choices=QUANTIZATION_MODES)
+    parser.add_argument('--checkpoint', action='store', help='weights to export, the latest in weights/ by default')
+    parser.add_argument('--calibration_batches', action='store', type=int, default=16)
+    parser.add_argument('--latency_steps', action='store', type=int, default=100)
+    parser.add_argument('--out_dir', action='store', help='defaults to <exp_dir>/export')
+    parser.add_argument('--skip_onnx', action='store_true')
+    args = parser.parse_args()
+
+    experiment = Experiment(args.exp_dir, args.checkpoint)
+    conf, model = experiment.conf, experiment.model
+    out_dir = args.out_dir or os.path.join(args.exp_dir, 'export')
+    os.makedirs(out_dir, exist_ok=True)
+
+    # Calibrate on training samples, without augmentation
+    calibration_inputs = []
+    for batch in experiment.dataloader(experiment.train_dataset):
+        if len(calibration_inputs) == args.calibration_batches:
+            break
+        calibration_inputs.append(experiment.to_inputs(batch))
+    quantized = quantize(model, args.mode, calibration_inputs)
+
+    example = positional_inputs(calibration_inputs[0], conf.model)
+    single = (tuple(x[:1] for x in example[0]),) + tuple(x[:1] for x in example[1:])
+    artifacts = {}
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(_PolicyInputs(quantized).eval(), single, check_trace=False))
+    artifacts[f'int8_{args.mode}'] = os.path.join(out_dir, f'policy_int8_{args.mode}.pt')
+    torch.jit.save(traced, artifacts[f'int8_{args.mode}'])
+    if not args.skip_onnx:
+        names = input_names(len(single[0]))
+        artifacts['onnx'] = os.path.join(out_dir, 'policy.onnx')
+        torch.onnx.export(_PolicyInputs(model).eval(), single, artifacts['onnx'], input_names=names,
+                          output_names=['action'], dynamic_axes={name: {0: 'batch'} for name in names})
+
+    weights = io.BytesIO()
+    torch.save(model.state_dict(), weights)
+    forwards = {'fp32': (_PolicyInputs(model).eval(), weights.getbuffer().nbytes)}
+    for name, path in artifacts.items():
+        try:
+            # ONNX may keep the weights in a separate <path>.data file
+            size = sum(os.path.getsize(f) for f in glob.glob(f'{path}*'))
+            forwards[name] = (load_artifact(path, torch.device('cpu')), size)
+        except ImportError as e:
+            print(f'Not evaluating {path}: {e}')
+
+    report = {}
+    for name, (forward, size) in forwards.items():
+        metrics = evaluate(forward, experiment)
+        metrics['p50_ms'], metrics['p99_ms'] = latency(forward, example, args.latency_steps)
+        # Size of the serialized weights, not the memory used while running them
+        metrics['checkpoint_mb'] = size / 2 ** 20
+        report[name] = metrics
+    for name, metrics in report.items():
+        metrics['loss_delta'] = metrics['loss'] - report['fp32']['loss']
+        print(f'{name:>12}: val loss {metrics["loss"]:.5f} ({metrics["loss_delta"]:+.5f}), '
+              f'x {metrics["xloss"]:.5f}, y {metrics["yloss"]:.5f}, z {metrics["zloss"]:.5f}, '
+              f'p50 {metrics["p50_ms"]:6.2f} ms, p99 {metrics["p99_ms"]:6.2f} ms, '
+              f'checkpoint {metrics["checkpoint_mb"]:6.1f} MB')
+    OmegaConf.save(OmegaConf.create(report), os.path.join(out_dir, 'report.yaml'))
+    print(f'Wrote {", ".join(artifacts.values())} and report.yaml; set model_artifact in the policy config to use one')
@@ -2,13 +2,16 @@ import argparse
 import copy
 import os
 import sys
+import time
 
 import numpy as np
 import torch
 import torchvision
-from bench_press.models.datasets.tb_dataset import TBDataset
+from bench_press.models.datasets.feature_cache import FeatureBatchDataset, FeatureStore, module_fingerprint
+from bench_press.models.datasets.samplers import FileBatchDataset, FileChunkBatchSampler
 from bench_press.models.datasets.tb_dataset_subset import TBDatasetSubset
-from bench_press.models.datasets.transforms import ImageTransform
+from bench_press.models.datasets.training_cache import _hash, _plain
+from bench_press.models.datasets.transforms import BatchImageTransform, ImageTransform, to_chw_tensor
 from bench_press.models.modules.pretrained_encoder import pretrained_model_normalize
 from bench_press.utils.infra import str_to_class, deep_map
 from bench_press.utils.obs_to_np import denormalize_action, denormalize
@@ -19,6 +22,25 @@ from torchvision import transforms
 from tqdm import tqdm
 
 
+def make_dataset(conf):
+    """
+    :return: the dataset of a training config, with its filter for TBDatasetSubset
+    """
+    dataset_class = str_to_class(conf.dataset.type)
+    if dataset_class is TBDatasetSubset:
+        filter_class = str_to_class(conf.dataset.filter) if conf.dataset.filter else None
+        return dataset_class(conf.dataset, filter_class)
+    return dataset_class(conf.dataset)
+
+
+def split_dataset(dataset, train_frac):
+    """
+    :return: random train and val subsets, drawn from torch's global RNG
+    """
+    train_len = int(train_frac * len(dataset))
+    return torch.utils.data.random_split(dataset, [train_len, len(dataset) - train_len])
+
+
 class Trainer:
 
     def __init__(self, conf, resume_dir):
@@ -28,25 +50,108 @@ class Trainer:
             self.device = torch.device('cuda')
         else:
             self.device = torch.device('cpu')
+        self._set_precision()
         self.model_class = str_to_class(conf.model.type)
         self.model = self.model_class(conf.model, resume_dir).to(self.device)
+        if self.conf.channels_last:
+            # Only affects 4D weights, i.e. the convolutions of the image encoders
+            self.model = self.model.to(memory_format=torch.channels_last)
         print(list(self.conf.model.final_size)[::-1])
-        self.dataset_class = str_to_class(conf.dataset.type)
-        if self.conf.dataset.filter:
-            self.filter_class = str_to_class(conf.dataset.filter)
+        self.dataset = make_dataset(conf)
+        self.total_dataset_len = len(self.dataset)
+        self.train_dataset, self.val_dataset = split_dataset(self.dataset, conf.train_frac)
+        if self.conf.batch_transforms:
+            self._make_batch_transforms()
         else:
-            self.filter_class = None
-        if self.dataset_class is TBDataset:
-            self.dataset = self.dataset_class(conf.dataset)
-        elif self.dataset_class is TBDatasetSubset:
-            self.dataset = self.dataset_class(conf.dataset, self.filter_class)
+            self._make_sample_transforms()
+
+        self.train_dataloader = self._make_dataloader(self.train_dataset)
+        self.val_dataloader = self._make_dataloader(self.val_dataset)
+        if self.conf.feature_cache_dir:
+            self._make_feature_dataloaders()
+
+        self.optimizer = torch.optim.Adam(self.model.parameters())
+        self.summary_writer = self._make_summary_writer()
+        self.global_step = 0
+        self.start_epoch = 0
+
+        if resume_dir is not None:
+            self.start_epoch = self._load_most_recent_chkpt()
+
+        self.current_epoch = self.start_epoch
+
+    def _make_dataloader(self, subset):
+        kwargs = {}
+        if self.conf.dataset.dataloader_workers > 1:
+            kwargs['num_workers'] = self.conf.dataset.dataloader_workers
+        if self.conf.dataset.chunk_steps:
+            # Batches are sampled from few files at a time and read with one call per file
+            sampler = FileChunkBatchSampler(subset, self.conf.model.batch_size, self.conf.dataset.chunk_steps,
+                                            self.conf.dataset.shuffle_buffer)
+            return torch.utils.data.DataLoader(FileBatchDataset(subset), sampler=sampler, batch_size=None, **kwargs)
+        return torch.utils.data.DataLoader(subset, batch_size=self.conf.model.batch_size, shuffle=True, **kwargs)
+
+    def _make_feature_dataloaders(self):
+        """
+        Freeze the image encoders, encode every sample once per augmentation seed into a
+        FeatureStore and train only fc_layers and output_layer from the stored features
+        """
+        assert self.conf.model.image_inputs, 'The feature cache needs image inputs'
+        if self.conf.feature_encoder_checkpoint:
+            state_dict = torch.load(self.conf.feature_encoder_checkpoint, map_location=self.device)['state_dict']
+            self.model.load_state_dict({k: v for k, v in state_dict.items() if k.startswith('image_encoders.')},
+                                       strict=False)
+        for param in self.model.image_encoders.parameters():
+            param.requires_grad = False
+        aug_seeds = 4 if self.conf.feature_aug_seeds is None else self.conf.feature_aug_seeds
+        if not self.conf.augment_prob:
+            aug_seeds = 0
+        key = _hash({
+            'encoders': module_fingerprint(self.model.image_encoders),
+            'image_inputs': _plain(self.conf.model.image_inputs),
+            'final_size': _plain(self.conf.model.final_size),
+            'dataset': _plain(self.conf.dataset),
+            'augmentation': [self.conf.augment_prob, self.conf.brightness, self.conf.hue, self.conf.batch_transforms],
+            'seeds': [self.conf.seed, aug_seeds],
+        })
+        kwargs = {}
+        if self.conf.dataset.dataloader_workers > 1:
+            kwargs['num_workers'] = self.conf.dataset.dataloader_workers
+
+        def make_batches(seed):
+            if seed == 0:
+                dataset, batch_transform = self.val_dataset.dataset, self.val_batch_transform
+            else:
+                dataset, batch_transform = self.train_dataset.dataset, self.train_batch_transform
+            # Augmentations of a seed only depend on it, also in the DataLoader workers
+            torch.manual_seed(self.conf.seed + seed)
+            loader = torch.utils.data.DataLoader(dataset, batch_size=self.conf.model.batch_size, **kwargs)
+            for batch in loader:
+                yield self._to_inputs(batch, batch_transform)
+
+        def encode(images):
+            selected = self.model.select_images(images)
+            return self.model.encode_images(selected).view(selected[0].shape[0], len(selected), -1)
+
+        self.model.eval()
+        self.feature_store = FeatureStore.open_or_build(self.conf.feature_cache_dir, key, self.dataset.h5_files,
+                                                        self.total_dataset_len, 1 + aug_seeds, make_batches, encode)
+        train_seeds = list(range(1, self.feature_store.num_seeds)) or [0]
+        self.train_dataloader = self._make_feature_dataloader(self.train_dataset.indices, train_seeds, shuffle=True)
+        self.val_dataloader = self._make_feature_dataloader(self.val_dataset.indices, [0], shuffle=False)
+        self.train_batch_transform, self.val_batch_transform = None, None
+
+    def _make_feature_dataloader(self, indices, seeds, shuffle):
+        dataset = FeatureBatchDataset(self.feature_store, indices, seeds)
+        if shuffle:
+            sampler = torch.utils.data.RandomSampler(dataset)
         else:
-            self.dataset = self.dataset_class(conf.dataset)
+            sampler = torch.utils.data.SequentialSampler(dataset)
+        sampler = torch.utils.data.BatchSampler(sampler, self.conf.model.batch_size, drop_last=False)
+        return torch.utils.data.DataLoader(dataset, sampler=sampler, batch_size=None)
 
-        self.total_dataset_len = len(self.dataset)
-        self.train_val_split = [int(self.conf.train_frac * self.total_dataset_len),
-                                self.total_dataset_len - int(self.conf.train_frac * self.total_dataset_len)]
-        self.train_dataset, self.val_dataset = torch.utils.data.random_split(self.dataset, self.train_val_split)
+    def _make_sample_transforms(self):
+        self.train_batch_transform, self.val_batch_transform = None, None
         self.train_dataset.dataset.transform = transforms.Compose(
             [
                 ImageTransform(transforms.ToPILImage()),
@@ -73,27 +178,33 @@ class Trainer:
             ]
         )
 
-        if self.conf.dataset.dataloader_workers > 1:
-            self.train_dataloader = torch.utils.data.DataLoader(self.train_dataset, batch_size=conf.model.batch_size,
-                                                                num_workers=conf.dataset.dataloader_workers,
-                                                                shuffle=True)
-            self.val_dataloader = torch.utils.data.DataLoader(self.val_dataset, batch_size=conf.model.batch_size,
-                                                              num_workers=conf.dataset.dataloader_workers, shuffle=True)
-        else:
-            self.train_dataloader = torch.utils.data.DataLoader(self.train_dataset, batch_size=conf.model.batch_size,
-                                                                shuffle=True)
-            self.val_dataloader = torch.utils.data.DataLoader(self.val_dataset, batch_size=conf.model.batch_size,
-                                                              shuffle=True)
-
-        self.optimizer = torch.optim.Adam(self.model.parameters())
-        self.summary_writer = self._make_summary_writer()
-        self.global_step = 0
-        self.start_epoch = 0
+    def _make_batch_transforms(self):
+        """
+        Samples only become CHW uint8 tensors in the DataLoader workers. Augmentation,
+        resizing and normalization are applied to whole batches on the device.
+        """
+        self.train_dataset.dataset.transform = ImageTransform(to_chw_tensor)
+        self.val_dataset.dataset = copy.copy(self.train_dataset.dataset)
+        self.train_batch_transform = BatchImageTransform(self.conf.model.final_size, self.conf.augment_prob,
+                                                         self.conf.brightness, self.conf.hue)
+        self.val_batch_transform = BatchImageTransform(self.conf.model.final_size)
 
-        if resume_dir is not None:
-            self.start_epoch = self._load_most_recent_chkpt()
+    def _to_inputs(self, batch, batch_transform):
+        inputs = deep_map(lambda x: x.to(self.device), batch)
+        if batch_transform is not None:
+            inputs['images'] = batch_transform(inputs['images'])
+        if self.conf.channels_last and 'images' in inputs:
+            inputs['images'] = [images.contiguous(memory_format=torch.channels_last) for images in inputs['images']]
+        return inputs
 
-        self.current_epoch = self.start_epoch
+    def _forward(self, inputs):
+        """
+        :return: model output and loss, computed under autocast if training in reduced precision
+        """
+        with torch.autocast(self.device.type, dtype=self.autocast_dtype, enabled=self.autocast_dtype is not None):
+            output = self.model(inputs)
+        output = output.float()
+        return output, self.model.loss(output, inputs['label'])
 
     def _make_summary_writer(self):
         folder_name = os.path.join(self.model.exp_path, 'logs')
@@ -101,11 +212,37 @@ class Trainer:
         return SummaryWriter(folder_name)
 
     def _set_seeds(self):
+        """
+        Seed everything and pick cuDNN settings: `reproducible` (the default)
+        uses deterministic kernels only, `fast` lets cuDNN benchmark and pick
+        the fastest kernels and allows TF32 matmuls
+        """
+        performance_mode = self.conf.performance_mode or 'reproducible'
+        assert performance_mode in ('reproducible', 'fast'), 'performance_mode must be reproducible or fast'
+        fast = performance_mode == 'fast'
         torch.manual_seed(self.conf.seed)
-        torch.backends.cudnn.deterministic = True
-        torch.backends.cudnn.benchmark = False
+        torch.backends.cudnn.deterministic = not fast
+        torch.backends.cudnn.benchmark = fast
+        torch.backends.cuda.matmul.allow_tf32 = fast
         np.random.seed(self.conf.seed)
 
+    def _set_precision(self):
+        """
+        `precision` is one of fp32 (the default), bf16, fp16, or auto (fp16 on
+        CUDA, bf16 otherwise). Reduced precision runs the forward pass under
+        autocast; fp16 also scales the loss with a GradScaler.
+        """
+        precision = self.conf.precision or 'fp32'
+        if precision == 'auto':
+            precision = 'fp16' if self.device.type == 'cuda' else 'bf16'
+        assert precision in ('fp32', 'bf16', 'fp16'), 'precision must be fp32, bf16, fp16 or auto'
+        if precision == 'fp16' and self.device.type != 'cuda':
+            print('!! fp16 training needs CUDA, using bf16 instead')
+            precision = 'bf16'
+        self.precision = precision
+        self.autocast_dtype = {'fp32': None, 'bf16': torch.bfloat16, 'fp16': torch.float16}[precision]
+        self.scaler = torch.amp.GradScaler(self.device.type, enabled=precision == 'fp16')
+
     def _load_most_recent_chkpt(self):
         weights_path = os.path.join(self.model.exp_path, 'weights')
         checkpoints = os.listdir(weights_path)
@@ -114,6 +251,8 @@ class Trainer:
         print(f'Loading checkpoint from file {most_recent_file}')
         checkpoint = torch.load(most_recent_file)
         self.model.load_state_dict(checkpoint['state_dict'])
+        if 'scaler' in checkpoint:
+            self.scaler.load_state_dict(checkpoint['scaler'])
         self.global_step = checkpoint['global_step']
         return checkpoint['epoch']
 
@@ -124,9 +263,8 @@ class Trainer:
             totals = []
             total_real = []
             for batch_idx, batch in enumerate(self.val_dataloader):
-                inputs = deep_map(lambda x: x.to(self.device), batch)
-                output = self.model(inputs)
-                loss = self.model.loss(output, inputs['label'])
+                inputs = self._to_inputs(batch, self.val_batch_transform)
+                output, loss = self._forward(inputs)
                 if verbose:
                     true_state_batch = denormalize(batch['state'].cpu().numpy(),
                                                    self.conf.dataset.norms.state_norm.mean,
@@ -177,31 +315,61 @@ class Trainer:
                         'global_step': self.global_step,
                         'state_dict': self.model.state_dict(),
                         'optimizer': self.optimizer.state_dict(),
+                        'scaler': self.scaler.state_dict(),
                     }, self.current_epoch)
                 self._train_one_epoch(self.current_epoch)
                 self.model.dump_params(self.conf)
                 pbar.update(1)
 
+    def _clock(self):
+        """
+        time.perf_counter() once all work queued on the device is done: CUDA
+        kernels run asynchronously, so the clock alone would only time their launch
+        """
+        if self.device.type == 'cuda':
+            torch.cuda.synchronize(self.device)
+        return time.perf_counter()
+
     def _train_one_epoch(self, epoch_num):
         self.model.train()
         epoch_len = len(self.train_dataloader)
         print(epoch_len)
         losses = []
         x_l, y_l, z_l = [], [], []
+        perf_log_every = self.conf.perf_log_every or 50
+        window_steps, window_samples, window_data_time = 0, 0, 0.0
+        epoch_start = window_start = step_start = self._clock()
         for batch_idx, batch in tqdm(enumerate(self.train_dataloader)):
-            inputs = deep_map(lambda x: x.to(self.device), batch)
+            window_data_time += time.perf_counter() - step_start
+            inputs = self._to_inputs(batch, self.train_batch_transform)
             self.optimizer.zero_grad()
-            output = self.model(inputs)
-            loss = self.model.loss(output, inputs['label'])
-            loss.backward()
-            self.optimizer.step()
+            output, loss = self._forward(inputs)
+            self.scaler.scale(loss).backward()
+            self.scaler.step(self.optimizer)
+            self.scaler.update()
             self.global_step = self.global_step + 1
+            window_steps += 1
+            window_samples += self._batch_size(batch)
+            if window_steps == perf_log_every:
+                now = self._clock()
+                self.summary_writer.add_scalar('perf/samples_per_sec', window_samples / (now - window_start),
+                                               self.global_step)
+                self.summary_writer.add_scalar('perf/step_ms', (now - window_start) * 1e3 / window_steps,
+                                               self.global_step)
+                self.summary_writer.add_scalar('perf/data_ms', window_data_time * 1e3 / window_steps,
+                                               self.global_step)
+                window_steps, window_samples, window_data_time = 0, 0, 0.0
+                window_start = now
             p = torch.mean((output - inputs['label']) ** 2, dim=0)
             x_l.append(p[0] * self._batch_size(batch))
             y_l.append(p[1] * self._batch_size(batch))
             z_l.append(p[2] * self._batch_size(batch))
             losses.append(loss * self._batch_size(batch))
             del output, loss
+            step_start = time.perf_counter()
+        self.summary_writer.add_scalar('perf/epoch_samples_per_sec',
+                                       len(self.train_dataloader.dataset) / (self._clock() - epoch_start),
+                                       self.global_step)
         self.visualize_images(inputs, 'train')
         loss = sum(losses) / len(self.train_dataloader.dataset)
         x_l = sum(x_l) / len(self.train_dataloader.dataset)
@@ -211,8 +379,13 @@ class Trainer:
         self.summary_writer.add_scalar('train/xloss', x_l, self.global_step)
         self.summary_writer.add_scalar('train/yloss', y_l, self.global_step)
         self.summary_writer.add_scalar('train/zloss', z_l, self.global_step)
+        if self.dataset.anchor_cache is not None:
+            for key, value in self.dataset.anchor_cache.stats().items():
+                self.summary_writer.add_scalar(f'anchor_cache/{key}', value, self.global_step)
 
     def visualize_images(self, inputs, train_val):
+        if 'images' not in inputs:
+            return
         images = inputs['images']
         for cam_i, image in enumerate(images):
             img_grid = torchvision.utils.make_grid(image[:16], normalize=True)
@@ -228,6 +401,8 @@ if __name__ == '__main__':
     parser.add_argument('config_file', action='store')
     parser.add_argument('--resume_dir', action='store', type=str, dest='resume_dir')
     parser.add_argument('--val', action='store_true', dest='val')
+    parser.add_argument('--materialize', action='store_true', dest='materialize',
+                        help='only build the training cache (dataset.cache_dir) and exit')
     args = parser.parse_args()
     try:
         conf = OmegaConf.load(args.config_file)
@@ -235,6 +410,11 @@ if __name__ == '__main__':
         print('Failed to load config, exiting now...')
         sys.exit()
 
+    if args.materialize:
+        assert conf.dataset.cache_dir, 'Set dataset.cache_dir to materialize the dataset'
+        make_dataset(conf)
+        sys.exit()
+
     trainer = Trainer(conf, args.resume_dir)
     if args.val:
         trainer.val(verbose=True)
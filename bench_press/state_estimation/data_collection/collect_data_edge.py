@@ -37,14 +37,11 @@ out = args.out
 
 tb = TestBench('/dev/ttyACM0', 0)
 
-while not tb.ready():
-    time.sleep(0.1)
-    tb.update()
+tb.wait_ready()
 
 tb.start()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 '''
 Grab a quick reading, use to verify that load cells have been initialized
@@ -95,8 +92,7 @@ for i in range(num_trials):
     x, y, z = target_x, target_y, target_z
 
     tb.target_pos(target_x, target_y, target_z)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     p_z = int(np.random.uniform(0, z_radius))
     p_y = 0
@@ -120,8 +116,7 @@ for i in range(num_trials):
 
     tb.target_pos(target_x, target_y, target_z)
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     time.sleep(0.5)
     py = int(np.random.uniform(0, y_radius))
@@ -129,8 +124,7 @@ for i in range(num_trials):
 
     target_y += py
     tb.target_pos(target_x, target_y, target_z)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     time.sleep(.5)
 
@@ -153,8 +147,7 @@ for i in range(num_trials):
 
     target_z -= p_z
     tb.target_pos(target_x, target_y, target_z)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     if i % NEW_FILE_EVERY == 0 and i > 0:  # Save progress often so we don't lose data!
         savemat(data_dir + '/data_{}.mat'.format(data_file_num),
@@ -196,5 +189,4 @@ savemat(data_dir + '/data_{}.mat'.format(data_file_num),
 
 tb.reset()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
@@ -36,14 +36,11 @@ y_radius = config['y_radius']
 out = args.out
 tb = TestBench('/dev/ttyACM0', 0, 2)
 
-while not tb.ready():
-    time.sleep(0.1)
-    tb.update()
+tb.wait_ready()
 
 tb.start()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 '''
 Grab a quick reading, use to verify that load cells have been initialized
@@ -57,14 +54,11 @@ y = HOME_POS['y']
 z = HOME_POS['z']
 
 tb.target_pos(x, 0, 0)
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 tb.target_pos(x, y, 0)
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 tb.target_pos(x, y, z)
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 dx = 0
 dy = 0
@@ -104,8 +98,7 @@ for i in range(num_trials):
     print('---------- TRIAL {} -----------'.format(i))
     tb.target_pos(target_x, target_y, target_z)
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     p_z = int(np.random.uniform(0, z_radius))
     # p_z = z_radius
@@ -130,16 +123,14 @@ for i in range(num_trials):
 
     tb.target_pos(target_x, target_y, target_z)
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
     time.sleep(.5)
     py = int(np.random.uniform(0, y_radius))
     # py = y_radius
 
     target_y += py
     tb.target_pos(target_x, target_y, target_z)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     time.sleep(.5)
     data = tb.req_data()
@@ -163,8 +154,7 @@ for i in range(num_trials):
 
     target_y -= py
     tb.target_pos(target_x, target_y, target_z)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     if i % NEW_FILE_EVERY == 0 and i > 0:  # Save progress often so we don't lose data!
         savemat(data_dir + '/data_{}.mat'.format(data_file_num),
@@ -212,5 +202,4 @@ savemat(data_dir + '/data_{}.mat'.format(data_file_num),
 
 tb.reset()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
@@ -37,14 +37,11 @@ tb = TestBench('/dev/ttyACM0', 1)
 dyna = Dynamixel('/dev/ttyUSB1', dyna_config['home'])
 dyna.move_to_angle(0)
 
-while not tb.ready():
-    time.sleep(0.1)
-    tb.update()
+tb.wait_ready()
 
 tb.start()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 '''
 Grab a quick reading, use to verify that load cells have been initialized
@@ -109,8 +106,7 @@ for i in range(num_trials):
     x, y, z = target_x, target_y, target_z
 
     tb.target_pos(target_x, target_y, target_z)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     dyna.move_to_angle(0)
     time.sleep(1)
@@ -125,15 +121,13 @@ for i in range(num_trials):
     # cv2.imwrite("cap_framebefore" + str(i) + ".png", frame)
     ppf = np.copy(frame)
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
     force_mean = 0
 
     while force_mean < MIN_FORCE_THRESH:
         target_z += 50
         tb.target_pos(target_x, target_y, target_z)
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
         data = tb.req_data()
         print(data)
         # force_mean = meanwoutliers([data['force_1'], data['force_2'], data['force_3'], data['force_4']])
@@ -201,7 +195,6 @@ savemat(data_dir + '/data_{}.mat'.format(data_file_num),
 
 tb.reset()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 dyna.move_to_angle(0)
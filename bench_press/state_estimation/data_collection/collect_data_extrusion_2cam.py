@@ -37,14 +37,11 @@ out = args.out
 tb = TestBench('/dev/ttyACM0', 0, 2)
 dyna = Dynamixel('/dev/ttyUSB0', dyna_config['home'])
 
-while not tb.ready():
-    time.sleep(0.1)
-    tb.update()
+tb.wait_ready()
 
 tb.start()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 dyna.move_to_angle(0)
 '''
@@ -114,8 +111,7 @@ for i in range(num_trials):
     x, y, z = target_x, target_y, target_z
 
     tb.target_pos(target_x, target_y, target_z)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     dyna.move_to_angle(0)
     time.sleep(1)
@@ -132,8 +128,7 @@ for i in range(num_trials):
 
     ppf, ppf2 = np.copy(frame), np.copy(frame2)
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     force_min = 0
     mean = 0
@@ -158,8 +153,7 @@ for i in range(num_trials):
             print('Hit z threshold based on trig!')
             break
         tb.target_pos(target_x, target_y, target_z)
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
         data = tb.req_data()
         print(data)
         # force_mean = meanwoutliers([data['force_1'], data['force_2'], data['force_3'], data['force_4']])
@@ -238,7 +232,6 @@ savemat(data_dir + '/data_{}.mat'.format(data_file_num),
 
 tb.reset()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 dyna.move_to_angle(0)
@@ -38,14 +38,11 @@ tb = TestBench('/dev/ttyACM0', 0, 2)
 dyna = Dynamixel('/dev/ttyUSB0', dyna_config['home'])
 
 dyna.move_to_angle(-90)
-while not tb.ready():
-    time.sleep(0.1)
-    tb.update()
+tb.wait_ready()
 
 tb.start()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 '''
 Grab a quick reading, use to verify that load cells have been initialized
@@ -115,8 +112,7 @@ for i in range(num_trials):
 
     dyna.move_to_angle(-90)
     tb.target_pos(target_x, target_y, target_z)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     time.sleep(1)
 
@@ -130,8 +126,7 @@ for i in range(num_trials):
     y_offset = total_ticks * ((dynamixel_angle_max + offset_angle) / (dynamixel_angle_max - dynamixel_angle_min))
     target_y += y_offset
     tb.target_pos(target_x, target_y, target_z)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     print(offset_angle)
     dyna.move_to_angle(offset_angle)
@@ -142,8 +137,7 @@ for i in range(num_trials):
 
     ppf, ppf2 = np.copy(frame), np.copy(frame2)
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     force_min = 0
     mean = 0
@@ -172,8 +166,7 @@ for i in range(num_trials):
             print('Hit z threshold based on trig!')
             break
         tb.target_pos(target_x, target_y, target_z)
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
         data = tb.req_data()
         print(data)
         # force_mean = meanwoutliers([data['force_1'], data['force_2'], data['force_3'], data['force_4']])
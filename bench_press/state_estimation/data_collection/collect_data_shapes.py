@@ -49,14 +49,11 @@ assert shape_name in SHAPE_POS, "Invalid shape!"
 
 tb = TestBench('/dev/ttyACM0', 0)
 
-while not tb.ready():
-    time.sleep(0.1)
-    tb.update()
+tb.wait_ready()
 
 tb.start()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 '''
 Grab a quick reading, use to verify that load cells have been initialized
@@ -113,8 +110,7 @@ for i in range(num_trials):
 
     tb.target_pos(target_x, target_y, 0)
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     time.sleep(0.25)
 
@@ -134,8 +130,7 @@ for i in range(num_trials):
         else:
             tb.press_z(0, force_threshold)
 
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
 
         time.sleep(0.5)
         data = tb.req_data()
@@ -175,8 +170,7 @@ for i in range(num_trials):
 
     tb.reset_z()
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
 savemat(out + ctimestr + '-' + shape_name + '.mat',
         {
@@ -195,5 +189,4 @@ savemat(out + ctimestr + '-' + shape_name + '.mat',
 
 tb.reset()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
@@ -7,14 +7,11 @@ import save_traj
 from testbench_control import TestBench
 
 tb = TestBench('/dev/ttyACM0', 0)
-while not tb.ready():
-    time.sleep(0.1)
-    tb.update()
+tb.wait_ready()
 
 tb.start()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 ZERO_POS = [2650, 6040, 870]
 max_force = 15
@@ -39,7 +36,7 @@ def run_traj(num_steps, policy):
     states = []
     pos = ZERO_POS[:]
     tb.target_pos(*pos)
-    while tb.busy(): tb.update()
+    tb.wait_idle()
     frame, data = tb.get_frame(), tb.req_data()
     time.sleep(0.05)
 
@@ -52,12 +49,10 @@ def run_traj(num_steps, policy):
     states.append(data)
 
     tb.press_z(0, 5)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
     pos[2] = tb.req_data()['z']
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     def normalize_pos(pos):
         mX, mY, mZ = 6000, 12000, 1300
@@ -84,8 +79,7 @@ def run_traj(num_steps, policy):
         tb.target_pos(*pos)
         bt = millis()
 
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
 
         print(millis() - bt)
         frame, data = tb.get_frame(), tb.req_data()
@@ -122,8 +116,7 @@ def run_traj(num_steps, policy):
     # while tb.busy():
     #    tb.update()
     tb.target_pos(*pos)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     # for i in range(0, len(images), 5):
     #   plt.imshow(images[i])
@@ -142,8 +135,7 @@ with open('bearing_stats.pkl', 'rb') as f:
 for i in range(2000):
     if not i % 100:
         tb.reset()
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
 
     traj = run_traj(18, random_actions)
 
@@ -151,5 +143,4 @@ for i in range(2000):
     save_traj.save_tf_record('traj_data/' + ctimestr + '/traj' + str(i) + '/', 'traj' + str(i), traj)
 
 tb.reset();
-while tb.busy():
-    tb.update()
+tb.wait_idle()
@@ -19,17 +19,14 @@ resetter = serial.Serial('/dev/ttyUSB0', baudrate=9600, timeout=1)
 # notify = Notify()
 # notify.register()
 
-while not tb.ready():
-    time.sleep(0.1)
-    tb.update()
+tb.wait_ready()
 
 tb.flip_x_reset()
 time.sleep(0.5)
 
 tb.start()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 ZERO_POS = [5200, 5300, 0]
 max_force = 15
@@ -90,7 +87,7 @@ def run_traj(num_steps, policy):
     OFFSET_HOME_POS = pos[:]
 
     tb.target_pos(*pos)
-    while tb.busy(): tb.update()
+    tb.wait_idle()
     frame, data = tb.get_frame(), tb.req_data()
     time.sleep(0.05)
 
@@ -107,13 +104,11 @@ def run_traj(num_steps, policy):
     states.append(data)
 
     tb.press_z(600, 7)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
     pos[2] = tb.req_data()['z']
     print('z pos' + str(pos[2]))
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     def normalize_pos(pos):
         pos[0] = min(maxX, max(minX, pos[0]))
@@ -149,8 +144,7 @@ def run_traj(num_steps, policy):
         tb.target_pos(*pos)
         bt = millis()
 
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
 
         print(millis() - bt)
         data = tb.req_data()
@@ -183,8 +177,7 @@ def run_traj(num_steps, policy):
         n += 1
 
     tb.reset_z()
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     # for i in range(0, len(images), 5):
     #   plt.imshow(images[i])
@@ -207,8 +200,7 @@ for i in range(5000):
     if not i % 100:
         reset_dice()
         tb.reset()
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
 
     traj = run_traj(18, random_actions)
 
@@ -217,5 +209,4 @@ for i in range(5000):
     # save_dice_traj.save_dd_record('traj_data/' + ctimestr + '/traj'+str(i) + '/', 'traj' + str(i), traj)
 
 tb.reset()
-while tb.busy():
-    tb.update()
+tb.wait_idle()
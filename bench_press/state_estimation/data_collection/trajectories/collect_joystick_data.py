@@ -9,17 +9,14 @@ from testbench_control import TestBench
 
 tb = TestBench('/dev/ttyACM0', 0)
 
-while not tb.ready():
-    time.sleep(0.1)
-    tb.update()
+tb.wait_ready()
 
 tb.flip_x_reset()
 tb.sleep(0.5)
 
 tb.start()
 
-while tb.busy():
-    tb.update()
+tb.wait_idle()
 
 ZERO_POS = [5500, 6000, 0]
 max_force = 15
@@ -55,7 +52,7 @@ def run_traj(num_steps, policy):
     pos[2] += offset[2]
 
     tb.target_pos(*pos)
-    while tb.busy(): tb.update()
+    tb.wait_idle()
     frame, data = tb.get_frame(), tb.req_data()
     time.sleep(0.05)
 
@@ -68,12 +65,10 @@ def run_traj(num_steps, policy):
     states.append(data)
 
     tb.press_z(0, 5)
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
     pos[2] = tb.req_data()['z']
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     def normalize_pos(pos):
         maxX, maxY, maxZ = 5800, 6300, 300
@@ -101,8 +96,7 @@ def run_traj(num_steps, policy):
         tb.target_pos(*pos)
         bt = millis()
 
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
 
         print(millis() - bt)
         frame, data = tb.get_frame(), tb.req_data()
@@ -133,8 +127,7 @@ def run_traj(num_steps, policy):
         states.append(data)
 
     tb.reset_z()
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     # for i in range(0, len(images), 5):
     #   plt.imshow(images[i])
@@ -153,8 +146,7 @@ with open('joystick_stats.pkl', 'rb') as f:
 for i in range(5000):
     if not i % 100:
         tb.reset()
-        while tb.busy():
-            tb.update()
+        tb.wait_idle()
 
     traj = run_traj(18, random_actions)
 
@@ -162,5 +154,4 @@ for i in range(5000):
     save_traj.save_tf_record('traj_data/' + ctimestr + '/traj' + str(i) + '/', 'traj' + str(i), traj, mean, std)
 
 tb.reset()
-while tb.busy():
-    tb.update()
+tb.wait_idle()
@@ -40,11 +40,11 @@ if os.name == 'nt':
 else:
     import sys, tty, termios
 
-    fd = sys.stdin.fileno()
-    old_settings = termios.tcgetattr(fd)
-
 
     def getch():
+        # Terminal settings are read here rather than at import, so the module imports without a tty
+        fd = sys.stdin.fileno()
+        old_settings = termios.tcgetattr(fd)
         try:
             tty.setraw(sys.stdin.fileno())
             ch = sys.stdin.read(1)
@@ -52,14 +52,27 @@ else:
             termios.tcsetattr(fd, termios.TCSADRAIN, old_settings)
         return ch
 
+import threading
+import time
+
+from bench_press.utils.rate_scheduler import RateScheduler
 from dynamixel_sdk import *  # Uses Dynamixel SDK library
 
 
+def _to_signed(value, num_bytes):
+    bits = 8 * num_bytes
+    return value - (1 << bits) if value >= (1 << (bits - 1)) else value
+
+
 class Dynamixel():
     # Control table address
     ADDR_PRO_TORQUE_ENABLE = 64  # Control table address is different in Dynamixel model
     ADDR_PRO_GOAL_POSITION = 116
-    ADDR_PRO_PRESENT_POSITION = 132
+    ADDR_PRO_PRESENT_LOAD = 126  # Present load/current, 2 bytes
+    ADDR_PRO_PRESENT_VELOCITY = 128  # 4 bytes
+    ADDR_PRO_PRESENT_POSITION = 132  # 4 bytes
+    LEN_PRO_GOAL_POSITION = 4
+    LEN_PRO_PRESENT_STATE = 10  # Load, velocity and position are contiguous, so one sync read gets all three
 
     # Protocol version
     PROTOCOL_VERSION = 2.0  # See which protocol version is used in the Dynamixel
@@ -77,7 +90,22 @@ class Dynamixel():
     dxl_goal_position = [DXL_MINIMUM_POSITION_VALUE, DXL_MAXIMUM_POSITION_VALUE]  # Goal position
     TICKS_PER_REV = 4096
 
-    def __init__(self, device_name, home_pos):
+    def __init__(self, device_name, home_pos, ids=None):
+        """
+        :param device_name: serial port of the U2D2/USB2DYNAMIXEL
+        :param home_pos: tick position corresponding to angle 0, either one
+            value for all servos or a list with one value per id
+        :param ids: Dynamixel ids on the bus, defaults to [DXL_ID]. The first
+            id is the primary servo used by the single servo methods.
+        """
+        self.ids = list(ids) if ids else [self.DXL_ID]
+        if isinstance(home_pos, (int, float)):
+            home_pos = [home_pos] * len(self.ids)
+        assert len(home_pos) == len(self.ids), 'Need one home position per Dynamixel id'
+        self.home_positions = dict(zip(self.ids, home_pos))
+        self.home_pos = self.home_positions[self.ids[0]]
+        self.bus_lock = threading.Lock()  # One transaction on the bus at a time
+        self.poller = None
 
         # Initialize PortHandler instance
         # Set the port path
@@ -107,36 +135,79 @@ class Dynamixel():
             getch()
             quit()
 
+        # Group handlers for single transaction reads and writes to all servos
+        self.groupSyncWrite = GroupSyncWrite(self.portHandler, self.packetHandler, self.ADDR_PRO_GOAL_POSITION,
+                                             self.LEN_PRO_GOAL_POSITION)
+        self.groupSyncRead = GroupSyncRead(self.portHandler, self.packetHandler, self.ADDR_PRO_PRESENT_LOAD,
+                                           self.LEN_PRO_PRESENT_STATE)
+        for dxl_id in self.ids:
+            if not self.groupSyncRead.addParam(dxl_id):
+                print(f"[ID:{dxl_id:03d}] groupSyncRead addparam failed")
+
         # Enable Dynamixel Torque
-        dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, self.DXL_ID,
-                                                                       self.ADDR_PRO_TORQUE_ENABLE, self.TORQUE_ENABLE)
-        if dxl_comm_result != COMM_SUCCESS:
-            print("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
-        elif dxl_error != 0:
-            print("%s" % self.packetHandler.getRxPacketError(dxl_error))
-        else:
-            print("Dynamixel has been successfully connected")
+        for dxl_id in self.ids:
+            dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, dxl_id,
+                                                                           self.ADDR_PRO_TORQUE_ENABLE,
+                                                                           self.TORQUE_ENABLE)
+            if dxl_comm_result != COMM_SUCCESS:
+                print("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
+            elif dxl_error != 0:
+                print("%s" % self.packetHandler.getRxPacketError(dxl_error))
+            else:
+                print(f"Dynamixel {dxl_id} has been successfully connected")
+
+    def angle_to_ticks(self, angle, dxl_id=None):
+        dxl_id = self.ids[0] if dxl_id is None else dxl_id
+        return (int)((angle / 360) * self.TICKS_PER_REV + self.home_positions[dxl_id])
 
-        self.home_pos = home_pos
+    def ticks_to_angle(self, ticks, dxl_id=None):
+        dxl_id = self.ids[0] if dxl_id is None else dxl_id
+        return (ticks - self.home_positions[dxl_id]) * 360 / self.TICKS_PER_REV
 
     def move_to_angle(self, angle):
-        target_pos = (int)((angle / 360) * self.TICKS_PER_REV + self.home_pos)
-        self.set_pos(target_pos)
+        self.set_pos(self.angle_to_ticks(angle))
+
+    def move_to_angles(self, angles):
+        """
+        Move every servo in a single sync write.
+        :param angles: one angle per id, in the order of `ids`
+        """
+        assert len(angles) == len(self.ids), 'Need one angle per Dynamixel id'
+        self.sync_set_pos({dxl_id: self.angle_to_ticks(angle, dxl_id) for dxl_id, angle in zip(self.ids, angles)})
 
     def set_pos(self, position):
         # Write goal position
-        dxl_comm_result, dxl_error = self.packetHandler.write4ByteTxRx(self.portHandler, self.DXL_ID,
-                                                                       self.ADDR_PRO_GOAL_POSITION, position)
+        with self.bus_lock:
+            dxl_comm_result, dxl_error = self.packetHandler.write4ByteTxRx(self.portHandler, self.ids[0],
+                                                                           self.ADDR_PRO_GOAL_POSITION, position)
         if dxl_comm_result != COMM_SUCCESS:
             print("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
             raise ValueError('communication failure!')
         elif dxl_error != 0:
             print("%s" % self.packetHandler.getRxPacketError(dxl_error))
 
+    def sync_set_pos(self, positions):
+        """
+        :param positions: dict mapping Dynamixel id to goal position in ticks
+        """
+        with self.bus_lock:
+            for dxl_id, position in positions.items():
+                param_goal_position = [DXL_LOBYTE(DXL_LOWORD(position)), DXL_HIBYTE(DXL_LOWORD(position)),
+                                       DXL_LOBYTE(DXL_HIWORD(position)), DXL_HIBYTE(DXL_HIWORD(position))]
+                self.groupSyncWrite.addParam(dxl_id, param_goal_position)
+            dxl_comm_result = self.groupSyncWrite.txPacket()
+            self.groupSyncWrite.clearParam()
+        if dxl_comm_result != COMM_SUCCESS:
+            print("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
+            raise ValueError('communication failure!')
+
     def get_pos(self):
-        dxl_present_position, dxl_comm_result, dxl_error = self.packetHandler.read4ByteTxRx(self.portHandler,
-                                                                                            self.DXL_ID,
-                                                                                            self.ADDR_PRO_PRESENT_POSITION)
+        if self.poller is not None:
+            return self.poller.get_state()[self.ids[0]]['position']
+        with self.bus_lock:
+            dxl_present_position, dxl_comm_result, dxl_error = self.packetHandler.read4ByteTxRx(self.portHandler,
+                                                                                                self.ids[0],
+                                                                                                self.ADDR_PRO_PRESENT_POSITION)
         if dxl_comm_result != COMM_SUCCESS:
             print("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
         elif dxl_error != 0:
@@ -144,18 +215,124 @@ class Dynamixel():
 
         return dxl_present_position;
 
-    def get_current_angle(self):
-        current_ticks = self.get_pos()
-        return (current_ticks - self.home_pos) * 360 / self.TICKS_PER_REV
+    def sync_read_state(self):
+        """
+        Read position, velocity and load of every servo in a single bus transaction.
+        Raises a ValueError if the transaction fails or a servo did not reply,
+        instead of returning zeros for it.
+        :return: dict mapping Dynamixel id to a dict with 'position' (ticks),
+            'angle' (degrees), 'velocity' and 'load' (raw units)
+        """
+        with self.bus_lock:
+            dxl_comm_result = self.groupSyncRead.txRxPacket()
+            if dxl_comm_result != COMM_SUCCESS:
+                print("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
+                raise ValueError('communication failure!')
+            state = {}
+            for dxl_id in self.ids:
+                if not self.groupSyncRead.isAvailable(dxl_id, self.ADDR_PRO_PRESENT_LOAD, self.LEN_PRO_PRESENT_STATE):
+                    raise ValueError(f'[ID:{dxl_id:03d}] groupSyncRead getdata failed')
+                position = _to_signed(self.groupSyncRead.getData(dxl_id, self.ADDR_PRO_PRESENT_POSITION, 4), 4)
+                state[dxl_id] = {
+                    'position': position,
+                    'angle': self.ticks_to_angle(position, dxl_id),
+                    'velocity': _to_signed(self.groupSyncRead.getData(dxl_id, self.ADDR_PRO_PRESENT_VELOCITY, 4), 4),
+                    'load': _to_signed(self.groupSyncRead.getData(dxl_id, self.ADDR_PRO_PRESENT_LOAD, 2), 2),
+                }
+        return state
+
+    def get_current_angle(self, state=None):
+        """
+        :param state: sync_read_state() result to take the position from instead, e.g. a poller snapshot
+        """
+        current_ticks = self.get_pos() if state is None else state[self.ids[0]]['position']
+        return self.ticks_to_angle(current_ticks)
+
+    def get_servo_states(self, state=None):
+        """
+        :param state: sync_read_state() result to use instead, e.g. a poller snapshot
+        :return: sync_read_state() result keyed by 'id<n>', from the poller cache if one is running
+        """
+        if state is None:
+            state = self.poller.get_state() if self.poller is not None else self.sync_read_state()
+        return {f'id{dxl_id}': servo_state for dxl_id, servo_state in state.items()}
+
+    def start_polling(self, rate):
+        """
+        Keep the latest state of all servos cached by a background thread, so
+        that get_pos, get_current_angle and get_servo_states cost no bus time.
+        """
+        self.poller = DynamixelPoller(self, rate)
+        self.poller.start()
+        if not self.poller.wait_first():
+            self.stop_polling()
+            raise ValueError('communication failure!')
+
+    def stop_polling(self):
+        if self.poller is not None:
+            self.poller.stop()
+            self.poller.join()
+            self.poller = None
 
     def disable(self):
+        self.stop_polling()
         # Disable Dynamixel Torque
-        dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, self.DXL_ID,
-                                                                       self.ADDR_PRO_TORQUE_ENABLE, self.TORQUE_DISABLE)
-        if dxl_comm_result != COMM_SUCCESS:
-            print("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
-        elif dxl_error != 0:
-            print("%s" % self.packetHandler.getRxPacketError(dxl_error))
+        for dxl_id in self.ids:
+            dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, dxl_id,
+                                                                           self.ADDR_PRO_TORQUE_ENABLE,
+                                                                           self.TORQUE_DISABLE)
+            if dxl_comm_result != COMM_SUCCESS:
+                print("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
+            elif dxl_error != 0:
+                print("%s" % self.packetHandler.getRxPacketError(dxl_error))
 
         # Close port
         self.portHandler.closePort()
+
+
+class DynamixelPoller(threading.Thread):
+    """
+    Polls all servos of a Dynamixel with one sync read per cycle and caches the
+    result, with the time.monotonic() at which it was read.
+    """
+
+    def __init__(self, dynamixel, thread_rate):
+        super(DynamixelPoller, self).__init__(daemon=True)
+        self.dynamixel = dynamixel
+        self.thread_rate = thread_rate
+        self.state = None
+        self.timestamp = None
+        self.lock = threading.Lock()  # Keeps state and timestamp from the same poll
+        self.first_read = threading.Event()
+        self.scheduler = RateScheduler(thread_rate)
+
+    def _poll(self):
+        try:
+            state = self.dynamixel.sync_read_state()
+        except ValueError as e:
+            # Keep the last good state (and its timestamp) and retry on the next cycle
+            print(f'Dynamixel poll failed: {e}')
+            return
+        timestamp = time.monotonic()
+        with self.lock:
+            self.state, self.timestamp = state, timestamp
+        self.first_read.set()
+
+    def run(self):
+        self.scheduler.run(self._poll)
+
+    def wait_first(self, timeout=1.0):
+        return self.first_read.wait(timeout)
+
+    def get_state(self):
+        return self.state
+
+    def get_snapshot(self):
+        """
+        :return: (state, timestamp) of the same poll
+        """
+        with self.lock:
+            return self.state, self.timestamp
+
+    def stop(self):
+        self.scheduler.stop()
@@ -0,0 +1,385 @@
+import argparse
+import multiprocessing
+import os
+import pty
+import re
+import select
+import threading
+import time
+import tty
+
+import numpy as np
+from bench_press.tb_control.telemetry import encode_frame
+
+
+X_INV_INIT_POS = 8000  # xInvInitPos in testbench.ino
+MAX_STEPS = (8000, 12000, 1600)  # maxSteps of the x, y and z Axis objects
+PRESS_Z_LIMIT = 1275  # TBControl::feedbackMoveZ stops here
+PRESS_SAMPLE_STEPS = 20  # feedbackMoveZ reads the load cells every this many steps
+
+
+def _substring(s, left, right=None):
+    # Arduino String::substring, whose unsigned int arguments turn indexOf's -1 into 65535
+    right = len(s) if right is None else right
+    left, right = sorted((left & 0xFFFF, right & 0xFFFF))
+    return s[left:min(right, len(s))]
+
+
+def _to_int(s):
+    # Arduino String::toInt, i.e. atol
+    match = re.match(r'\s*([+-]?\d+)', s)
+    return int(match.group(1)) if match else 0
+
+
+def _int16(value):
+    # Assignment to an int on the 8-bit AVR
+    return (value + 0x8000) % 0x10000 - 0x8000
+
+
+class TBEmulator:
+    """
+    Simulated testbench Arduino, mirroring firmware/testbench/testbench.ino on
+    the master end of a pseudo-terminal. Point a `TestBench` at `port_name` to
+    talk to it instead of /dev/ttyACM0.
+
+    Replies are those of handleInput: every command is echoed, then
+        - `start`, `r`: home z, x and y, tare, "Initialized" / "Reset"
+        - `invx`: x homes to the far end from then on; no reply
+        - `rz`: home z, "Reset Z"
+        - `pz<steps>w<thresh>`: "Pressed to max force <mean force>"
+        - `l`: position and load cells in the format of TBControl::log
+        - `s<rate>`: stream telemetry frames at rate Hz, `s0` stops
+        - anything else is a position command, parsed with the firmware's
+          String calls: "Target set to <t>" (or "Invalid target set at <t>")
+          per axis, the x step period when x is not the longer XY move (see
+          TBControl::moveNorm), and "Ready" once the move is done.
+    The firmware does not read input during the XY part of a move or during
+    the blocking start/r/rz/pz routines, but does while z moves; telemetry
+    frames are sent except during the blocking routines. The emulator does
+    the same.
+
+    Model:
+        - every step takes `step_time`, as with the firmware's 500us pulses; x
+          and y move together, timed by the longer of the two, then z moves
+        - the sensor touches a rigid plate at z = `contact_z`, beyond which the
+          total force grows by `stiffness` grams per step. It is split between
+          the four load cells bilinearly by the xy position over `plate_size`,
+          plus gaussian noise of `force_noise` grams.
+        - `pz` descends `steps` at full speed, then creeps, reading the load
+          cells (`sample_time`) every PRESS_SAMPLE_STEPS steps until their
+          mean force reaches `thresh` or z reaches PRESS_Z_LIMIT
+    All durations are divided by `time_scale`, so that runs can go faster than
+    real time. If `move_time` is set, every command takes exactly that long.
+    The boot messages are sent `boot_time` seconds (not scaled) after a client
+    opens the port, standing in for the Arduino's reset on open.
+    """
+
+    def __init__(self, time_scale=1.0, step_time=0.001, tare_time=1.0, reply_latency=0.001, contact_z=1000,
+                 stiffness=0.5, plate_size=(8000, 12000), force_noise=0.05, sample_time=0.0125, move_time=None,
+                 seed=None, boot_time=0.05):
+        self.time_scale = time_scale
+        self.boot_time = boot_time
+        self.step_time = step_time
+        self.tare_time = tare_time
+        self.reply_latency = reply_latency
+        self.contact_z = contact_z
+        self.stiffness = stiffness
+        self.plate_size = np.array(plate_size, dtype=np.float64)
+        self.force_noise = force_noise
+        self.sample_time = sample_time
+        self.move_time = move_time
+        self.rng = np.random.RandomState(seed)
+
+        self.master_fd, slave_fd = pty.openpty()
+        tty.setraw(slave_fd)
+        self.port_name = os.ttyname(slave_fd)
+        os.close(slave_fd)  # Only the client keeps the slave end open, see client_connected
+        self.poller = select.poll()
+        self.poller.register(self.master_fd, select.POLLIN)
+
+        self.pos = np.zeros(3)  # Where the current legs start
+        self.legs = []  # Consecutive straight moves (start time, end time, start pos, end pos)
+        self.target = np.zeros(3)
+        self.x_init = 0
+        self.idle = True
+        self.replies = []  # Scheduled (time, message) of blocking routines
+        self.ready_time = None  # When the current move is done and "Ready" is sent
+        self.input_blocked_until = 0.0
+        self.stream_blocked_until = 0.0
+        self.last_reply_time = None
+        self.in_buffer = bytearray()
+        self.stream_period = None
+        self.next_frame_time = None
+        self.start_time = time.monotonic()
+
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+        os.close(self.master_fd)
+
+    def client_connected(self):
+        # The master end reports a hangup while nobody has the slave end open
+        return not any(event & select.POLLHUP for _, event in self.poller.poll(0))
+
+    def write_line(self, line):
+        os.write(self.master_fd, (line + '\n').encode())
+
+    def run(self):
+        # Like the Arduino, which is reset when the port is opened, only boot
+        # once a client is connected: pyserial flushes its input on open, so
+        # anything written before or right after the open would be lost.
+        while not self.client_connected():
+            if self.stop_event.wait(0.01):
+                return
+        if self.stop_event.wait(self.boot_time):
+            return
+        self.write_line('Capabilities: stream')
+        self.write_line('Starting testbench...')
+        while not self.stop_event.is_set():
+            if not self.client_connected():
+                self.stop_event.wait(0.01)
+                continue
+            deadlines = [time.monotonic() + 0.05] + [t for t, _ in self.replies]
+            if self.ready_time is not None:
+                deadlines.append(self.ready_time)
+            if self.stream_period is not None:
+                deadlines.append(max(self.next_frame_time, self.stream_blocked_until))
+            if b'\n' in self.in_buffer:
+                deadlines.append(self.input_blocked_until)
+            timeout = max(0.0, min(deadlines) - time.monotonic())
+            readable, _, _ = select.select([self.master_fd], [], [], timeout)
+            if readable:
+                try:
+                    self.in_buffer.extend(os.read(self.master_fd, 1024))
+                except OSError:  # Client disconnected since the check above
+                    continue
+            self.stream()
+            self.send_replies()
+            while time.monotonic() >= self.input_blocked_until:
+                newline = self.in_buffer.find(b'\n')
+                if newline < 0:
+                    break
+                cmd = self.in_buffer[:newline].decode(errors='replace').rstrip('\r')
+                del self.in_buffer[:newline + 1]
+                self.write_line(cmd)  # The firmware echoes every command
+                self.handle_input(cmd, time.monotonic())
+
+    def stream(self):
+        now = time.monotonic()
+        if self.stream_period is None or now < self.next_frame_time or now < self.stream_blocked_until:
+            return
+        fw_time = int((now - self.start_time) * self.time_scale * 1e6)
+        pos = self.current_pos(now)
+        os.write(self.master_fd, encode_frame(fw_time, *pos, np.abs(self.forces(pos))))
+        # Skip missed frames rather than bursting to catch up
+        while self.next_frame_time <= now:
+            self.next_frame_time += self.stream_period
+
+    def send_replies(self):
+        now = time.monotonic()
+        due = [msg for t, msg in self.replies if t <= now]
+        self.replies = [(t, msg) for t, msg in self.replies if t > now]
+        if self.ready_time is not None and self.ready_time <= now:
+            due.append('Ready')
+            self.ready_time = None
+            self.idle = True
+        for msg in due:
+            self.last_reply_time = now
+            self.write_line(msg)
+
+    def current_pos(self, now=None):
+        now = time.monotonic() if now is None else now
+        pos = self.pos
+        for start_time, end_time, start, end in self.legs:
+            if now >= end_time:
+                pos = end
+                continue
+            frac = max(0.0, (now - start_time) / (end_time - start_time))
+            pos = np.round(start + frac * (end - start))
+            break
+        return [int(p) for p in pos]
+
+    def forces(self, pos):
+        total = self.stiffness * max(0, pos[2] - self.contact_z)
+        u, v = np.clip(np.array(pos[:2]) / self.plate_size, 0, 1)
+        weights = np.array([(1 - u) * (1 - v), u * (1 - v), (1 - u) * v, u * v])
+        return total * weights + self.rng.normal(0, self.force_noise, 4)
+
+    def durations(self, steps):
+        """
+        :param steps: number of steps of each leg of a command
+        :return: real (scaled) seconds each leg takes
+        """
+        if self.move_time is not None:
+            return [self.move_time / len(steps)] * len(steps)
+        return [n * self.step_time / self.time_scale for n in steps]
+
+    def plan(self, now, waypoints):
+        """
+        Replace the current motion by straight legs from the current position
+        through `waypoints`, each a (position, number of steps) pair.
+        :return: end time of every leg
+        """
+        self.pos = np.array(self.current_pos(now), dtype=np.float64)
+        self.legs = []
+        start_time, start, end_times = now, self.pos, []
+        for (end, _), duration in zip(waypoints, self.durations([steps for _, steps in waypoints])):
+            end = np.array(end, dtype=np.float64)
+            self.legs.append((start_time, start_time + duration, start, end))
+            start_time, start = start_time + duration, end
+            end_times.append(start_time)
+        return end_times
+
+    def reply_delay(self, extra_time=0.0):
+        if self.move_time is not None:
+            return 0.0
+        return (extra_time + self.reply_latency) / self.time_scale
+
+    def blocking(self, now, waypoints, reply, extra_time=0.0):
+        """
+        Run a blocking routine moving through `waypoints`, replying `reply`
+        after `extra_time` (unscaled seconds) more. A move the routine
+        interrupted is resumed afterwards, as the firmware's loop() does.
+        """
+        end = self.plan(now, waypoints)[-1] + self.reply_delay(extra_time)
+        self.replies.append((end, reply))
+        self.input_blocked_until = self.stream_blocked_until = end
+        if not self.idle:
+            self.move_to_target(end)
+
+    def home(self, now, reply):
+        # TBControl::initialize homes z, x and y in turn, then tares the load cells
+        x, y, z = self.current_pos(now)
+        self.blocking(now, [((x, y, 0), z), ((self.x_init, y, 0), abs(x - self.x_init)),
+                            ((self.x_init, 0, 0), y)], reply, self.tare_time)
+
+    def move_to_target(self, now):
+        """
+        Move to self.target like the firmware's loop(): x and y together,
+        then z. Input is read again once x and y have arrived.
+        """
+        x, y, z = self.current_pos(now)
+        tx, ty, tz = self.target
+        xy_end, z_end = self.plan(now, [((tx, ty, z), max(abs(tx - x), abs(ty - y))), (self.target, abs(tz - z))])
+        self.input_blocked_until = max(self.input_blocked_until, xy_end)
+        self.ready_time = z_end + self.reply_delay()
+        self.idle = False
+
+    def press(self, now, quick_steps, thresh):
+        # TBControl::feedbackMoveZ
+        x, y, z = self.current_pos(now)
+        z += quick_steps
+        weight, steps, samples = 0.0, 0, 0
+        while weight < thresh and z < PRESS_Z_LIMIT:
+            z += 1
+            if steps % PRESS_SAMPLE_STEPS == 0:
+                weight = np.abs(self.forces((x, y, z))).sum()
+                samples += 1
+            weight /= 4
+            steps += 1
+        self.blocking(now, [((x, y, z), quick_steps + steps)], f'Pressed to max force {weight:.2f}',
+                      samples * self.sample_time)
+
+    def set_targets(self, targets):
+        # Axis::setTarget ignores out of range targets
+        for axis, target in enumerate(targets):
+            if target < 0 or target > MAX_STEPS[axis]:
+                self.write_line(f'Invalid target set at {target}')
+                continue
+            self.target[axis] = target
+            self.write_line(f'Target set to {target}')
+
+    def move_norm(self, now):
+        # TBControl::moveNorm prints the x step period when x is not the longer move
+        pos = self.current_pos(now)
+        xd, yd = abs(self.target[0] - pos[0]), abs(self.target[1] - pos[1])
+        if xd <= yd:
+            # Unsigned division by zero gives all ones on the AVR
+            self.write_line(str(int(1000 * yd) // int(xd) if xd else 0xFFFFFFFF))
+
+    def handle_input(self, cmd, now):
+        if cmd == 'start':
+            self.home(now, 'Initialized')
+        elif cmd == 'invx':
+            self.x_init = X_INV_INIT_POS
+        elif cmd == 'r':
+            self.home(now, 'Reset')
+        elif cmd == 'rz':
+            x, y, z = self.current_pos(now)
+            self.blocking(now, [((x, y, 0), z)], 'Reset Z')
+        elif cmd.startswith('pz'):
+            quick_steps = _int16(_to_int(_substring(cmd, cmd.find('z') + 1, cmd.find('w'))))
+            self.press(now, quick_steps, _to_int(_substring(cmd, cmd.find('w') + 1)))
+        elif cmd == 'l':
+            self.write_line(self.data_str())
+        elif cmd.startswith('s'):
+            rate = _to_int(_substring(cmd, 1))
+            self.stream_period = (1000000 // rate) * 1e-6 if rate > 0 else None
+            self.next_frame_time = now
+        else:
+            # By default, a position command
+            self.set_targets([_int16(_to_int(_substring(cmd, cmd.find('x') + 1, cmd.find('y')))),
+                              _int16(_to_int(_substring(cmd, cmd.find('y') + 1, cmd.find('z')))),
+                              _int16(_to_int(_substring(cmd, cmd.find('z') + 1)))])
+            self.move_norm(now)
+            self.move_to_target(now)
+
+    def data_str(self):
+        # TBControl::log
+        pos = self.current_pos()
+        forces = ''.join(f'{i + 1}: {abs(force):.2f} ' for i, force in enumerate(self.forces(pos)))
+        return f'X: {pos[0]} Y: {pos[1]} Z: {pos[2]} {forces}'
+
+
+class TBEmulatorProcess(multiprocessing.Process):
+    """
+    Runs a TBEmulator in its own process, so that many simulated testbenches
+    can run side by side without sharing a GIL. `port_name` is available
+    once `start` returns.
+    """
+
+    def __init__(self, **emulator_kwargs):
+        super(TBEmulatorProcess, self).__init__(daemon=True)
+        self.emulator_kwargs = emulator_kwargs
+        self.port_queue = multiprocessing.Queue()
+        self.stop_event = multiprocessing.Event()
+        self.port_name = None
+
+    def run(self):
+        emulator = TBEmulator(**self.emulator_kwargs).start()
+        self.port_queue.put(emulator.port_name)
+        self.stop_event.wait()
+        emulator.stop()
+
+    def start(self):
+        super(TBEmulatorProcess, self).start()
+        self.port_name = self.port_queue.get(timeout=10)
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='run simulated testbenches on pseudo-terminals')
+    parser.add_argument('-n', '--num', action='store', type=int, default=1, help='number of testbenches')
+    parser.add_argument('--time_scale', action='store', type=float, default=1.0)
+    args = parser.parse_args()
+
+    emulators = [TBEmulatorProcess(time_scale=args.time_scale, seed=i).start() for i in range(args.num)]
+    for emulator in emulators:
+        print(emulator.port_name)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for emulator in emulators:
+            emulator.stop()
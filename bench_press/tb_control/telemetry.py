@@ -0,0 +1,80 @@
+"""
+Binary telemetry frames streamed by the testbench firmware after `s<rate>`
+(`s0` stops streaming). Every frame is 36 bytes, little endian:
+
+    magic     2 bytes   0xA5 0x5A
+    fw_time   uint32    firmware micros() at sampling time
+    x, y, z   int32     axis positions in steps
+    force     4x float  load cell readings
+    crc       uint16    CRC-16/CCITT-FALSE over fw_time..force
+
+Text lines are plain ASCII, so a 0xA5 byte can only start a frame.
+"""
+
+import binascii
+import struct
+
+import numpy as np
+
+FRAME_MAGIC = b'\xa5\x5a'
+FRAME_STRUCT = struct.Struct('<2sI3i4fH')
+FRAME_SIZE = FRAME_STRUCT.size
+
+FRAME_DTYPE = np.dtype([
+    ('magic', 'S2'),
+    ('fw_time', '<u4'),
+    ('x', '<i4'),
+    ('y', '<i4'),
+    ('z', '<i4'),
+    ('force', '<f4', (4,)),
+    ('crc', '<u2'),
+])
+
+TELEMETRY_DTYPE = np.dtype([
+    ('host_time', 'f8'),  # time.monotonic() when the frame was received
+    ('fw_time', 'u4'),
+    ('x', 'i4'),
+    ('y', 'i4'),
+    ('z', 'i4'),
+    ('force', 'f4', (4,)),
+])
+
+assert FRAME_DTYPE.itemsize == FRAME_SIZE
+
+
+def crc16(payload):
+    return binascii.crc_hqx(payload, 0xFFFF)
+
+
+def encode_frame(fw_time, x, y, z, forces):
+    frame = FRAME_STRUCT.pack(FRAME_MAGIC, fw_time & 0xFFFFFFFF, x, y, z, *forces, 0)
+    return frame[:-2] + struct.pack('<H', crc16(frame[2:-2]))
+
+
+def frame_ok(frame):
+    return frame[:2] == FRAME_MAGIC and crc16(frame[2:-2]) == struct.unpack_from('<H', frame, FRAME_SIZE - 2)[0]
+
+
+def decode_frames(buf, host_time):
+    """
+    :param buf: concatenation of valid frames
+    :param host_time: receive time stamped on every decoded record
+    :return: structured array with TELEMETRY_DTYPE
+    """
+    frames = np.frombuffer(buf, dtype=FRAME_DTYPE)
+    records = np.empty(len(frames), dtype=TELEMETRY_DTYPE)
+    records['host_time'] = host_time
+    for key in ('fw_time', 'x', 'y', 'z', 'force'):
+        records[key] = frames[key]
+    return records
+
+
+def record_to_dict(record):
+    """
+    Convert a telemetry record to the dictionary format returned by TestBench.req_data
+    """
+    res = {'x': int(record['x']), 'y': int(record['y']), 'z': int(record['z'])}
+    for i in range(4):
+        res['force_' + str(i + 1)] = float(record['force'][i])
+    res['time'] = float(record['host_time'])
+    return res
@@ -1,7 +1,15 @@
 import datetime
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
 from enum import Enum
 
 import serial
+from bench_press.tb_control.telemetry import FRAME_MAGIC, FRAME_SIZE, TELEMETRY_DTYPE, decode_frames, frame_ok, \
+    record_to_dict
+from bench_press.utils.ring_buffer import RingBuffer
 
 
 # This class provides an interface to the gelsight testbench setup via serial.
@@ -14,13 +22,118 @@ class State(Enum):
     READY = 2
 
 
+class SerialReaderThread(threading.Thread):
+    """
+    Background reader for the testbench serial port. Each pass blocks for one
+    byte, then drains whatever else is waiting, and splits the bytes into text
+    lines, handed to `line_callback`, and binary telemetry frames. All valid
+    frames in a read are passed to `frame_callback` at once.
+
+    The blocking read returns as soon as a byte arrives; the port timeout only
+    bounds how long `stop` takes. Compared to busy-polling the port on the
+    caller's thread, a reply reaches a waiting caller after two thread wake-ups
+    instead of none, which costs about 150-200us at the median (see
+    scripts/bench_tb_serial.py), in exchange for not spinning a core.
+    """
+
+    def __init__(self, ser, line_callback, frame_callback=None):
+        super(SerialReaderThread, self).__init__(daemon=True)
+        self.ser = ser
+        self.line_callback = line_callback
+        self.frame_callback = frame_callback
+        self.stop_event = threading.Event()
+        self.buffer = bytearray()
+        self.line = bytearray()
+        self.bad_frames = 0
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                # Block for the first byte, then take the rest of the reply in the same pass
+                chunk = self.ser.read(1)
+                if chunk and self.ser.in_waiting:
+                    chunk += self.ser.read(self.ser.in_waiting)
+            except (serial.SerialException, OSError, TypeError):
+                # Port was closed underneath us
+                break
+            if chunk:
+                self.feed(chunk)
+
+    def feed(self, chunk):
+        self.buffer.extend(chunk)
+        frames = []
+        while self.buffer:
+            if self.buffer[0] == FRAME_MAGIC[0]:
+                if len(self.buffer) < FRAME_SIZE:
+                    break
+                frame = bytes(self.buffer[:FRAME_SIZE])
+                if frame_ok(frame):
+                    frames.append(frame)
+                    del self.buffer[:FRAME_SIZE]
+                else:
+                    # Corrupted frame: drop it whole if the header survived,
+                    # otherwise skip a byte and resynchronize
+                    self.bad_frames += 1
+                    del self.buffer[:FRAME_SIZE if frame.startswith(FRAME_MAGIC) else 1]
+                continue
+            newline = self.buffer.find(b'\n')
+            magic = self.buffer.find(FRAME_MAGIC[:1])
+            if magic >= 0 and (newline < 0 or magic < newline):
+                # A frame was sent in the middle of a line
+                self.line.extend(self.buffer[:magic])
+                del self.buffer[:magic]
+                continue
+            if newline < 0:
+                self.line.extend(self.buffer)
+                self.buffer.clear()
+                break
+            self.line.extend(self.buffer[:newline])
+            del self.buffer[:newline + 1]
+            line = self.line.decode(errors='replace').rstrip('\r')
+            self.line = bytearray()
+            self.line_callback(line)
+        if frames and self.frame_callback is not None:
+            self.frame_callback(b''.join(frames))
+
+    def stop(self):
+        self.stop_event.set()
+
+
 class TestBench:
     IDLE_MSGS = ["Initialized", "Moved", "Reset", "Pressed", "Ready"]
+    DATA_PREFIX = 'X:'
+    CAPABILITIES_PREFIX = 'Capabilities:'
 
-    def __init__(self, name):
-        self.ser = serial.Serial(name, baudrate=250000, timeout=1)
-        self.curr_msg = ""
+    def __init__(self, name, verbose=True, telemetry_capacity=4096):
+        self.ser = serial.Serial(name, baudrate=250000, timeout=0.05)
+        self.verbose = verbose
+        self.telemetry = RingBuffer(TELEMETRY_DTYPE, telemetry_capacity)
+        self.stream_rate = 0
+        # Optional protocol features announced by the firmware at boot, before "Starting"
+        self.capabilities = set()
         self.state = State.IDLE
+        self.state_cond = threading.Condition()
+        self.msg_count = 0
+        self.data_lines = queue.Queue()
+        self.req_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        # Queued xyz targets with their futures, the move in flight, and the
+        # position the queue will end at (None when unknown, e.g. after a reset)
+        self.waypoints = deque()
+        self.current_move = None
+        self.commanded_pos = None
+        self.reader = SerialReaderThread(self.ser, self.__handle_line, self.__handle_frames)
+        self.reader.start()
+
+    def __send(self, msg, state=None):
+        # The state is set before writing so that a fast reply cannot be
+        # processed before we have marked ourselves as busy.
+        if state is not None:
+            with self.state_cond:
+                self.state = state
+        with self.write_lock:
+            self.ser.write(msg)
+            self.ser.flush()
 
     def target_pos(self, x, y, z):
         """
@@ -28,10 +141,44 @@ class TestBench:
         After calling target_pos, wait for the testbench to become idle again.
         """
 
+        self.commanded_pos = (x, y, z)
         msg = 'x' + str(x) + 'y' + str(y) + 'z' + str(z) + '\n'
-        self.ser.write(msg.encode())
-        self.state = State.BUSY
-        print(self.state)
+        self.__send(msg.encode(), State.BUSY)
+
+    def move_to_async(self, x, y, z):
+        """
+        Queue an xyz target without waiting for the testbench.
+        Targets are sent one at a time, in order: the reader thread sends the
+        next one as soon as the previous move is reported done, so a sequence
+        of waypoints costs no host round trips in between.
+        :return: concurrent.futures.Future resolving to the (x, y, z) target
+            once the testbench has reached it. Cancelling it before the target
+            is sent drops the target from the queue.
+        """
+
+        future = Future()
+        with self.state_cond:
+            self.waypoints.append(((x, y, z), future))
+            self.commanded_pos = (x, y, z)
+            if self.current_move is None and self.state != State.BUSY:
+                self.__next_waypoint()
+        return future
+
+    def moves_pending(self):
+        return self.current_move is not None or len(self.waypoints) > 0
+
+    def __next_waypoint(self):
+        # Called with state_cond held. Waypoints whose future was cancelled are dropped.
+        while self.waypoints:
+            (x, y, z), future = self.waypoints.popleft()
+            if future.set_running_or_notify_cancel():
+                self.current_move = ((x, y, z), future)
+                msg = 'x' + str(x) + 'y' + str(y) + 'z' + str(z) + '\n'
+                self.__send(msg.encode(), State.BUSY)
+                return
+            if not self.waypoints:
+                # The last queued target will not be reached, so where the testbench ends up is unknown
+                self.commanded_pos = None
 
     def reset(self):
         """
@@ -40,13 +187,11 @@ class TestBench:
         After calling reset, wait for the testbench to become idle again.
         """
 
-        self.ser.write(b'r\n')
-        self.ser.flush()
-        self.state = State.BUSY
+        self.commanded_pos = None
+        self.__send(b'r\n', State.BUSY)
 
     def flip_x_reset(self):
-        self.ser.write(b'invx\n')
-        self.ser.flush()
+        self.__send(b'invx\n')
 
     def press_z(self, quick_steps, thresh):
         """
@@ -58,9 +203,8 @@ class TestBench:
         """
 
         msg = 'pz' + str(quick_steps) + 'w' + str(thresh) + '\n'
-        self.ser.write(msg.encode())
-        self.ser.flush()
-        self.state = State.BUSY
+        self.commanded_pos = None
+        self.__send(msg.encode(), State.BUSY)
 
     def reset_z(self):
         """
@@ -69,9 +213,8 @@ class TestBench:
         After calling reset_z, wait for the testbench to become idle again.
         """
 
-        self.ser.write(b'rz\n')
-        self.ser.flush()
-        self.state = State.BUSY
+        self.commanded_pos = None
+        self.__send(b'rz\n', State.BUSY)
 
     def busy(self):
         return self.state == State.BUSY
@@ -87,35 +230,74 @@ class TestBench:
         After calling start, wait for the testbench to become idle again.
         """
 
-        self.ser.write(b'start\n')
-        self.ser.flush()
-        self.state = State.BUSY
+        self.commanded_pos = None
+        self.__send(b'start\n', State.BUSY)
+
+    def wait_idle(self, timeout=None):
+        """
+        Block until the testbench is no longer busy, without polling.
+        :param timeout: maximum number of seconds to wait, None waits forever
+        :return: True if the testbench became idle, False on timeout
+        """
+        with self.state_cond:
+            return self.state_cond.wait_for(lambda: self.state != State.BUSY, timeout)
+
+    def wait_ready(self, timeout=None):
+        """
+        Block until the testbench reports that its firmware has started.
+        :param timeout: maximum number of seconds to wait, None waits forever
+        :return: True if the testbench is ready, False on timeout
+        """
+        with self.state_cond:
+            return self.state_cond.wait_for(lambda: self.state == State.READY, timeout)
 
     def __handle_msg(self, msg):
         pm = str(datetime.datetime.now()) + ": " + msg
-        if any([msg.startswith(key) for key in self.IDLE_MSGS]):
-            self.state = State.IDLE
-        if msg.startswith("Starting"):
-            self.state = State.READY
-        print(pm)
+        finished = None
+        with self.state_cond:
+            if any([msg.startswith(key) for key in self.IDLE_MSGS]):
+                self.state = State.IDLE
+                finished, self.current_move = self.current_move, None
+                if self.waypoints:
+                    self.__next_waypoint()
+            if msg.startswith(self.CAPABILITIES_PREFIX):
+                self.capabilities = set(msg[len(self.CAPABILITIES_PREFIX):].split())
+            if msg.startswith("Starting"):
+                self.state = State.READY
+            self.msg_count += 1
+            self.state_cond.notify_all()
+        if finished is not None:
+            target, future = finished
+            if future.running():
+                future.set_result(target)
+        if self.verbose:
+            print(pm)
         return pm
 
-    def update(self):
+    def __handle_line(self, line):
+        if line.startswith(self.DATA_PREFIX):
+            self.data_lines.put(line)
+        elif line.startswith('l'):  # Ignore echo of log request
+            return
+        else:
+            self.__handle_msg(line)
+
+    def __handle_frames(self, buf):
+        self.telemetry.extend(decode_frames(buf, time.monotonic()))
+
+    def update(self, timeout=0.1):
         """
-        If you are waiting on a message (for example, indicator that state will
-        change from busy to idle), call update in a loop, otherwise new messages
-        will not be received over serial.
+        Messages are received by a background thread, so calling update is no
+        longer required. It is kept for scripts which wait using
+        `while tb.busy(): tb.update()`: it now sleeps until the next message
+        arrives (or `timeout` expires) instead of spinning.
         """
 
-        for i in range(self.ser.inWaiting()):
-            ch = self.ser.read().decode()
-            if ch == "\n":
-                self.__handle_msg(self.curr_msg)
-                self.curr_msg = ""
-            else:
-                self.curr_msg += ch
+        with self.state_cond:
+            count = self.msg_count
+            self.state_cond.wait_for(lambda: self.msg_count != count, timeout)
 
-    def req_data(self):
+    def req_data(self, timeout=1.0):
         """
         Queries testbench for latest XYZ position and load cell readings.
         This method, unlike other commands sent to the testbench,
@@ -123,12 +305,72 @@ class TestBench:
         value is a dictionary with parsed values.
         """
 
-        self.ser.write(b'l\n')
-        self.ser.flush()
-        data = self.ser.readline()
-        while data.decode().startswith('l'):  # Ignore echo of log request
-            data = self.ser.readline()
-        return self.__parse_data_str(data.decode())
+        with self.req_lock:
+            while not self.data_lines.empty():  # Drop stale replies
+                self.data_lines.get_nowait()
+            self.__send(b'l\n')
+            data = self.data_lines.get(timeout=timeout)
+        return self.__parse_data_str(data)
+
+    def start_stream(self, rate):
+        """
+        Ask the firmware to push binary telemetry frames (position, load cells
+        and a timestamp) at `rate` Hz. They are decoded by the reader thread
+        into `self.telemetry`, so `latest_data` needs no serial round trip.
+        The text protocol, including req_data, keeps working while streaming.
+        Firmware that does not announce the 'stream' capability at boot would
+        parse `s<rate>` as a position command, so it is never sent to it.
+        """
+
+        if not self.supports('stream'):
+            raise RuntimeError('Testbench firmware does not support streaming, flash firmware/testbench')
+        self.stream_rate = rate
+        self.__send(('s' + str(rate) + '\n').encode())
+
+    def stop_stream(self):
+        if not self.streaming():
+            return
+        self.stream_rate = 0
+        self.__send(b's0\n')
+
+    def supports(self, capability):
+        """
+        :return: whether the firmware announced `capability` when it started
+        """
+        return capability in self.capabilities
+
+    def streaming(self):
+        return self.stream_rate > 0
+
+    def latest_data(self, max_age=None):
+        """
+        Latest streamed XYZ position and load cell readings, in the same format
+        as req_data plus the host receive 'time'. Falls back to req_data when
+        nothing has been streamed yet, or the newest frame is older than
+        `max_age` seconds.
+        """
+
+        record = self.telemetry.latest()
+        if record is None or (max_age is not None and time.monotonic() - record['host_time'] > max_age):
+            return self.req_data()
+        return record_to_dict(record)
+
+    def close(self):
+        with self.state_cond:
+            pending = [future for _, future in self.waypoints]
+            if self.current_move is not None:
+                pending.append(self.current_move[1])
+            self.waypoints.clear()
+            self.current_move = None
+        for future in pending:
+            # Only the move in progress is running, queued ones can still be cancelled
+            if future.running():
+                future.set_exception(RuntimeError('Testbench closed before the move finished'))
+            else:
+                future.cancel()
+        self.reader.stop()
+        self.reader.join()
+        self.ser.close()
 
     @staticmethod
     def __parse_data_str(data):
@@ -1,7 +1,12 @@
+import sys
 import threading
 import time
+from collections import namedtuple
 
 import cv2
+import numpy as np
+from bench_press.utils.rate_scheduler import RateScheduler
+from bench_press.utils.ring_buffer import RingBuffer
 
 
 class Camera:
@@ -15,8 +20,11 @@ class Camera:
         self.goal_height, self.goal_width = goal_height, goal_width
         print(f'Instantiating camera {self.name} with raw height: {self.raw_height} and width: {self.raw_width}')
 
-    def get_raw_frame(self):
-        return self.cap.read()
+    def get_raw_frame(self, out=None):
+        """
+        :param out: optional array to capture into, reused if its shape matches
+        """
+        return self.cap.read(out)
 
     """
     :returns current camera frame in BGR format!
@@ -27,47 +35,159 @@ class Camera:
         return raw_frame, cv2.resize(raw_frame, (self.goal_width, self.goal_height), interpolation=cv2.INTER_AREA)
 
 
+class BufferPool:
+    """
+    A small set of preallocated arrays which frames are converted into.
+    A buffer is only handed out again once nobody else holds a reference to it
+    (numpy views keep their base array alive, so a frame stored in an
+    observation pins its buffer). If every buffer is still in use, a fresh one
+    takes the place of one of them, which stays alive for as long as its
+    readers need it.
+    """
+
+    def __init__(self, shape, size=3, dtype=np.uint8):
+        self.shape, self.dtype = shape, dtype
+        self.buffers = [np.empty(shape, dtype=dtype) for _ in range(size)]
+        self.next = 0
+
+    def acquire(self):
+        for _ in range(len(self.buffers)):
+            i = self.next
+            self.next = (self.next + 1) % len(self.buffers)
+            if sys.getrefcount(self.buffers[i]) <= 2:  # Only the list and the getrefcount argument
+                return self.buffers[i]
+        self.buffers[i] = np.empty(self.shape, dtype=self.dtype)
+        return self.buffers[i]
+
+
+# Read-only views of the most recent frames, with their sequence number and capture time
+Frame = namedtuple('Frame', ['seq', 'timestamp', 'image', 'raw_image'])
+
+
+def _readonly_view(arr):
+    view = arr.view()
+    view.flags.writeable = False
+    return view
+
+
 class CameraThread(threading.Thread):
 
-    def __init__(self, camera, thread_rate):
+    def __init__(self, camera, thread_rate, publish_raw=True, num_buffers=3, history_len=64):
         super(CameraThread, self).__init__()
         assert isinstance(camera, Camera), 'CameraThread must be built using Camera obj'
         self.camera = camera
         self.thread_rate = thread_rate  # (polling rate in Hz)
-        self.current_frame, self.current_frame_raw = None, None
-        self.running_lock = threading.Lock()
-        self.running = None
+        self.publish_raw = publish_raw  # Full resolution RGB conversion is skipped unless requested
+        self.num_buffers = num_buffers
+        self.frame_pool, self.raw_frame_pool = None, None
+        self.latest = Frame(-1, None, None, None)  # Swapped as a whole, so readers always see a consistent frame
+        self.frame_cond = threading.Condition()
+        self.scheduler = RateScheduler(thread_rate)
+        self.raw_bgr, self.small_bgr = None, None  # Capture buffers, reused every cycle
+        # The last history_len (resized) frames with their timestamps, for lookups by capture time
+        self.history = RingBuffer(np.dtype([
+            ('timestamp', 'f8'),
+            ('seq', 'i8'),
+            ('image', np.uint8, (camera.goal_height, camera.goal_width, 3)),
+        ]), history_len)
+
+    def subscribe_raw(self):
+        self.publish_raw = True
+
+    def _capture(self):
+        success, self.raw_bgr = self.camera.get_raw_frame(self.raw_bgr)
+        raw_bgr = self.raw_bgr
+        if self.small_bgr is None:
+            self.small_bgr = np.empty((self.camera.goal_height, self.camera.goal_width, 3), dtype=np.uint8)
+            self.frame_pool = BufferPool(self.small_bgr.shape, self.num_buffers)
+        small_bgr = self.small_bgr
+        cv2.resize(raw_bgr, (self.camera.goal_width, self.camera.goal_height), dst=small_bgr,
+                   interpolation=cv2.INTER_AREA)
+        timestamp = time.monotonic()
+
+        frame = self.frame_pool.acquire()
+        cv2.cvtColor(small_bgr, cv2.COLOR_BGR2RGB, dst=frame)
+        raw_frame = None
+        if self.publish_raw:
+            if self.raw_frame_pool is None or self.raw_frame_pool.shape != raw_bgr.shape:
+                self.raw_frame_pool = BufferPool(raw_bgr.shape, self.num_buffers)
+            raw_frame = self.raw_frame_pool.acquire()
+            cv2.cvtColor(raw_bgr, cv2.COLOR_BGR2RGB, dst=raw_frame)
+            raw_frame = _readonly_view(raw_frame)
+
+        seq = self.latest.seq + 1
+        idx = self.history.claim()
+        self.history.data['timestamp'][idx] = timestamp
+        self.history.data['seq'][idx] = seq
+        self.history.data['image'][idx] = frame
+        self.history.commit()
+
+        self.latest = Frame(seq, timestamp, _readonly_view(frame), raw_frame)
+        with self.frame_cond:
+            self.frame_cond.notify_all()
 
     def run(self):
-        with self.running_lock:
-            self.running = True
-        while True:
-            with self.running_lock:
-                if not self.running:
-                    break
-            start = time.time()
-            raw_bgr, current_bgr_frame = self.camera.get_frame()
-            self.current_frame = cv2.cvtColor(current_bgr_frame, cv2.COLOR_BGR2RGB)
-            self.current_frame_raw = cv2.cvtColor(raw_bgr, cv2.COLOR_BGR2RGB)
-            end = time.time()
-            time_per_cycle = 1.0 / self.thread_rate  # Number of seconds per cycle
-            remaining = start - end + time_per_cycle
-            if remaining > 0:
-                time.sleep(remaining)
+        self.scheduler.run(self._capture)
 
     def get_frame(self):
-        return self.current_frame
+        return self.latest.image
 
     def get_raw_frame(self):
-        return self.current_frame_raw
+        return self.latest.raw_image
+
+    def get_latest(self):
+        """
+        :return: Frame tuple with the most recent frame, raw frame (None unless
+            publish_raw is set), their sequence number and capture timestamp
+        """
+        return self.latest
+
+    @staticmethod
+    def _record_to_frame(record):
+        return Frame(int(record['seq']), float(record['timestamp']), record['image'], None)
+
+    def frame_at(self, t):
+        """
+        :param t: time.monotonic() timestamp
+        :return: Frame from the history captured closest to t (without raw
+            image), None if the history is empty
+        """
+        i = self.history.search(t, 'timestamp')
+        records = self.history.get(i - 1, i + 1)
+        if len(records) == 0:
+            return None
+        return self._record_to_frame(records[np.argmin(np.abs(records['timestamp'] - t))])
+
+    def frames_between(self, t0, t1):
+        """
+        :return: list of Frames from the history captured in [t0, t1], oldest first
+        """
+        records = self.history.get(self.history.search(t0, 'timestamp'),
+                                   self.history.search(t1, 'timestamp', side='right'))
+        return [self._record_to_frame(record) for record in records]
+
+    def latest_after(self, t, timeout=None):
+        """
+        Wait until a frame captured at or after time t is available.
+        :return: the latest Frame, or None if none arrived within timeout seconds
+        """
+        with self.frame_cond:
+            arrived = self.frame_cond.wait_for(
+                lambda: self.latest.timestamp is not None and self.latest.timestamp >= t, timeout)
+        return self.latest if arrived else None
 
     # Get human-readable name specified in config
     def get_name(self):
         return self.camera.name
 
+    def get_rate_stats(self):
+        return self.scheduler.stats()
+
+    def rate_summary(self):
+        return self.scheduler.summary()
+
     def stop(self):
-        with self.running_lock:
-            self.running = False
+        self.scheduler.stop()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,154 @@
+"""
+Columnar trajectory format: one HDF5 file per rollout with one array per
+modality, indexed by step, instead of one deepdish group per step:
+
+    /images/<cam>        (T, H, W, 3) uint8
+    /raw_images/<cam>    (T, RH, RW, 3) uint8
+    /tb_state            (T,) structured array with the tb_state fields (x, y, z, force_1..4, ...)
+    /dynamixel_state     (T,) float64
+    /optoforce           (T, 3) float64
+
+Arrays are chunked along the step axis (and optionally compressed), so a
+step range of a modality is read with a single I/O call.
+"""
+import os
+
+import deepdish as dd
+import h5py
+import numpy as np
+
+FORMAT_NAME = 'columnar'
+FORMAT_VERSION = 1
+IMAGE_KEYS = ('images', 'raw_images')
+# Modalities the training datasets need, raw images are only read when asked for
+DEFAULT_KEYS = ('images', 'tb_state', 'dynamixel_state', 'optoforce')
+
+
+def is_columnar(path):
+    with h5py.File(path, 'r') as f:
+        return f.attrs.get('format') == FORMAT_NAME
+
+
+def _tb_state_dtype(tb_state):
+    return np.dtype([(k, 'i8' if isinstance(v, (int, np.integer)) else 'f8') for k, v in tb_state.items()])
+
+
+def write_columnar(path, observations, chunk_steps=8, compression='lzf', source=None):
+    """
+    :param observations: list of observation dicts, as logged by Logger.log_obs
+    :param chunk_steps: number of steps per chunk of the image arrays
+    :param compression: h5py compression filter for the image arrays, None to disable
+    """
+    num_steps = len(observations)
+    with h5py.File(path, 'w') as f:
+        f.attrs['format'] = FORMAT_NAME
+        f.attrs['version'] = FORMAT_VERSION
+        f.attrs['num_steps'] = num_steps
+        if source is not None:
+            f.attrs['source'] = source
+        first = observations[0]
+        for key in IMAGE_KEYS:
+            if not first.get(key):
+                continue
+            group = f.create_group(key)
+            for cam, image in first[key].items():
+                images = np.stack([obs[key][cam] for obs in observations]).astype(np.uint8)
+                group.create_dataset(cam, data=images, chunks=(min(chunk_steps, num_steps),) + image.shape,
+                                     compression=compression)
+        if 'tb_state' in first:
+            dtype = _tb_state_dtype(first['tb_state'])
+            tb_state = np.array([tuple(obs['tb_state'][k] for k in dtype.names) for obs in observations], dtype=dtype)
+            f.create_dataset('tb_state', data=tb_state)
+        if first.get('dynamixel_state') is not None:
+            f.create_dataset('dynamixel_state', data=np.array([obs['dynamixel_state'] for obs in observations],
+                                                              dtype=np.float64))
+        if first.get('optoforce') is not None:
+            f.create_dataset('optoforce', data=np.array([obs['optoforce'] for obs in observations],
+                                                        dtype=np.float64))
+
+
+def convert_record(src, dst, **kwargs):
+    """
+    Convert a deepdish rollout log (record_<n>.h5) to the columnar format.
+    """
+    write_columnar(dst, dd.io.load(src), source=os.path.abspath(src), **kwargs)
+
+
+class ColumnarTrajectory:
+    """
+    Reader for the columnar format. `traj[t0:t1]` returns a dict with the
+    arrays of every modality for those steps; `observations` returns per-step
+    observation dicts in the layout of the deepdish logs, so the obs_to_*
+    helpers work on either.
+
+    The file is opened lazily and reopened after a fork or unpickling, so a
+    reader can be created before DataLoader workers are started.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file, self.pid = None, None
+        with h5py.File(path, 'r') as f:
+            self.num_steps = int(f.attrs['num_steps'])
+
+    def _file(self):
+        if self.file is None or self.pid != os.getpid():
+            self.file, self.pid = h5py.File(self.path, 'r'), os.getpid()
+        return self.file
+
+    def __len__(self):
+        return self.num_steps
+
+    def __getstate__(self):
+        # Open files cannot be pickled (e.g. into Pool or DataLoader workers), the copy reopens it
+        state = self.__dict__.copy()
+        state['file'], state['pid'] = None, None
+        return state
+
+    def read(self, sel, keys=None):
+        """
+        :param sel: slice, or increasing list of step indices
+        :param keys: modalities to read, None for all of them
+        :return: dict of modality -> array (dict of camera -> array for images)
+        """
+        f = self._file()
+        out = {}
+        for key in (f.keys() if keys is None else keys):
+            if key not in f:
+                continue
+            if isinstance(f[key], h5py.Group):
+                out[key] = {cam: dset[sel] for cam, dset in f[key].items()}
+            else:
+                out[key] = f[key][sel]
+        return out
+
+    def __getitem__(self, sel):
+        assert isinstance(sel, slice), 'Index a trajectory with a slice, or use read/observations'
+        return self.read(sel)
+
+    def observations(self, steps, keys=DEFAULT_KEYS):
+        """
+        :param steps: step indices, in any order and possibly repeated
+        :return: tuple of observation dicts, one per step
+        """
+        unique = sorted(set(steps))
+        contiguous = unique[-1] - unique[0] + 1 == len(unique)
+        data = self.read(slice(unique[0], unique[-1] + 1) if contiguous else unique, keys)
+        obs_list = []
+        for step in steps:
+            i = unique.index(step)
+            obs = {}
+            for key, value in data.items():
+                if isinstance(value, dict):
+                    obs[key] = {cam: images[i] for cam, images in value.items()}
+                elif key == 'tb_state':
+                    obs[key] = {name: value[i][name].item() for name in value.dtype.names}
+                else:
+                    obs[key] = value[i]
+            obs_list.append(obs)
+        return tuple(obs_list)
+
+    def close(self):
+        if self.file is not None and self.pid == os.getpid():
+            self.file.close()
+        self.file = None
@@ -2,6 +2,7 @@ import datetime
 from pathlib import Path
 
 import deepdish as dd
+from bench_press.utils.rollout_writer import RolloutWriter
 from omegaconf import OmegaConf
 
 
@@ -30,3 +31,33 @@ class Logger:
     def log_obs(self, obs, index):
         assert isinstance(obs, list), 'observations should be logged in list format, first dim being time'
         dd.io.save(f"{self.log_dir}/record_{index}.h5", obs)
+
+    def start_rollout(self, index):
+        """
+        :return: recorder with `append(obs)` and `close()` for the observations
+            of rollout `index`. With `stream_obs` set, they are written to disk
+            as they arrive (see RolloutWriter), otherwise kept in memory and
+            saved with log_obs on close.
+        """
+        if not self.logger_conf.stream_obs:
+            return BufferedRollout(self, index)
+        return RolloutWriter(f"{self.log_dir}/record_{index}.h5",
+                             queue_size=self.logger_conf.stream_queue_size or 8,
+                             flush_every=self.logger_conf.flush_every or 10,
+                             compression=self.logger_conf.get('compression', 'blosc'),
+                             compression_level=self.logger_conf.compression_level or 5)
+
+
+class BufferedRollout:
+
+    def __init__(self, logger, index):
+        self.logger = logger
+        self.index = index
+        self.observations = []
+
+    def append(self, obs):
+        self.observations.append(obs)
+
+    def close(self):
+        self.logger.log_obs(self.observations, self.index)
+        return len(self.observations)
@@ -0,0 +1,58 @@
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+# A reading together with the time.monotonic() at which the sensor captured it,
+# for sensors sampled in the background (camera frames, streamed telemetry, ...)
+Timestamped = namedtuple('Timestamped', ['value', 'timestamp'])
+
+
+class ObservationAssembler:
+    """
+    Reads a set of sensors concurrently on a small thread pool, so that an
+    observation takes about as long as the slowest sensor instead of the sum of
+    all of them. Readers of sensors sampled in the background return a
+    Timestamped reading, which is stamped with its own capture time; any other
+    reading is taken synchronously and stamped with the time.monotonic() at
+    which its read returned.
+    """
+
+    def __init__(self, readers):
+        """
+        :param readers: dict mapping observation key to a zero-argument callable returning that reading,
+            or a Timestamped reading
+        """
+        self.readers = readers
+        self.executor = ThreadPoolExecutor(max_workers=max(1, len(readers)), thread_name_prefix='obs')
+
+    @staticmethod
+    def _timed_read(reader):
+        value = reader()
+        if isinstance(value, Timestamped):
+            if value.timestamp is not None:
+                return value
+            value = value.value
+        return value, time.monotonic()
+
+    def read(self):
+        """
+        :return: (observation dict, timing dict). The timing dict contains the
+            per-sensor 'capture_time', each sensor's 'offset' from the earliest
+            capture, the overall 'skew' and the total 'duration' of the read.
+        """
+        start = time.monotonic()
+        futures = {key: self.executor.submit(self._timed_read, reader) for key, reader in self.readers.items()}
+        obs, capture_times = {}, {}
+        for key, future in futures.items():
+            obs[key], capture_times[key] = future.result()
+        earliest = min(capture_times.values(), default=start)
+        timing = {
+            'capture_time': capture_times,
+            'offset': {key: t - earliest for key, t in capture_times.items()},
+            'skew': max(capture_times.values(), default=start) - earliest,
+            'duration': time.monotonic() - start,
+        }
+        return obs, timing
+
+    def shutdown(self):
+        self.executor.shutdown()
@@ -63,6 +63,15 @@ def obs_to_action(obs_1, obs_2, norm_conf):
     return normalize(unnormalized_action, norm_conf['mean'], norm_conf['std'])
 
 
+def states_to_actions(state_1, state_2):
+    """
+    Vectorized obs_to_action on (N, 4) arrays of unnormalized states
+    """
+    actions = state_2 - state_1
+    actions[:, 3] = state_2[:, 3]
+    return actions
+
+
 def denormalize_action(action, norm_conf):
     """
     :param action: batch of actions with shape (B, a_dim)
@@ -1,46 +1,88 @@
 import threading
 import time
 
+import numpy as np
+from bench_press.utils.rate_scheduler import RateScheduler
+from bench_press.utils.ring_buffer import RingBuffer
 from src.optoforce.optoforce import *
 
+OPTO_DTYPE = np.dtype([
+    ('timestamp', 'f8'),  # time.monotonic() of the reading
+    ('force', 'f8', (3,)),  # fx, fy, fz
+])
+
 
 class OptoforceThread(threading.Thread):
 
-    def __init__(self, optoforce, thread_rate=5000):
+    def __init__(self, optoforce, thread_rate=None, history_len=10000):
         super(OptoforceThread, self).__init__()
         assert isinstance(optoforce, OptoforceDriver), 'Must be using optoforcedriver'
         self.opto = optoforce
-        self.thread_rate = thread_rate  # (polling rate in Hz)
-        self.current_reading = None
-        self.running_lock = threading.Lock()
-        self.running = None
+        self.thread_rate = thread_rate  # (polling rate in Hz), None to read as fast as the sensor sends
+        # Every reading is kept until overwritten, see window and window_stats
+        self.history = RingBuffer(OPTO_DTYPE, history_len)
+        self.scheduler = RateScheduler(thread_rate)
+
+    def _read(self):
+        force = self.opto.read().force[0]
+        idx = self.history.claim()
+        self.history.data['timestamp'][idx] = time.monotonic()
+        self.history.data['force'][idx] = force
+        self.history.commit()
 
     def run(self):
-        with self.running_lock:
-            self.running = True
-        while True:
-            with self.running_lock:
-                if not self.running:
-                    break
-            start = time.time()
-            self.current_reading = self.opto.read().force[0]
-            end = time.time()
-            time_per_cycle = 1.0 / self.thread_rate  # Number of seconds per cycle
-            remaining = start - end + time_per_cycle
-            if remaining > 0:
-                time.sleep(remaining)
+        self.scheduler.run(self._read)
 
     def get_force(self):
-        return self.current_reading
+        latest = self.history.latest()
+        if latest is None:
+            return None
+        return latest['force']
+
+    def window(self, window_ms, end=None):
+        """
+        :param window_ms: length of the window in milliseconds
+        :param end: time.monotonic() timestamp the window ends at, defaults to now
+        :return: structured array of the (timestamp, force) readings in the window, oldest first
+        """
+        end = time.monotonic() if end is None else end
+        start = self.history.search(end - window_ms / 1000.0, 'timestamp')
+        return self.history.get(start, self.history.search(end, 'timestamp', side='right'))
+
+    def window_stats(self, window_ms, end=None):
+        """
+        :return: dict with the per-axis mean, max, RMS and least squares slope
+            (force units per second) of the readings in the window, and the
+            number of readings 'n'. Statistics are NaN for an empty window.
+        """
+        readings = self.window(window_ms, end)
+        forces, t = readings['force'], readings['timestamp']
+        stats = {'n': len(readings)}
+        if len(readings) == 0:
+            nan = np.full(3, np.nan)
+            stats.update(mean=nan, max=nan, rms=nan, slope=nan)
+            return stats
+        stats['mean'] = forces.mean(axis=0)
+        stats['max'] = forces.max(axis=0)
+        stats['rms'] = np.sqrt(np.mean(forces ** 2, axis=0))
+        dt = t - t.mean()
+        var = np.dot(dt, dt)
+        stats['slope'] = dt @ (forces - stats['mean']) / var if var > 0 else np.zeros(3)
+        return stats
+
+    def get_rate_stats(self):
+        return self.scheduler.stats()
+
+    def rate_summary(self):
+        return self.scheduler.summary()
 
     def stop(self):
-        with self.running_lock:
-            self.running = False
+        self.scheduler.stop()
 
 
 if __name__ == "__main__":
     test_opto = OptoforceDriver("/dev/ttyACM1", 's-ch/3-axis', [[1] * 3])
-    opto_thread = OptoforceThread(test_opto, 5000)
+    opto_thread = OptoforceThread(test_opto)
     opto_thread.start()
     while True:
         print(opto_thread.get_force())
@@ -0,0 +1,82 @@
+import bisect
+import threading
+import time
+
+
+class RateScheduler:
+    """
+    Calls a function periodically against absolute deadlines (start + k / rate),
+    so that timing errors do not accumulate into drift.
+
+    If a call overruns its slot the next one starts right away; if whole slots
+    were missed they are skipped rather than run in a burst, and counted as
+    overruns. The lateness of every call relative to its deadline is kept in a
+    histogram. Sleeping is done on `stop_event`, so `stop` takes effect
+    immediately. A rate of None or 0 runs the function back to back, for
+    sources that block on their own device clock.
+    """
+
+    # Upper edges (in seconds) of the lateness histogram bins, the last bin is open ended
+    JITTER_BINS = [1e-5, 1e-4, 5e-4, 1e-3, 5e-3, 1e-2]
+
+    def __init__(self, rate, stop_event=None):
+        self.rate = rate
+        self.period = 1.0 / rate if rate else 0.0
+        self.stop_event = threading.Event() if stop_event is None else stop_event
+        self.iterations = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.jitter_hist = [0] * (len(self.JITTER_BINS) + 1)
+        self.start_time, self.last_start = None, None
+
+    def run(self, fn):
+        """
+        Call fn() every period until stop() is called.
+        """
+        self.start_time = time.monotonic()
+        deadline = self.start_time
+        while not self.stop_event.is_set():
+            self.last_start = time.monotonic()
+            if self.period:
+                self.jitter_hist[bisect.bisect_left(self.JITTER_BINS, self.last_start - deadline)] += 1
+            fn()
+            self.iterations += 1
+            if not self.period:
+                continue
+            deadline += self.period
+            behind = time.monotonic() - deadline
+            if behind < 0:
+                self.stop_event.wait(-behind)
+                continue
+            self.overruns += 1
+            if behind >= self.period:
+                missed = int(behind / self.period)
+                self.skipped += missed
+                deadline += missed * self.period
+
+    def stop(self):
+        self.stop_event.set()
+
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def achieved_rate(self):
+        # Measured over the intervals between the first and the last call
+        if self.iterations < 2 or self.last_start <= self.start_time:
+            return 0.0
+        return (self.iterations - 1) / (self.last_start - self.start_time)
+
+    def stats(self):
+        labels = [f'<{edge * 1e6:g}us' for edge in self.JITTER_BINS] + [f'>={self.JITTER_BINS[-1] * 1e6:g}us']
+        return {
+            'configured_rate': self.rate,
+            'achieved_rate': self.achieved_rate(),
+            'iterations': self.iterations,
+            'overruns': self.overruns,
+            'skipped': self.skipped,
+            'lateness_hist': dict(zip(labels, self.jitter_hist)),
+        }
+
+    def summary(self):
+        return (f'{self.achieved_rate():.1f} Hz achieved of {self.rate} Hz configured, '
+                f'{self.overruns} overruns ({self.skipped} slots skipped) in {self.iterations} iterations')
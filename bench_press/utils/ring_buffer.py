@@ -0,0 +1,124 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Fixed-capacity circular buffer backed by one preallocated NumPy structured
+    array, so appending never allocates.
+
+    Meant for a single writer thread and any number of reader threads. The
+    writer never takes a lock: it advances `write_head` before touching a slot
+    and `count` once the slot is complete. Readers copy what they need and then
+    check that the writer has not lapped them in the meantime, retrying if so.
+    """
+
+    def __init__(self, dtype, capacity):
+        assert capacity > 0, 'Ring buffer capacity must be positive'
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.count = 0  # Number of records committed so far
+        self.write_head = 0  # Number of records committed or being written
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def nbytes(self):
+        return self.data.nbytes
+
+    def claim(self):
+        """
+        Reserve the next slot for in-place writing, e.g.
+        `ring.data['frame'][ring.claim()] = image`, then call `commit`.
+        :return: index of the slot in `data`
+        """
+        self.write_head = self.count + 1
+        return self.count % self.capacity
+
+    def commit(self):
+        self.count = self.write_head
+
+    def append(self, record):
+        self.data[self.claim()] = record
+        self.commit()
+
+    def extend(self, records):
+        """
+        Append a structured array of records with one vectorized copy (two
+        when wrapping around). Only the newest `capacity` records are kept.
+        """
+        total = len(records)
+        records = records[-self.capacity:]
+        n = len(records)
+        # Dropped records still count, so absolute indices stay those of append
+        start = (self.count + total - n) % self.capacity
+        first = min(n, self.capacity - start)
+        self.write_head = self.count + total
+        self.data[start:start + first] = records[:first]
+        self.data[:n - first] = records[first:]
+        self.commit()
+
+    def _valid(self, oldest):
+        # The slot for record index i is overwritten once the writer reaches i + capacity
+        return self.write_head <= oldest + self.capacity
+
+    def _read(self, start, stop, field=None):
+        """
+        Copy the records (or one of their fields) with absolute indices
+        [start, stop) in chronological order.
+        """
+        data = self.data if field is None else self.data[field]
+        i, j = start % self.capacity, stop % self.capacity
+        if stop - start == 0:
+            return data[:0].copy()
+        if i < j:
+            return data[i:j].copy()
+        return np.concatenate((data[i:], data[:j]))
+
+    def search(self, value, field, side='left'):
+        """
+        Binary search over a non-decreasing field (e.g. a timestamp).
+        :return: absolute index of the first stored record whose `field` is
+            >= value (> value for side='right'); `count` if there is none
+        """
+        while True:
+            end = self.count
+            start = end - len(self)
+            values = self._read(start, end, field)
+            if self._valid(start):
+                return start + int(np.searchsorted(values, value, side=side))
+
+    def get(self, start, stop):
+        """
+        :return: copy of the records with absolute indices [start, stop), as
+            returned by `search`. Records overwritten in the meantime are skipped.
+        """
+        while True:
+            end = self.count
+            lo, hi = max(start, end - len(self)), min(stop, end)
+            out = self._read(lo, max(lo, hi))
+            if self._valid(lo):
+                return out
+
+    def last(self, n=None):
+        """
+        :param n: number of most recent records to return, None for all stored
+        :return: copy of the records, oldest first
+        """
+        while True:
+            end = self.count
+            num = len(self) if n is None else min(n, len(self))
+            out = self._read(end - num, end)
+            if self._valid(end - num):
+                return out
+
+    def latest(self):
+        """
+        :return: copy of the most recent record, or None if nothing was written yet
+        """
+        while True:
+            end = self.count
+            if end == 0:
+                return None
+            out = self.data[(end - 1) % self.capacity].copy()
+            if self._valid(end - 1):
+                return out
@@ -0,0 +1,120 @@
+import queue
+import threading
+
+import numpy as np
+import tables
+
+# Markers deepdish puts on the root group of a file saved with dd.io.save(path, list)
+DEEPDISH_IO_VERSION = ('DEEPDISH_IO_VERSION', 12)
+DEEPDISH_IO_UNPACK = 'DEEPDISH_IO_DEEPDISH_IO_UNPACK'
+
+
+class RolloutWriter:
+    """
+    Writes the observations of a rollout to HDF5 one at a time, as they
+    arrive, instead of saving the whole list at the end.
+
+    The layout is the one `dd.io.save(path, observations)` produces: step n
+    is the group `/data/i{n}`, so the files load with `dd.io.load` and the
+    `/data/i{n}` group access of the datasets. Arrays are stored as chunked
+    carrays, compressed with `compression` (a PyTables complib, or None).
+
+    Writing happens on a background thread. `append` blocks while `queue_size`
+    observations are waiting, so a slow disk slows the rollout down instead of
+    piling up frames in memory. The step count of `/data` is only advanced,
+    and the file flushed, every `flush_every` steps and on `close`, so a
+    crashed rollout stays loadable up to its last flush.
+    """
+
+    def __init__(self, path, queue_size=8, flush_every=10, compression='blosc', compression_level=5):
+        self.path = path
+        self.flush_every = flush_every
+        self.filters = None
+        if compression:
+            self.filters = tables.Filters(complevel=compression_level, complib=compression, shuffle=True)
+        self.h5file = tables.open_file(path, mode='w')
+        self.h5file.root._v_attrs[DEEPDISH_IO_VERSION[0]] = DEEPDISH_IO_VERSION[1]
+        self.h5file.root._v_attrs[DEEPDISH_IO_UNPACK] = True
+        self.data = self.h5file.create_group('/', 'data', 'list:0')
+        self.num_written = 0
+        self.num_committed = 0
+        self.error = None
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def append(self, obs):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(obs)
+
+    def _run(self):
+        while True:
+            obs = self.queue.get()
+            if obs is None:
+                break
+            if self.error is not None:
+                continue  # Keep draining so that append never blocks forever
+            try:
+                self._write_level(self.data, f'i{self.num_written}', obs)
+                self.num_written += 1
+                if self.num_written % self.flush_every == 0:
+                    self._commit()
+            except Exception as e:
+                self.error = e
+
+    def _commit(self):
+        self.data._v_title = f'list:{self.num_written}'
+        self.h5file.flush()
+        self.num_committed = self.num_written
+
+    def _write_level(self, group, name, value):
+        # Mirrors deepdish.io.hdf5io._save_level for the types observations contain
+        if isinstance(value, dict):
+            new_group = self.h5file.create_group(group, name, f'dict:{len(value)}')
+            for k, v in value.items():
+                self._write_level(new_group, str(k), v)
+        elif isinstance(value, (list, tuple)):
+            kind = 'list' if isinstance(value, list) else 'tuple'
+            new_group = self.h5file.create_group(group, name, f'{kind}:{len(value)}')
+            for i, v in enumerate(value):
+                self._write_level(new_group, f'i{i}', v)
+        elif isinstance(value, np.ndarray) and value.dtype.kind in 'biufc':
+            self._write_array(group, name, value)
+        elif value is None:
+            self.h5file.create_group(group, name, 'nonetype:')
+        elif isinstance(value, (int, float, complex, bool, str, bytes, np.generic)):
+            setattr(group._v_attrs, name, value)
+        else:
+            # Pickled, like deepdish does for anything it has no native type for
+            self.h5file.create_vlarray(group, name, tables.ObjectAtom()).append(value)
+
+    def _write_array(self, group, name, x):
+        if x.ndim == 0:
+            setattr(group._v_attrs, name, x[()])
+            return
+        atom = tables.Atom.from_dtype(x.dtype)
+        if np.min(x.shape) == 0:
+            node = self.h5file.create_array(group, name, atom=tables.Int64Atom(), shape=(x.ndim,))
+            node._v_attrs.zeroarray_dtype = x.dtype.str.encode('ascii')
+            node[:] = x.shape
+        elif x.size > 300:  # Small arrays are not worth chunking and compressing
+            node = self.h5file.create_carray(group, name, atom=atom, shape=x.shape, filters=self.filters)
+            node[:] = x
+        else:
+            node = self.h5file.create_array(group, name, atom=atom, shape=x.shape)
+            node[:] = x
+
+    def close(self):
+        """
+        Write out the remaining observations and close the file.
+        :return: number of observations written
+        """
+        self.queue.put(None)
+        self.thread.join()
+        if self.h5file.isopen:
+            self._commit()
+            self.h5file.close()
+        if self.error is not None:
+            raise self.error
+        return self.num_committed
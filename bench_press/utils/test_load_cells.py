@@ -7,14 +7,11 @@ def main():
     tb = TestBench('/dev/ttyACM0')
     tb.flip_x_reset()
 
-    while not tb.ready():
-        time.sleep(0.1)
-        tb.update()
+    tb.wait_ready()
 
     tb.start()
 
-    while tb.busy():
-        tb.update()
+    tb.wait_idle()
 
     while True:
         data = tb.req_data()
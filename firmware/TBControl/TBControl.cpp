@@ -2,6 +2,7 @@
 #include "TBControl.h"
 #include "Axis.h"
 #include "HX711.h"
+#include "Telemetry.h"
 
 double TBControl::scaleCalibFactors[] = {-7050.0, -7050.0, -7050.0, -7050.0 };
 const int TBControl::FEEDBACK_LIM = 15;
@@ -15,6 +16,9 @@ TBControl::TBControl(Axis *x, Axis *y, Axis *z, HX711 *s) {
     pxtime = 0;
     ytime = 0;
     pytime = 0;
+    for (int i = 0; i < 4; i++) {
+        lastForces[i] = 0;
+    }
 }
 
 void TBControl::initialize(int zInit, int yInit, int xInit) {
@@ -190,3 +194,25 @@ void TBControl::log() {
     Serial.println();
 }
 
+
+/**
+ * Write one binary telemetry frame (see Telemetry.h). Only load cells with
+ * a conversion ready are read, the others keep their last value, so this
+ * never waits on the HX711s. The frame is dropped rather than blocking when
+ * the serial transmit buffer is full.
+ */
+
+void TBControl::sendTelemetry() {
+    unsigned long time = micros();
+    for (int i = 0; i < 4; i++) {
+        if ((*(scales + i)).is_ready()) {
+            lastForces[i] = abs((*(scales + i)).get_units(1));
+        }
+    }
+    if (Serial.availableForWrite() < TELEMETRY_FRAME_SIZE) {
+        return;
+    }
+    uint8_t frame[TELEMETRY_FRAME_SIZE];
+    encodeTelemetryFrame(frame, time, xPos(), yPos(), zPos(), lastForces);
+    Serial.write(frame, TELEMETRY_FRAME_SIZE);
+}
@@ -23,6 +23,7 @@ class TBControl {
         int zPos();
         double avgWeight();
         void log();
+        void sendTelemetry();
         static double scaleCalibFactors[];
         static const int FEEDBACK_LIM;
 
@@ -37,6 +38,7 @@ class TBControl {
         unsigned long ytime;
         unsigned long pytime;
         unsigned long pxtime;
+        float lastForces[4];
         
 };
 
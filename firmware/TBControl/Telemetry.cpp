@@ -0,0 +1,38 @@
+#include <string.h>
+#include "Telemetry.h"
+
+uint16_t telemetryCrc16(const uint8_t *data, int len) {
+    uint16_t crc = 0xFFFF;
+    for (int i = 0; i < len; i++) {
+        crc ^= (uint16_t) data[i] << 8;
+        for (int b = 0; b < 8; b++) {
+            crc = (crc & 0x8000) ? (crc << 1) ^ 0x1021 : crc << 1;
+        }
+    }
+    return crc;
+}
+
+static uint8_t *putU32(uint8_t *p, uint32_t v) {
+    for (int i = 0; i < 4; i++) {
+        *p++ = (v >> (8 * i)) & 0xFF;
+    }
+    return p;
+}
+
+void encodeTelemetryFrame(uint8_t *frame, uint32_t fwTime, int32_t x, int32_t y, int32_t z, const float *forces) {
+    uint8_t *p = frame;
+    *p++ = 0xA5;
+    *p++ = 0x5A;
+    p = putU32(p, fwTime);
+    p = putU32(p, (uint32_t) x);
+    p = putU32(p, (uint32_t) y);
+    p = putU32(p, (uint32_t) z);
+    for (int i = 0; i < 4; i++) {
+        uint32_t bits;
+        memcpy(&bits, forces + i, sizeof(bits));
+        p = putU32(p, bits);
+    }
+    uint16_t crc = telemetryCrc16(frame + 2, TELEMETRY_FRAME_SIZE - 4);
+    *p++ = crc & 0xFF;
+    *p++ = crc >> 8;
+}
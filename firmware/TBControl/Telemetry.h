@@ -0,0 +1,26 @@
+#ifndef Telemetry_h
+#define Telemetry_h
+
+#include <stdint.h>
+
+/*
+ * Binary telemetry frames streamed after an "s<rate>" command, see
+ * bench_press/tb_control/telemetry.py for the host side. Every frame is
+ * 36 bytes, little endian:
+ *
+ *     magic     2 bytes   0xA5 0x5A
+ *     fw_time   uint32    micros() at sampling time
+ *     x, y, z   int32     axis positions in steps
+ *     force     4x float  load cell readings
+ *     crc       uint16    CRC-16/CCITT-FALSE over fw_time..force
+ *
+ * Kept free of Arduino dependencies so it can be compiled and checked
+ * against the host decoder on a PC.
+ */
+
+const int TELEMETRY_FRAME_SIZE = 36;
+
+uint16_t telemetryCrc16(const uint8_t *data, int len);
+void encodeTelemetryFrame(uint8_t *frame, uint32_t fwTime, int32_t x, int32_t y, int32_t z, const float *forces);
+
+#endif
@@ -63,6 +63,9 @@ TBControl tb(&xAxis, &yAxis, &zAxis, scales);
 
 void setup() {
     Serial.begin(250000);
+    // Optional protocol features, announced before the ready message so
+    // that the host knows them by the time it starts sending commands
+    Serial.println("Capabilities: stream");
     Serial.println("Starting testbench...");
 }
 
@@ -72,6 +75,25 @@ bool idle = true;
 double z_force_thresh = 10;
 int xInitPos = 0;
 int i = 0;
+unsigned long streamPeriod = 0;  // Microseconds between telemetry frames, 0 when not streaming
+unsigned long lastFrameTime = 0;
+
+/**
+ * Send a telemetry frame if streaming and one is due. Called from the main
+ * loop and between XY steps; blocking routines (start, r, rz, pz) send no
+ * frames until they return.
+ */
+
+void streamTelemetry() {
+    if (streamPeriod && micros() - lastFrameTime >= streamPeriod) {
+        lastFrameTime += streamPeriod;
+        if (micros() - lastFrameTime >= streamPeriod) {
+            // Fell behind, e.g. after a blocking routine: don't send a burst
+            lastFrameTime = micros();
+        }
+        tb.sendTelemetry();
+    }
+}
 
 void loop() {
     if (Serial.available()) {
@@ -83,9 +105,11 @@ void loop() {
             input = "";
         }
     }
+    streamTelemetry();
     if (!idle) {
         while (tb.xyMoving()) {
             tb.stepXY();
+            streamTelemetry();
         }
        
         //if (tb.zMoving() && (i % 10 != 0 || tb.avgWeight() < z_force_thresh)) {
@@ -124,6 +148,11 @@ void handleInput(String s) {
         tb.feedbackMoveZ(s.substring(s.indexOf('z') + 1, s.indexOf('w')).toInt(), s.substring(s.indexOf('w')+1).toInt());
     } else if (s == "l") {
         tb.log();
+    } else if (s.startsWith("s")) {
+        // s<rate>: stream telemetry frames at rate Hz, s0 stops
+        long rate = s.substring(1).toInt();
+        streamPeriod = rate > 0 ? 1000000UL / rate : 0;
+        lastFrameTime = micros();
     } else {
         // By default, a position command
         int xTarget = s.substring(s.indexOf('x') + 1, s.indexOf('y')).toInt();    
@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+from bench_press.run.actions.action import AbsoluteAction, DeltaAction, DynamixelAngleAction, SequentialAction, \
+    SleepAction
+from bench_press.run.actions.compiler import ActionCompiler
+
+MIN_BOUNDS = np.array([0, 0, 0])
+MAX_BOUNDS = np.array([1000, 1000, 500])
+
+
+class RecordingEnv:
+    # Clips move targets to the bounds like TBEnv and records every position it moves to
+
+    def __init__(self, start_pos):
+        self.pos = np.array(start_pos)
+        self.positions = []
+        self.angles = []
+
+    def move_to(self, position):
+        self.pos = np.clip(np.array(position), MIN_BOUNDS, MAX_BOUNDS)
+        self.positions.append(tuple(self.pos))
+
+    def move_delta(self, delta):
+        self.move_to(self.pos + delta)
+
+    def move_dyna_to_angle(self, angle):
+        self.angles.append(angle)
+
+
+def run(action, start_pos):
+    env = RecordingEnv(start_pos)
+    action.apply(env)
+    return env
+
+
+def is_subsequence(short, long):
+    it = iter(long)
+    return all(any(x == y for y in it) for x in short)
+
+
+def compiler(**kwargs):
+    return ActionCompiler(min_bounds=MIN_BOUNDS, max_bounds=MAX_BOUNDS, **kwargs)
+
+
+def random_moves(rng, n):
+    actions = []
+    for _ in range(n):
+        if actions and rng.rand() < 0.2:
+            actions.append(actions[-1].inverse())
+            continue
+        delta = np.zeros(3, dtype=np.int64)
+        delta[rng.randint(3)] = rng.choice([-1, 1]) * rng.randint(0, 400)
+        actions.append(DeltaAction(delta))
+    return actions
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_compiled_moves_follow_the_clipped_path(seed):
+    rng = np.random.RandomState(seed)
+    start = (rng.randint(0, 1001), rng.randint(0, 1001), rng.choice([0, 250, 500]))
+    action = SequentialAction(random_moves(rng, 12))
+    plan = compiler().compile(action, start)
+    original, compiled = run(action, start), run(plan.action, start)
+    assert tuple(compiled.pos) == tuple(original.pos)
+    # Merging and folding only ever skip positions of the original path
+    assert is_subsequence(compiled.positions, original.positions)
+    assert len(plan) <= plan.num_original
+
+
+def test_fold_at_a_bound():
+    # +300 is clipped to +100, so the following -300 does not undo it
+    start = (900, 0, 0)
+    action = SequentialAction([DeltaAction((300, 0, 0)), DeltaAction((-300, 0, 0))])
+    plan = compiler().compile(action, start)
+    assert tuple(run(plan.action, start).pos) == tuple(run(action, start).pos) == (700, 0, 0)
+    # Without knowing the bounds, the moves fold away
+    assert len(ActionCompiler().compile(action, start)) == 0
+
+
+def test_unknown_position_blocks_merging_with_bounds():
+    action = SequentialAction([DeltaAction((100, 0, 0)), DeltaAction((100, 0, 0))])
+    assert len(compiler().compile(action)) == 2
+    assert len(compiler().compile(action, (0, 0, 0))) == 1
+    # An absolute move makes the position known again
+    action = SequentialAction([AbsoluteAction((0, 0, 0))] + action.action_list)
+    assert len(compiler().compile(action)) == 2
+
+
+def test_planar_merge_is_opt_in():
+    action = SequentialAction([DeltaAction((100, 0, 0)), DeltaAction((0, 100, 0))])
+    assert len(compiler().compile(action, (0, 0, 0))) == 2
+    plan = compiler(merge_planar=True).compile(action, (0, 0, 0))
+    assert len(plan) == 1 and plan.action.action_list[0].delta.tolist() == [100, 100, 0]
+
+
+def test_same_axis_merges_but_not_across_z_or_barriers():
+    action = SequentialAction([
+        SequentialAction([DeltaAction((10, 0, 0)), DeltaAction((20, 0, 0))]),
+        DeltaAction((0, 0, 5)),
+        DeltaAction((-5, 0, 0)),
+        SleepAction(0),
+        DeltaAction((-5, 0, 0)),
+    ])
+    plan = compiler().compile(action, (100, 100, 100))
+    assert [type(a).__name__ for a in plan.action.action_list] == ['DeltaAction', 'DeltaAction', 'DeltaAction',
+                                                                  'SleepAction', 'DeltaAction']
+    assert plan.action.action_list[0].delta.tolist() == [30, 0, 0]
+
+
+def test_absolute_moves_to_current_position_are_dropped():
+    action = SequentialAction([AbsoluteAction((10, 20, 30)), AbsoluteAction((10, 20, 30)), DeltaAction((0, 0, 0))])
+    assert len(compiler().compile(action)) == 1
+    assert len(compiler().compile(action, (10, 20, 30))) == 0
+    # Clipped to the position the testbench is already at
+    assert len(compiler().compile(SequentialAction([AbsoluteAction((2000, 0, 0))]), (1000, 0, 0))) == 0
+
+
+def test_gripper_commands():
+    action = SequentialAction([DynamixelAngleAction(-10), DynamixelAngleAction(0.2), DeltaAction((1, 0, 0)),
+                               DynamixelAngleAction(-20)])
+    plan = compiler().compile(action, (0, 0, 0), start_angle=0)
+    # The first two are overridden by the second, which is within tolerance of the current angle
+    assert [a.angle for a in plan.action.action_list if isinstance(a, DynamixelAngleAction)] == [-20]
+    assert plan.estimated_time < plan.original_time
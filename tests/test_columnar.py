@@ -0,0 +1,67 @@
+import pickle
+
+import deepdish as dd
+import numpy as np
+import pytest
+from bench_press.utils.columnar import ColumnarTrajectory, convert_record, is_columnar
+
+
+@pytest.fixture
+def record(tmpdir):
+    rng = np.random.RandomState(0)
+    observations = [{
+        'tb_state': {'x': i, 'y': 2 * i, 'z': 3, 'force_1': 0.25 * i, 'force_2': 1.0},
+        'images': {cam: rng.randint(0, 256, (6, 8, 3), dtype=np.uint8) for cam in ('external', 'gelsight_top')},
+        'raw_images': {'external': rng.randint(0, 256, (12, 16, 3), dtype=np.uint8)},
+        'dynamixel_state': -0.5 * i,
+        'optoforce': rng.rand(3),
+    } for i in range(11)]
+    src, dst = str(tmpdir.join('record_0.h5')), str(tmpdir.join('record_0.col.h5'))
+    dd.io.save(src, observations)
+    convert_record(src, dst, chunk_steps=4)
+    return observations, src, dst
+
+
+def assert_obs_equal(obs, expected, keys):
+    for key in keys:
+        if isinstance(expected[key], dict):
+            assert obs[key].keys() == expected[key].keys()
+            for k in expected[key]:
+                np.testing.assert_array_equal(obs[key][k], expected[key][k])
+        else:
+            np.testing.assert_array_equal(obs[key], expected[key])
+
+
+def test_conversion_preserves_observations(record):
+    observations, src, dst = record
+    assert is_columnar(dst) and not is_columnar(src)
+    traj = ColumnarTrajectory(dst)
+    assert len(traj) == len(observations)
+    steps = [10, 0, 3, 3, 7]  # Any order, repeats, not contiguous
+    keys = ('images', 'raw_images', 'tb_state', 'dynamixel_state', 'optoforce')
+    for obs, step in zip(traj.observations(steps, keys), steps):
+        assert_obs_equal(obs, observations[step], keys)
+    assert type(traj.observations([1])[0]['tb_state']['x']) is int
+    traj.close()
+
+
+def test_slices_and_default_keys(record):
+    observations, _, dst = record
+    traj = ColumnarTrajectory(dst)
+    chunk = traj[2:6]
+    np.testing.assert_array_equal(chunk['images']['external'],
+                                  np.stack([obs['images']['external'] for obs in observations[2:6]]))
+    np.testing.assert_array_equal(chunk['tb_state']['x'], [2, 3, 4, 5])
+    # Raw images are only read when asked for
+    assert 'raw_images' not in traj.observations([4, 5])[0]
+    with pytest.raises(AssertionError):
+        traj[3]
+
+
+def test_pickled_reader_reopens(record):
+    observations, _, dst = record
+    traj = ColumnarTrajectory(dst)
+    traj.observations([0])
+    copy = pickle.loads(pickle.dumps(traj))
+    assert copy.file is None
+    np.testing.assert_array_equal(copy.observations([5])[0]['optoforce'], observations[5]['optoforce'])
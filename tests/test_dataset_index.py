@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+from bench_press.models.datasets.dataset_index import INDEX_NAME, STEP_COLUMNS, DatasetIndex
+from bench_press.models.datasets.moments import Moments
+from bench_press.utils.columnar import write_columnar
+
+
+def write_rollout(path, num_steps, offset=0):
+    write_columnar(path, [{'tb_state': {'x': i + offset, 'y': 2 * i, 'z': 3, 'force_1': 0.5, 'force_2': 0.0,
+                                        'force_3': 0.0, 'force_4': 0.0},
+                           'dynamixel_state': -1.0 * i} for i in range(num_steps)])
+
+
+def moments(value):
+    return {'state': Moments.of([[value]])}
+
+
+@pytest.fixture
+def folder(tmpdir):
+    data = tmpdir.mkdir('data')
+    for i, num_steps in enumerate((5, 7)):
+        write_rollout(str(data.join(f'record_{i}.h5')), num_steps)
+    return str(data) + os.sep
+
+
+def rollouts(folder):
+    return [os.path.join(folder, f'record_{i}.h5') for i in range(2)]
+
+
+def test_index_is_kept_outside_the_data_folder(folder, tmpdir, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+    index = DatasetIndex(folder)
+    assert index.update(rollouts(folder)) == [5, 7]
+    index.close()
+    assert not os.path.exists(os.path.join(folder, INDEX_NAME))
+    assert index.path.startswith(str(tmpdir.join('cache')))
+
+    index = DatasetIndex(folder, in_folder=True)
+    index.update(rollouts(folder))
+    index.close()
+    assert os.path.isfile(os.path.join(folder, INDEX_NAME))
+
+
+def test_update_rescans_modified_and_drops_removed_files(folder, tmpdir):
+    index_dir = str(tmpdir.join('index'))
+    files = rollouts(folder)
+    index = DatasetIndex(folder, index_dir)
+    index.update(files)
+    index.put_moments({f: moments(float(i)) for i, f in enumerate(files)}, 'kind')
+    index.close()
+
+    # Rewritten with other values and more steps
+    write_rollout(files[0], 9, offset=100)
+    index = DatasetIndex(folder, index_dir)
+    assert index.update(files) == [9, 7]
+    steps = index.steps(files[0])
+    assert steps.shape == (9, len(STEP_COLUMNS))
+    np.testing.assert_array_equal(steps[:, STEP_COLUMNS.index('x')], np.arange(9) + 100)
+    assert index.get_moments(files[0], 'kind') is None
+    assert index.get_moments(files[1], 'kind') is not None
+
+    os.remove(files[1])
+    assert index.update(files[:1]) == [9]
+    assert index.db.execute('SELECT COUNT(*) FROM files').fetchone()[0] == 1
+    assert index.get_moments(files[1], 'kind') is None
+    index.close()
+
+
+def test_unchanged_files_are_not_rescanned(folder, tmpdir, monkeypatch):
+    index_dir = str(tmpdir.join('index'))
+    files = rollouts(folder)
+    DatasetIndex(folder, index_dir).update(files)
+
+    def fail(*args, **kwargs):
+        raise AssertionError('unchanged files must not be scanned')
+
+    monkeypatch.setattr('bench_press.models.datasets.dataset_index.Pool', fail)
+    assert DatasetIndex(folder, index_dir).update(files) == [5, 7]
+
+
+def test_unwritable_index_falls_back_to_memory(folder, tmpdir):
+    blocker = tmpdir.join('not_a_dir')
+    blocker.write('')
+    index = DatasetIndex(folder, str(blocker.join('index')))
+    assert index.path == ':memory:'
+    assert index.update(rollouts(folder)) == [5, 7]
+    index.close()
@@ -0,0 +1,100 @@
+import struct
+import threading
+
+import pytest
+
+dynamixel_sdk = pytest.importorskip('dynamixel_sdk')
+from bench_press.tb_control.dynamixel_interface import Dynamixel, DynamixelPoller
+
+
+class FakePacketHandler:
+    """
+    Protocol 2.0 packet handler answering sync reads from a dict of servo
+    replies instead of the bus; a missing id times out
+    """
+
+    def __init__(self, replies, tx_result=dynamixel_sdk.COMM_SUCCESS):
+        self.replies = replies
+        self.tx_result = tx_result
+
+    def getProtocolVersion(self):
+        return 2.0
+
+    def syncReadTx(self, port, start_address, data_length, param, param_length, *args):
+        return self.tx_result
+
+    def readRx(self, port, dxl_id, length):
+        if dxl_id not in self.replies:
+            return [], dynamixel_sdk.COMM_RX_TIMEOUT, 0
+        return self.replies[dxl_id], dynamixel_sdk.COMM_SUCCESS, 0
+
+    def getTxRxResult(self, result):
+        return f'result {result}'
+
+
+def state_bytes(load, velocity, position):
+    # Present load, velocity and position are contiguous in the control table
+    return list(struct.pack('<hii', load, velocity, position))
+
+
+def make_dynamixel(packet_handler, ids=(1, 2), home_pos=1000):
+    # Skips __init__, which opens the serial port
+    dxl = Dynamixel.__new__(Dynamixel)
+    dxl.ids = list(ids)
+    dxl.home_positions = {dxl_id: home_pos for dxl_id in ids}
+    dxl.bus_lock = threading.Lock()
+    dxl.poller = None
+    dxl.portHandler = None
+    dxl.packetHandler = packet_handler
+    dxl.groupSyncRead = dynamixel_sdk.GroupSyncRead(None, packet_handler, Dynamixel.ADDR_PRO_PRESENT_LOAD,
+                                                    Dynamixel.LEN_PRO_PRESENT_STATE)
+    for dxl_id in ids:
+        dxl.groupSyncRead.addParam(dxl_id)
+    return dxl
+
+
+def test_sync_read_state_decodes_every_servo():
+    dxl = make_dynamixel(FakePacketHandler({1: state_bytes(-5, 12, 1000 + 1024), 2: state_bytes(7, -3, 500)}))
+    state = dxl.sync_read_state()
+    assert state[1] == {'position': 2024, 'angle': 1024 * 360 / Dynamixel.TICKS_PER_REV, 'velocity': 12, 'load': -5}
+    assert state[2]['position'] == 500 and state[2]['velocity'] == -3 and state[2]['load'] == 7
+
+
+def test_sync_read_state_raises_on_failed_transaction():
+    dxl = make_dynamixel(FakePacketHandler({1: state_bytes(0, 0, 0), 2: state_bytes(0, 0, 0)},
+                                           tx_result=dynamixel_sdk.COMM_TX_FAIL))
+    with pytest.raises(ValueError):
+        dxl.sync_read_state()
+
+
+def test_sync_read_state_raises_on_missing_servo():
+    # Before, the missing servo read back as position 0 instead of an error
+    dxl = make_dynamixel(FakePacketHandler({1: state_bytes(0, 0, 1000)}))
+    with pytest.raises(ValueError):
+        dxl.sync_read_state()
+
+
+def test_poller_keeps_last_good_state():
+    handler = FakePacketHandler({1: state_bytes(0, 0, 1100), 2: state_bytes(0, 0, 900)})
+    poller = DynamixelPoller(make_dynamixel(handler), thread_rate=100)
+    poller._poll()
+    state, timestamp = poller.get_snapshot()
+    handler.tx_result = dynamixel_sdk.COMM_TX_FAIL
+    poller._poll()
+    assert poller.get_snapshot() == (state, timestamp) and poller.get_state() is state
+    assert state[1]['position'] == 1100
+
+
+def test_readings_come_from_the_snapshot_they_are_given():
+    handler = FakePacketHandler({1: state_bytes(0, 0, 1100), 2: state_bytes(0, 0, 900)})
+    dxl = make_dynamixel(handler)
+    dxl.poller = DynamixelPoller(dxl, thread_rate=100)
+    dxl.poller._poll()
+    state, timestamp = dxl.poller.get_snapshot()
+    handler.replies = {1: state_bytes(0, 0, 1200), 2: state_bytes(0, 0, 800)}
+    dxl.poller._poll()
+    assert dxl.poller.get_snapshot()[1] >= timestamp
+    # The angle and servo states of the earlier snapshot, not of the latest poll
+    assert dxl.get_current_angle(state) == 100 * 360 / Dynamixel.TICKS_PER_REV
+    assert dxl.get_servo_states(state)['id2']['position'] == 900
+    assert dxl.get_current_angle() == 200 * 360 / Dynamixel.TICKS_PER_REV
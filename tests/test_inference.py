@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+import torch
+import torch.nn as nn
+from bench_press.models.modules.pretrained_encoder import pretrained_model_normalize
+from bench_press.run.policy.inference import InferenceEngine
+from omegaconf import OmegaConf
+from torchvision import transforms
+
+FINAL_SIZE = (24, 32)
+
+
+class TinyPolicy(nn.Module):
+    # Takes the input dict of PolicyNetwork and uses the images, state and optoforce readings
+
+    def __init__(self, num_cameras):
+        super(TinyPolicy, self).__init__()
+        self.convs = nn.ModuleList([nn.Conv2d(3, 4, 3, stride=2) for _ in range(num_cameras)])
+        self.head = nn.Linear(num_cameras * 4 + 4 + 2, 3)
+
+    def forward(self, inputs):
+        features = [conv(image).mean(dim=(2, 3)) for conv, image in zip(self.convs, inputs['images'])]
+        return self.head(torch.cat(features + [inputs['state'], inputs['opto_1'], inputs['opto_2']], dim=1))
+
+
+def eager_reference(model, images, state, opto_1, opto_2):
+    to_input = transforms.Compose([transforms.ToTensor(), pretrained_model_normalize])
+    inputs = {'images': [to_input(image)[None] for image in images], 'state': torch.from_numpy(state)[None],
+              'opto_1': torch.from_numpy(opto_1)[None], 'opto_2': torch.from_numpy(opto_2)[None]}
+    with torch.no_grad():
+        return model(inputs).numpy()
+
+
+def observations(num_cameras, num_steps, seed=0):
+    rng = np.random.RandomState(seed)
+    for _ in range(num_steps):
+        yield ([rng.randint(0, 256, FINAL_SIZE + (3,), dtype=np.uint8) for _ in range(num_cameras)],
+               rng.randn(4).astype(np.float32), rng.randn(1).astype(np.float32), rng.randn(1).astype(np.float32))
+
+
+def model_conf(**kwargs):
+    return OmegaConf.create(dict(type='bench_press.models.policy_network.PolicyNetwork', final_size=list(FINAL_SIZE),
+                                 state_dim=4, opto_dim=1, **kwargs))
+
+
+@pytest.mark.parametrize('mode', ['eager', 'trace'])
+def test_engine_matches_eager_forward(mode):
+    torch.manual_seed(0)
+    model = TinyPolicy(3).eval()
+    engine = InferenceEngine(model, model_conf(), torch.device('cpu'), mode=mode)
+    engine.warmup(3)
+    if mode == 'trace':
+        assert isinstance(engine.forward, torch.jit.ScriptModule), 'Tracing fell back to eager mode'
+    # Several steps, so that inputs left over from the previous step would show
+    for images, state, opto_1, opto_2 in observations(3, 4):
+        np.testing.assert_allclose(engine(images, state, opto_1, opto_2),
+                                   eager_reference(model, images, state, opto_1, opto_2), rtol=1e-4, atol=1e-5)
+
+
+def test_engine_only_loads_used_cameras():
+    torch.manual_seed(0)
+    model = TinyPolicy(3).eval()
+    # Sorted input sources are external, gelsight_side, gelsight_top
+    engine = InferenceEngine(model, model_conf(image_inputs=['gelsight_top', 'external']), torch.device('cpu'),
+                             mode='eager')
+    images, state, opto_1, opto_2 = next(observations(3, 1))
+    engine(images, state, opto_1, opto_2)
+    assert engine.used_cameras == [2, 0]
+    assert torch.count_nonzero(engine.images[1]) == 0
+
+
+def test_engine_resizes_to_final_size():
+    torch.manual_seed(0)
+    model = TinyPolicy(1).eval()
+    engine = InferenceEngine(model, model_conf(), torch.device('cpu'), mode='eager')
+    _, state, opto_1, opto_2 = next(observations(1, 1))
+    # Any resize of a uniform image is the same uniform image at the final size
+    color = np.array([10, 128, 250], dtype=np.uint8)
+    large = np.broadcast_to(color, (3 * FINAL_SIZE[0], 2 * FINAL_SIZE[1], 3))
+    small = np.broadcast_to(color, FINAL_SIZE + (3,)).copy()
+    np.testing.assert_allclose(engine([large], state, opto_1, opto_2),
+                               eager_reference(model, [small], state, opto_1, opto_2), rtol=1e-4, atol=1e-5)
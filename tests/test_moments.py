@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from bench_press.models.datasets.moments import Moments
+
+
+@pytest.mark.parametrize('splits', [[50], [10, 40], [1, 1, 48], [0, 25, 0, 25], [7, 13, 30]])
+def test_merged_shards_match_numpy(splits):
+    rng = np.random.RandomState(0)
+    x = rng.normal(1000, 3, (sum(splits), 4))  # Large mean, small spread: cancellation prone
+    moments = Moments()
+    start = 0
+    for n in splits:
+        moments.merge(Moments.of(x[start:start + n]))
+        start += n
+    assert moments.count == len(x)
+    np.testing.assert_allclose(moments.mean, x.mean(axis=0), rtol=1e-12)
+    np.testing.assert_allclose(moments.std, x.std(axis=0), rtol=1e-9)
+
+
+def test_update_matches_of():
+    x = np.random.RandomState(1).rand(30, 3)
+    moments = Moments()
+    for row in x:
+        moments.update(row[None])
+    expected = Moments.of(x)
+    np.testing.assert_allclose(moments.mean, expected.mean)
+    np.testing.assert_allclose(moments.m2, expected.m2)
+
+
+def test_merge_into_empty_copies():
+    other = Moments.of(np.ones((3, 2)))
+    merged = Moments().merge(other)
+    merged.update(np.zeros((1, 2)))
+    assert other.count == 3 and other.mean.tolist() == [1.0, 1.0]
+
+
+def test_dict_round_trip():
+    moments = Moments.of(np.arange(12.0).reshape(6, 2))
+    restored = Moments.from_dict(moments.to_dict())
+    assert restored.count == 6
+    np.testing.assert_array_equal(restored.mean, moments.mean)
+    np.testing.assert_array_equal(restored.m2, moments.m2)
+    assert Moments.from_dict(Moments().to_dict()).count == 0
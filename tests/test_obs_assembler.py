@@ -0,0 +1,31 @@
+import time
+
+from bench_press.utils.obs_assembler import ObservationAssembler, Timestamped
+
+
+def test_background_readings_keep_their_capture_time():
+    captured = time.monotonic() - 0.5
+    assembler = ObservationAssembler({'camera': lambda: Timestamped('frame', captured),
+                                      'servo': lambda: 'angle'})
+    try:
+        before = time.monotonic()
+        obs, timing = assembler.read()
+    finally:
+        assembler.shutdown()
+    assert obs == {'camera': 'frame', 'servo': 'angle'}
+    assert timing['capture_time']['camera'] == captured
+    # Synchronous readings are stamped when their read returns
+    assert before <= timing['capture_time']['servo'] <= time.monotonic()
+    assert timing['offset']['camera'] == 0
+    assert timing['skew'] == timing['capture_time']['servo'] - captured
+
+
+def test_unstamped_reading_falls_back_to_return_time():
+    assembler = ObservationAssembler({'tb_state': lambda: Timestamped({'x': 0}, None)})
+    try:
+        before = time.monotonic()
+        obs, timing = assembler.read()
+    finally:
+        assembler.shutdown()
+    assert obs == {'tb_state': {'x': 0}}
+    assert before <= timing['capture_time']['tb_state'] <= time.monotonic()
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from bench_press.utils.ring_buffer import RingBuffer
+
+DTYPE = np.dtype([('timestamp', 'f8'), ('value', 'i4', (2,))])
+
+
+def records(start, stop):
+    out = np.zeros(stop - start, dtype=DTYPE)
+    out['timestamp'] = np.arange(start, stop) * 0.5
+    out['value'][:, 0] = np.arange(start, stop)
+    return out
+
+
+def filled(capacity, n):
+    ring = RingBuffer(DTYPE, capacity)
+    for record in records(0, n):
+        ring.append(record)
+    return ring
+
+
+def test_empty():
+    ring = RingBuffer(DTYPE, 4)
+    assert len(ring) == 0
+    assert ring.latest() is None
+    assert len(ring.last()) == 0
+    assert ring.search(1.0, 'timestamp') == 0
+
+
+def test_claim_is_invisible_until_commit():
+    ring = RingBuffer(DTYPE, 4)
+    idx = ring.claim()
+    ring.data['timestamp'][idx] = 1.0
+    ring.data['value'][idx] = (7, 8)
+    assert ring.latest() is None and len(ring) == 0
+    ring.commit()
+    assert len(ring) == 1
+    assert ring.latest()['value'].tolist() == [7, 8]
+
+
+def test_wraparound_keeps_newest_in_order():
+    ring = filled(4, 10)
+    assert len(ring) == 4
+    assert ring.last()['value'][:, 0].tolist() == [6, 7, 8, 9]
+    assert ring.last(2)['value'][:, 0].tolist() == [8, 9]
+    assert ring.latest()['value'][0] == 9
+
+
+@pytest.mark.parametrize('chunks', [[3], [2, 5], [7, 1, 9], [20]])
+def test_extend_matches_append(chunks):
+    ring = RingBuffer(DTYPE, 8)
+    start = 0
+    for n in chunks:
+        ring.extend(records(start, start + n))
+        start += n
+    expected = filled(8, start)
+    np.testing.assert_array_equal(ring.last(), expected.last())
+    assert ring.count == expected.count == start
+
+
+def test_search_and_get_use_absolute_indices():
+    ring = filled(4, 10)  # Holds records 6..9, timestamps 3.0..4.5
+    assert ring.search(3.6, 'timestamp') == 8
+    assert ring.search(3.5, 'timestamp') == 7
+    assert ring.search(3.5, 'timestamp', side='right') == 8
+    assert ring.search(0.0, 'timestamp') == 6  # Older records are gone
+    assert ring.search(100.0, 'timestamp') == 10
+    assert ring.get(7, 9)['value'][:, 0].tolist() == [7, 8]
+    # Overwritten records are skipped
+    assert ring.get(2, 8)['value'][:, 0].tolist() == [6, 7]
+    assert len(ring.get(10, 12)) == 0
+
+
+def test_reader_retries_when_lapped():
+    ring = filled(4, 4)
+    read = ring._read
+
+    def lapping_read(start, stop, field=None):
+        # The writer laps the reader once, between its copy and its check
+        ring._read = read
+        out = read(start, stop, field)
+        for record in records(4, 8):
+            ring.append(record)
+        return out
+
+    ring._read = lapping_read
+    assert ring.last()['value'][:, 0].tolist() == [4, 5, 6, 7]
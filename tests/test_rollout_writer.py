@@ -0,0 +1,64 @@
+import threading
+
+import deepdish as dd
+import numpy as np
+import pytest
+from bench_press.utils.rollout_writer import RolloutWriter
+
+
+def make_obs(i, rng):
+    return {
+        'tb_state': {'x': i, 'y': 2 * i, 'z': 3, 'force_1': 0.5 * i},
+        'images': {'external': rng.randint(0, 256, (48, 64, 3), dtype=np.uint8)},
+        'dynamixel_state': -1.5 * i,
+        'capture_time': np.float64(i),
+        'tiny': np.arange(3, dtype=np.float32),
+        'empty': np.zeros((0, 3)),
+        'maybe': None,
+        'pair': (i, 'label'),
+        'strs': ['a', 'b'],
+    }
+
+
+def assert_same(a, b):
+    assert type(a) == type(b) or isinstance(a, (np.generic, float, int)), (a, b)
+    if isinstance(a, dict):
+        assert a.keys() == b.keys()
+        for k in a:
+            assert_same(a[k], b[k])
+    elif isinstance(a, (list, tuple)):
+        assert len(a) == len(b)
+        for x, y in zip(a, b):
+            assert_same(x, y)
+    elif isinstance(a, np.ndarray):
+        assert a.dtype == b.dtype
+        np.testing.assert_array_equal(a, b)
+    else:
+        assert a == b
+
+
+@pytest.mark.parametrize('compression', ['zlib', None])
+def test_round_trip_matches_deepdish(tmpdir, compression):
+    rng = np.random.RandomState(0)
+    observations = [make_obs(i, rng) for i in range(25)]
+    path = str(tmpdir.join('record_0.h5'))
+    writer = RolloutWriter(path, flush_every=10, compression=compression)
+    for obs in observations:
+        writer.append(obs)
+    assert writer.close() == len(observations)
+
+    loaded = dd.io.load(path)
+    assert_same(loaded, observations)
+    reference = str(tmpdir.join('reference.h5'))
+    dd.io.save(reference, observations)
+    assert_same(loaded, dd.io.load(reference))
+    # Single steps, as the datasets read them
+    assert_same(dd.io.load(path, '/data/i7'), observations[7])
+
+
+def test_write_errors_surface(tmpdir):
+    writer = RolloutWriter(str(tmpdir.join('record_0.h5')))
+    writer.append({'bad': threading.Lock()})  # Cannot be pickled
+    writer.append({'x': 1})
+    with pytest.raises(Exception):
+        writer.close()
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+import torch
+from bench_press.models.datasets.samplers import FileBatchDataset, FileChunkBatchSampler
+from torch.utils.data import Dataset, Subset
+
+STEPS_PER_FILE = 20
+
+
+class FakeDataset(Dataset):
+    # Sample i is step i % STEPS_PER_FILE of file i // STEPS_PER_FILE
+
+    def __init__(self, num_files):
+        self.num_files = num_files
+
+    def __len__(self):
+        return self.num_files * STEPS_PER_FILE
+
+    def __getitem__(self, idx):
+        return {'idx': torch.tensor(idx)}
+
+    def sample_locations(self, indices):
+        return indices // STEPS_PER_FILE, indices % STEPS_PER_FILE
+
+    def get_samples(self, indices):
+        return [self[idx] for idx in indices]
+
+
+def make_subset(num_files=10, seed=0):
+    dataset = FakeDataset(num_files)
+    indices = np.random.RandomState(seed).permutation(len(dataset))[:int(0.8 * len(dataset))]
+    return Subset(dataset, indices.tolist())
+
+
+@pytest.mark.parametrize('batch_size, chunk_steps, shuffle_buffer', [(8, 4, 16), (7, 16, 32), (5, 3, 5), (32, 8, None)])
+@pytest.mark.parametrize('drop_last', [False, True])
+def test_batches_cover_subset_once(batch_size, chunk_steps, shuffle_buffer, drop_last):
+    np.random.seed(0)
+    subset = make_subset()
+    sampler = FileChunkBatchSampler(subset, batch_size, chunk_steps, shuffle_buffer, drop_last)
+    for _ in range(2):  # Every epoch
+        batches = list(sampler)
+        assert len(batches) == len(sampler)
+        sizes = [len(batch) for batch in batches]
+        assert all(size == batch_size for size in sizes[:-1])
+        positions = np.concatenate(batches)
+        if drop_last:
+            assert sizes[-1] == batch_size
+            assert len(positions) == len(subset) // batch_size * batch_size
+        else:
+            assert 0 < sizes[-1] <= batch_size
+            assert len(positions) == len(subset)
+        assert len(np.unique(positions)) == len(positions)
+        assert positions.min() >= 0 and positions.max() < len(subset)
+        assert all(batch == sorted(batch) for batch in batches)
+
+
+def test_chunks_are_consecutive_steps_of_one_file():
+    subset = make_subset()
+    sampler = FileChunkBatchSampler(subset, 8, chunk_steps=4)
+    indices = np.asarray(subset.indices)
+    assert sum(len(chunk) for chunk in sampler.chunks) == len(subset)
+    for chunk in sampler.chunks:
+        files, steps = subset.dataset.sample_locations(indices[chunk])
+        assert len(set(files)) == 1
+        assert len(set(steps // 4)) == 1
+
+
+def test_small_buffer_keeps_batches_file_local():
+    np.random.seed(0)
+    subset = make_subset(num_files=50)
+    indices = np.asarray(subset.indices)
+
+    def mean_files_per_batch(shuffle_buffer):
+        sampler = FileChunkBatchSampler(subset, 8, chunk_steps=STEPS_PER_FILE, shuffle_buffer=shuffle_buffer)
+        return np.mean([len(set(indices[batch] // STEPS_PER_FILE)) for batch in sampler])
+
+    assert mean_files_per_batch(8) < 2
+    assert mean_files_per_batch(None) > 6  # Uniform shuffle
+
+
+def test_file_batch_dataset_returns_subset_samples():
+    subset = make_subset()
+    batch = FileBatchDataset(subset)[[3, 1, 4]]
+    assert batch['idx'].tolist() == [subset.indices[p] for p in (3, 1, 4)]
@@ -0,0 +1,59 @@
+from bench_press.tb_control.telemetry import decode_frames, encode_frame
+from bench_press.tb_control.testbench_control import SerialReaderThread
+
+
+def make_reader():
+    lines, frames = [], []
+    reader = SerialReaderThread(None, lines.append, lambda buf: frames.extend(decode_frames(buf, 0.0)))
+    return reader, lines, frames
+
+
+def frame(x):
+    return encode_frame(x, x, 2 * x, 3 * x, [0.5, 1.0, 1.5, 2.0])
+
+
+def test_lines_split_across_chunks():
+    reader, lines, _ = make_reader()
+    for chunk in (b'Starting test', b'bench...\r\nx10y20', b'z0\nReady\n', b'Rea'):
+        reader.feed(chunk)
+    assert lines == ['Starting testbench...', 'x10y20z0', 'Ready']
+    reader.feed(b'dy\n')
+    assert lines[-1] == 'Ready'
+
+
+def test_frames_between_and_inside_lines():
+    reader, lines, frames = make_reader()
+    data = b'Rea' + frame(1) + b'dy\n' + frame(2) + frame(3) + b'X: 1 Y: 2\n'
+    # Byte by byte, so every split point of frames and lines is exercised
+    for i in range(len(data)):
+        reader.feed(data[i:i + 1])
+    assert lines == ['Ready', 'X: 1 Y: 2']
+    assert [int(f['x']) for f in frames] == [1, 2, 3]
+    assert reader.bad_frames == 0
+
+
+def test_frames_in_one_read_are_batched():
+    calls = []
+    reader = SerialReaderThread(None, lambda line: None, calls.append)
+    reader.feed(frame(1) + frame(2) + b'Ready\n' + frame(3))
+    assert len(calls) == 1 and len(calls[0]) == 3 * len(frame(1))
+
+
+def test_resync_after_corrupt_frame():
+    reader, lines, frames = make_reader()
+    corrupt = bytearray(frame(2))
+    corrupt[10] ^= 0xFF
+    reader.feed(frame(1) + bytes(corrupt) + frame(3) + b'Ready\n')
+    assert [int(f['x']) for f in frames] == [1, 3]
+    assert lines == ['Ready']
+    assert reader.bad_frames == 1
+
+
+def test_resync_after_truncated_frame():
+    reader, lines, frames = make_reader()
+    # A frame that lost its second magic byte and everything after the position
+    truncated = frame(2)[:1] + frame(2)[2:14]
+    reader.feed(b'Ready\n' + truncated + frame(3) + frame(4) + b'Ready\n')
+    assert [int(f['x']) for f in frames] == [3, 4]
+    assert lines[0] == 'Ready' and lines[-1].endswith('Ready')
+    assert reader.bad_frames >= 1
@@ -0,0 +1,20 @@
+import subprocess
+import sys
+import time
+
+from bench_press.run.env.sim_tb_env import SimCamera
+
+
+def test_import_needs_no_hardware_drivers():
+    # Run in a fresh interpreter, other tests may have imported these already
+    code = ('import sys, bench_press.run.env.sim_tb_env; '
+            'print(sorted(m for m in ("cv2", "dynamixel_sdk", "src.optoforce.optoforce") if m in sys.modules))')
+    assert subprocess.check_output([sys.executable, '-c', code]).decode().strip() == '[]'
+
+
+def test_sim_camera_supports_image_alignment():
+    camera = SimCamera('external', 48, 64, thread_rate=30)
+    t = time.monotonic()
+    assert camera.latest_after(t, timeout=2.0 / camera.thread_rate).timestamp >= t
+    frame = camera.frame_at(t)
+    assert frame.timestamp == t and frame.image.shape == (48, 64, 3)
@@ -0,0 +1,62 @@
+import pickle
+
+import numpy as np
+import pytest
+from bench_press.models.datasets.filter_fns import ColumnFilter, InsertFilter
+from bench_press.models.datasets.tb_dataset_subset import TBDatasetSubset
+from bench_press.utils.columnar import write_columnar
+from omegaconf import OmegaConf
+
+
+class LegacyInsertFilter:
+    # InsertFilter as it was before ColumnFilter: called on every normalized data point
+    def __call__(self, datapoint, conf):
+        state = datapoint['state'] * np.array(conf.norms.state.std) + np.array(conf.norms.state.mean)
+        return bool(state[0] <= 5000 and state[2] < 500)
+
+
+@pytest.fixture
+def conf(tmpdir):
+    data = tmpdir.mkdir('data')
+    rollouts = data.mkdir('run')  # Datasets glob <folder>**/*.h5, one level down
+    rng = np.random.RandomState(0)
+    for r in range(3):
+        # x and z cross the filter's thresholds without landing on them
+        write_columnar(str(rollouts.join(f'record_{r}.h5')), [{
+            'tb_state': {'x': 4500 + 130 * i + 40 * r, 'y': 100 * i, 'z': 420 + 17 * i, 'force_1': 0.0,
+                         'force_2': 0.0, 'force_3': 0.0, 'force_4': 0.0},
+            'images': {'external': rng.randint(0, 256, (4, 4, 3), dtype=np.uint8)},
+            'dynamixel_state': -1.0 * i,
+        } for i in range(8)])
+    # Subsets are filtered before the dataset computes its norms, so legacy filters relied on configured ones
+    norms = {'state': {'mean': [4000.0, 300.0, 400.0, -3.0], 'std': [500.0, 200.0, 50.0, 2.0]},
+             'label': {'mean': [0.0] * 4, 'std': [1.0] * 4}}
+    return OmegaConf.create({'folders': [str(data) + '/'], 'index_dir': str(tmpdir.join('index')),
+                             'save_inds_to': str(tmpdir.join('inds.pkl')), 'norms': norms})
+
+
+def test_column_filter_keeps_the_samples_of_the_legacy_filter(conf):
+    column = TBDatasetSubset(conf.copy(), InsertFilter)
+    legacy_conf = conf.copy()
+    legacy_conf.save_inds_to = None
+    legacy = TBDatasetSubset(legacy_conf, LegacyInsertFilter)
+    assert 0 < len(column) < column.total_length
+    assert column.subset_inds == legacy.subset_inds
+
+
+def test_legacy_filter_ignores_indices_cached_by_a_column_filter(conf):
+    column = TBDatasetSubset(conf.copy(), InsertFilter)
+    with open(conf.save_inds_to, 'rb') as f:
+        assert isinstance(pickle.load(f), dict)
+    legacy = TBDatasetSubset(conf.copy(), LegacyInsertFilter)
+    assert legacy.subset_inds == column.subset_inds
+    with open(conf.save_inds_to, 'rb') as f:
+        assert pickle.load(f) == column.subset_inds
+
+
+def test_column_filter_must_implement_call():
+    class Incomplete(ColumnFilter):
+        pass
+
+    with pytest.raises(TypeError):
+        Incomplete()
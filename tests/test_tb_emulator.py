@@ -0,0 +1,119 @@
+import time
+
+import pytest
+import serial
+from bench_press.tb_control.tb_emulator import TBEmulator
+from bench_press.tb_control import testbench_control
+
+
+@pytest.fixture
+def emulator():
+    emulator = TBEmulator(time_scale=100, seed=0).start()
+    yield emulator
+    emulator.stop()
+
+
+def read_lines(ser, num_lines, timeout=2.0):
+    lines = []
+    deadline = time.monotonic() + timeout
+    while len(lines) < num_lines and time.monotonic() < deadline:
+        line = ser.readline()
+        if line:
+            lines.append(line.decode().rstrip('\n'))
+    return lines
+
+
+def test_replies_mirror_firmware(emulator):
+    ser = serial.Serial(emulator.port_name, baudrate=250000, timeout=0.5)
+    assert read_lines(ser, 2) == ['Capabilities: stream', 'Starting testbench...']
+    replies = [
+        ('invx', ['invx']),
+        ('start', ['start', 'Initialized']),
+        ('x4000y6000z10', ['x4000y6000z10', 'Target set to 4000', 'Target set to 6000', 'Target set to 10', '1500',
+                           'Ready']),
+        ('x9000y6000z0', ['x9000y6000z0', 'Invalid target set at 9000', 'Target set to 6000', 'Target set to 0',
+                          '4294967295', 'Ready']),
+        ('r', ['r', 'Reset']),
+        ('rz', ['rz', 'Reset Z']),
+        # Not a command the firmware knows: parsed as a move to the origin
+        ('foo', ['foo', 'Target set to 0', 'Target set to 0', 'Target set to 0', 'Ready']),
+    ]
+    for cmd, expected in replies:
+        ser.write((cmd + '\n').encode())
+        assert read_lines(ser, len(expected)) == expected
+    ser.write(b'pz1000w5\n')
+    echo, pressed = read_lines(ser, 2)
+    assert echo == 'pz1000w5' and pressed.startswith('Pressed to max force ')
+    float(pressed[len('Pressed to max force '):])
+    ser.write(b'l\n')
+    echo, log = read_lines(ser, 2)
+    assert log.startswith('X: 0 Y: 0 Z: ') and log.endswith(' ')
+    assert [field for field in log.split() if field.endswith(':')] == ['X:', 'Y:', 'Z:', '1:', '2:', '3:', '4:']
+    ser.close()
+
+
+def test_testbench_against_emulator(emulator):
+    tb = testbench_control.TestBench(emulator.port_name, verbose=False)
+    try:
+        assert tb.wait_ready(timeout=2)
+        assert tb.supports('stream')
+        tb.start()
+        assert tb.wait_idle(timeout=2)
+        tb.target_pos(100, 200, 30)
+        assert tb.wait_idle(timeout=2)
+        data = tb.req_data()
+        assert (data['x'], data['y'], data['z']) == (100, 200, 30)
+        assert set(data) == {'x', 'y', 'z', 'force_1', 'force_2', 'force_3', 'force_4'}
+
+        futures = [tb.move_to_async(100 * i, 100 * i, 0) for i in range(1, 4)]
+        assert [future.result(timeout=2) for future in futures] == [(100 * i, 100 * i, 0) for i in range(1, 4)]
+
+        tb.start_stream(200)
+        deadline = time.monotonic() + 2
+        while len(tb.telemetry) < 5 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        latest = tb.latest_data()
+        assert (latest['x'], latest['y'], latest['z']) == (300, 300, 0)
+        tb.stop_stream()
+        assert tb.reader.bad_frames == 0
+    finally:
+        tb.close()
+
+
+def test_stream_refused_without_capability(emulator):
+    tb = testbench_control.TestBench(emulator.port_name, verbose=False)
+    try:
+        assert tb.wait_ready(timeout=2)
+        tb.capabilities = set()  # As announced by firmware that predates streaming
+        with pytest.raises(RuntimeError):
+            tb.start_stream(100)
+        assert not tb.streaming()
+    finally:
+        tb.close()
+
+
+def test_cancelled_waypoints_are_dropped():
+    emulator = TBEmulator(move_time=0.1, seed=0).start()
+    handled = []
+    handle_input = emulator.handle_input
+    emulator.handle_input = lambda cmd, now: handled.append(cmd) or handle_input(cmd, now)
+    tb = testbench_control.TestBench(emulator.port_name, verbose=False)
+    try:
+        assert tb.wait_ready(timeout=2)
+        first, second, third = [tb.move_to_async(i, i, 0) for i in (10, 20, 30)]
+        assert not first.cancel()  # Already sent to the testbench
+        assert second.cancel()
+        assert first.result(timeout=2) == (10, 10, 0)
+        assert third.result(timeout=2) == (30, 30, 0)
+        assert tb.reader.is_alive()
+        assert [cmd for cmd in handled if cmd.startswith('x')] == ['x10y10z0', 'x30y30z0']
+
+        # Cancelling the last queued target leaves the final position unknown
+        tb.move_to_async(40, 40, 0)
+        tb.move_to_async(50, 50, 0).cancel()
+        assert tb.wait_idle(timeout=2)
+        assert tb.commanded_pos is None
+        assert tb.reader.is_alive()
+    finally:
+        tb.close()
+        emulator.stop()
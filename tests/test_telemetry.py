@@ -0,0 +1,81 @@
+import os
+import shutil
+import subprocess
+
+import numpy as np
+import pytest
+from bench_press.tb_control.telemetry import FRAME_SIZE, TELEMETRY_DTYPE, crc16, decode_frames, encode_frame, \
+    frame_ok, record_to_dict
+
+FIRMWARE_DIR = os.path.join(os.path.dirname(__file__), os.pardir, 'firmware', 'TBControl')
+
+FRAMES = [
+    (0, 0, 0, 0, [0.0, 0.0, 0.0, 0.0]),
+    (123456789, 4000, 6000, 1200, [1.5, 2.25, 0.0, 100.0]),
+    (2 ** 32 - 1, -5, 12000, 1600, [-0.5, 1e-3, 3.14159, 7050.0]),
+]
+
+
+def test_crc16_check_value():
+    # CRC-16/CCITT-FALSE of the standard check string
+    assert crc16(b'123456789') == 0x29B1
+
+
+def test_encode_decode_round_trip():
+    buf = b''.join(encode_frame(*frame) for frame in FRAMES)
+    assert len(buf) == FRAME_SIZE * len(FRAMES)
+    records = decode_frames(buf, host_time=12.5)
+    assert records.dtype == TELEMETRY_DTYPE
+    for record, (fw_time, x, y, z, forces) in zip(records, FRAMES):
+        assert record['fw_time'] == fw_time
+        assert (record['x'], record['y'], record['z']) == (x, y, z)
+        np.testing.assert_array_equal(record['force'], np.float32(forces))
+        assert record['host_time'] == 12.5
+
+
+def test_frame_ok_rejects_corruption():
+    frame = bytearray(encode_frame(*FRAMES[1]))
+    assert frame_ok(bytes(frame))
+    for i in range(FRAME_SIZE):
+        corrupted = bytearray(frame)
+        corrupted[i] ^= 0x10
+        assert not frame_ok(bytes(corrupted))
+
+
+def test_record_to_dict_matches_req_data_keys():
+    record = decode_frames(encode_frame(*FRAMES[1]), host_time=1.0)[0]
+    assert record_to_dict(record) == {'x': 4000, 'y': 6000, 'z': 1200, 'force_1': 1.5, 'force_2': 2.25,
+                                      'force_3': 0.0, 'force_4': 100.0, 'time': 1.0}
+
+
+FIRMWARE_MAIN = r'''
+#include <stdio.h>
+#include <stdlib.h>
+#include "Telemetry.h"
+
+int main(int argc, char **argv) {
+    float forces[4];
+    for (int i = 0; i < 4; i++) {
+        forces[i] = atof(argv[5 + i]);
+    }
+    uint8_t frame[TELEMETRY_FRAME_SIZE];
+    encodeTelemetryFrame(frame, strtoul(argv[1], 0, 10), atol(argv[2]), atol(argv[3]), atol(argv[4]), forces);
+    for (int i = 0; i < TELEMETRY_FRAME_SIZE; i++) {
+        printf("%02x", frame[i]);
+    }
+    return 0;
+}
+'''
+
+
+@pytest.mark.skipif(shutil.which('g++') is None, reason='needs a C++ compiler')
+def test_firmware_encoder_matches_host(tmpdir):
+    main = tmpdir.join('main.cpp')
+    main.write(FIRMWARE_MAIN)
+    binary = str(tmpdir.join('encode'))
+    subprocess.check_call(['g++', '-I', FIRMWARE_DIR, str(main), os.path.join(FIRMWARE_DIR, 'Telemetry.cpp'),
+                           '-o', binary])
+    for fw_time, x, y, z, forces in FRAMES:
+        args = [str(v) for v in (fw_time, x, y, z)] + [repr(f) for f in forces]
+        out = subprocess.check_output([binary] + args).decode()
+        assert bytes.fromhex(out) == encode_frame(fw_time, x, y, z, np.float32(forces))
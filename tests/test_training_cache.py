@@ -0,0 +1,56 @@
+import os
+
+import numpy as np
+import pytest
+from bench_press.models.datasets.state_estimation_dataset import StateEstimationDataset
+from bench_press.models.datasets.tb_dataset import TBDataset
+from bench_press.models.datasets.tb_dataset_subset import TBDatasetSubset
+from bench_press.models.datasets.training_cache import TrainingCache
+from bench_press.utils.columnar import write_columnar
+from omegaconf import OmegaConf
+
+
+@pytest.fixture
+def conf(tmpdir):
+    data = tmpdir.mkdir('data')
+    rollouts = data.mkdir('run')  # Datasets glob <folder>**/*.h5, one level down
+    rng = np.random.RandomState(0)
+    for r in range(2):
+        write_columnar(str(rollouts.join(f'record_{r}.h5')), [{
+            # Nonlinear in i, so that no state or label column has zero variance
+            'tb_state': {'x': 100 * i + r * i ** 2, 'y': 10 * i ** 2, 'z': 5 * i + r * i, 'force_1': 0.1 * i,
+                         'force_2': 0.2 * i, 'force_3': 0.3 * i, 'force_4': 0.4 * i + r},
+            'images': {'external': rng.randint(0, 256, (4, 4, 3), dtype=np.uint8)},
+            'dynamixel_state': -1.0 * i ** 2,
+        } for i in range(8)])
+    return OmegaConf.create({'folders': [str(data) + '/'], 'index_dir': str(tmpdir.join('index')),
+                             'cache_dir': str(tmpdir.join('cache')), 'dataloader_workers': 1})
+
+
+def test_cached_samples_match_the_rollout_files(conf):
+    cached = TBDataset(conf.copy())
+    assert cached.cache is not None
+    uncached_conf = conf.copy()
+    uncached_conf.cache_dir = None
+    uncached = TBDataset(uncached_conf)
+    for idx in range(len(cached)):
+        a, b = cached[idx], uncached[idx]
+        np.testing.assert_array_equal(np.transpose(a['images'][0].numpy(), (1, 2, 0)), b['images'][0])
+        np.testing.assert_allclose(a['state'], b['state'], rtol=1e-6)
+        np.testing.assert_allclose(a['label'], b['label'], rtol=1e-6)
+
+
+def test_datasets_of_other_classes_get_their_own_cache(conf):
+    dataset = TBDataset(conf.copy())
+    subset = TBDatasetSubset(conf.copy(), None)
+    assert TrainingCache.key(dataset) != TrainingCache.key(subset)
+    assert len(os.listdir(conf.cache_dir)) == 2
+
+
+def test_state_estimation_dataset_ignores_cache_dir(conf):
+    # Its samples have no label observation, which raw_sample would unpack
+    dataset = StateEstimationDataset(conf.copy())
+    assert dataset.cache is None
+    assert not os.path.exists(conf.cache_dir)
+    assert len(dataset) == 2 * 3
+    np.testing.assert_array_equal(dataset[0]['state'], dataset[0]['label'])
@@ -0,0 +1,59 @@
+import torch
+import torch.nn.functional as F
+from bench_press.models.datasets.transforms import BatchImageTransform, _adjust_brightness, _adjust_hue, _color_jitter
+
+
+def uniform_images(values, size):
+    """
+    :return: uint8 [B, 3, *size] batch, sample i filled with values[i]
+    """
+    return torch.tensor(values, dtype=torch.uint8).view(-1, 1, 1, 1).expand(-1, 3, *size).contiguous()
+
+
+def unnormalize(transform, x):
+    return x * transform.std * 255.0 + transform.mean * 255.0
+
+
+def test_plain_samples_are_resized():
+    transform = BatchImageTransform((24, 32))
+    images = torch.randint(0, 256, (4, 3, 48, 64), dtype=torch.uint8)
+    out = unnormalize(transform, transform([images])[0])
+    expected = F.interpolate(images.float(), size=(24, 32), mode='bilinear', align_corners=False, antialias=True)
+    assert torch.allclose(out, expected, atol=1e-3)
+
+
+def test_augmented_samples_are_cropped_from_source_resolution():
+    transform = BatchImageTransform((24, 32), augment_prob=0.5)
+    images = torch.randint(0, 256, (64, 3, 48, 64), dtype=torch.uint8)
+    apply = torch.arange(64) % 2 == 0
+    out = unnormalize(transform, transform.transform(images, apply))
+    assert out.shape == (64, 3, 24, 32)
+    expected = F.interpolate(images[~apply].float(), size=(24, 32), mode='bilinear', align_corners=False,
+                             antialias=True)
+    assert torch.allclose(out[~apply], expected, atol=1e-3)
+
+    # A crop of the full source image sampled at 24x32 pixel centres reads the source
+    # pixels directly, instead of bilinearly upsampling an already resized image
+    transform.scale, transform.log_ratio, transform.ratio = (1.0, 1.0), (0.0, 0.0), (1.0, 1.0)
+    square = torch.randint(0, 256, (2, 3, 48, 48), dtype=torch.uint8)
+    transform.final_size = (24, 24)
+    out = unnormalize(transform, transform.transform(square, torch.ones(2, dtype=torch.bool)))
+    expected = (square[..., 0::2, 0::2].float() + square[..., 1::2, 0::2] + square[..., 0::2, 1::2]
+                + square[..., 1::2, 1::2]) / 4
+    assert torch.allclose(out, expected, atol=1e-3)
+
+
+def test_augmentation_keeps_uniform_images_uniform():
+    transform = BatchImageTransform((24, 32), augment_prob=1.0)
+    out = unnormalize(transform, transform([uniform_images([10, 128, 250], (48, 64))])[0])
+    assert torch.allclose(out[:, 0], torch.tensor([10.0, 128.0, 250.0]).view(-1, 1, 1), atol=1e-3)
+
+
+def test_jitter_order_is_drawn_per_sample():
+    # Brightening clips the red channel, so the two orders give different colours
+    x = torch.tensor([250.0, 40.0, 10.0]).view(1, 3, 1, 1).expand(2, 3, 4, 4).contiguous()
+    factor, shift = torch.tensor([1.5, 1.5]), torch.tensor([0.3, 0.3])
+    out = _color_jitter(x, factor, shift, torch.tensor([True, False]))
+    assert torch.allclose(out[:1], _adjust_brightness(_adjust_hue(x[:1], shift[:1]), factor[:1]))
+    assert torch.allclose(out[1:], _adjust_hue(_adjust_brightness(x[1:], factor[1:]), shift[1:]))
+    assert not torch.allclose(out[0], out[1], atol=1.0)